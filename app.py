@@ -1,11 +1,32 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, abort, jsonify
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Follows, Likes
+import assets
+import caching
+import card_cache
+import counters
+import deletion
+import follow_graph
+import ingest
+import jobs
+import likes
+import metrics
+import migrations
+import n_plus_one
+import passwords
+import replica
+import search
+import sql_timing
+import timeline
+import user_cache
+from pagination import InvalidCursor, decode_cursor, keyset_page
 
 
 CURR_USER_KEY = "curr_user"
@@ -17,13 +38,56 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 
+# an optional read replica for read-only pages; see replica.py
+if os.environ.get('DATABASE_REPLICA_URL'):
+    app.config['SQLALCHEMY_BINDS'] = {
+        replica.REPLICA_BIND: os.environ['DATABASE_REPLICA_URL']}
+
+# per-worker connection pool, applied to the primary and the replica;
+# pre-ping and recycle drop connections the server or a proxy has closed
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+}
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# bcrypt cost and hashing pool size; lower the cost in dev/test, raise it
+# in production as hardware allows
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', 2))
+
+# the shared follow graph index; build it with `flask build-follow-graph`
+app.config['FOLLOW_GRAPH_PATH'] = os.environ.get('FOLLOW_GRAPH_PATH')
+
+# bearer token that lets integrations bulk-post for any user; see ingest.py
+app.config['INGEST_ADMIN_TOKEN'] = os.environ.get('INGEST_ADMIN_TOKEN')
+app.config['INGEST_MAX_BATCH'] = int(
+    os.environ.get('INGEST_MAX_BATCH', ingest.MAX_BATCH))
+
+# requests slower than this log every statement they ran
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 500))
 toolbar = DebugToolbarExtension(app) 
 
+metrics.init_app(app)  # before connect_db, which builds the engine
 connect_db(app)
+replica.init_app(app)
+n_plus_one.init_app(app)
+sql_timing.init_app(app)
+assets.init_app(app)
+caching.init_app(app)
+card_cache.init_app(app)
+passwords.init_app(app)
+user_cache.init_app(app)
+jobs.init_app(app)
+follow_graph.init_app(app)
 
 
 ##############################################################################
@@ -34,13 +98,38 @@ connect_db(app)
 def add_user_to_g(): #this funciton adds the current logged in user to Flask's "g" object
     """If we're logged in, add curr user to Flask global."""
 
-    if CURR_USER_KEY in session:
-        g.user = db.session.get(User, session[CURR_USER_KEY])
+    if request.endpoint == 'static':
+        # static files never look at the user
+        g.user = None
+
+    elif CURR_USER_KEY in session:
+        # usually served from the per-worker cache without a DB round trip
+        g.user = user_cache.load_user(db.session, session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+def followed_ids():
+    """IDs the logged-in user follows, loaded at most once per request.
+
+    Templates that render many user cards check `user.id in followed_ids()`
+    instead of calling `g.user.is_following()` per card.
+    """
+
+    if 'followed_ids' not in g:
+        g.followed_ids = g.user.following_ids() if g.user else set()
+
+    return g.followed_ids
+
+
+@app.context_processor
+def add_follow_lookup():
+    """Make `followed_ids()` available to every template."""
+
+    return {'followed_ids': followed_ids}
+
+
 def do_login(user):
     """Log in user."""
 
@@ -101,6 +190,7 @@ def login():
                                  form.password.data)
 
         if user:
+            db.session.commit()  # saves the rehashed password, if any
             do_login(user) #adds user.id to the session, thus logging them in
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -119,44 +209,88 @@ def logout():
     flash(f"You have been successfully logged out.", "success")
     return redirect("/")
 
+##############################################################################
+# Pagination
+
+
+def get_cursor():
+    """Decode the `before` querystring token, or 400 if it's garbage."""
+
+    try:
+        return decode_cursor(request.args.get('before'))
+    except InvalidCursor:
+        abort(400)
+
+
+def follows_page(user_column, other_column, user_id):
+    """One page of the users at the other end of `user_id`'s follows,
+    most recent follow first. Returns `(users, next_cursor)`."""
+
+    query = (db.session.query(User, Follows.created_at)
+             .join(Follows, other_column == User.id)
+             .filter(user_column == user_id))
+
+    rows, next_cursor = keyset_page(
+        query, Follows.created_at, other_column, before=get_cursor(),
+        position=lambda row: (row.created_at, row.User.id))
+
+    return [row.User for row in rows], next_cursor
+
+
 ##############################################################################
 # General user routes:
 
 @app.route('/users')
+@replica.read_only
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username, and an
+    'after' token to fetch the next page.
     """
 
-    search = request.args.get('q')
+    q = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    try:
+        users, next_token = search.directory_page(
+            db.session, q=q, after=request.args.get('after'))
+    except InvalidCursor:
+        abort(400)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=users, q=q,
+                           next_token=next_token)
 
 
 @app.route('/users/<int:user_id>')
+@replica.read_only
 def users_show(user_id):
     """Show user profile."""
 
     user = User.query.get_or_404(user_id)
+    before = get_cursor()
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    
-    return render_template('users/show.html', user=user, messages=messages)
+    messages, next_cursor = keyset_page(
+        Message.query.filter(Message.user_id == user_id),
+        Message.timestamp,
+        Message.id,
+        before=before)
+
+    following = bool(g.user) and g.user.is_following(user)
+
+    etag_parts = ('users_show', g.user and (g.user.id, g.user.version),
+                  user.id, user.version, user.messages_count,
+                  user.following_count, user.followers_count,
+                  user.likes_count, following, next_cursor,
+                  [msg.id for msg in messages])
+    return caching.render_with_etag('users/show.html', etag_parts,
+                                    user=user, messages=messages,
+                                    following=following,
+                                    next_cursor=next_cursor)
 
 @app.route('/users/<int:user_id>/following')
+@replica.read_only
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -165,9 +299,13 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    users, next_cursor = follows_page(Follows.user_following_id,
+                                      Follows.user_being_followed_id, user_id)
+    return render_template('users/following.html', user=user, users=users,
+                           next_cursor=next_cursor)
 
 @app.route("/users/<int:user_id>/likes")
+@replica.read_only
 def users_likes(user_id):
     """Show a list of messages that the user has liked"""
     
@@ -176,9 +314,24 @@ def users_likes(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user)
+
+    # most recently liked first; authors are joined in up front, as the
+    # template shows one per message
+    query = (db.session.query(Message, Likes.created_at)
+             .join(Likes, Likes.message_id == Message.id)
+             .filter(Likes.user_id == user_id)
+             .options(joinedload(Message.user)))
+
+    rows, next_cursor = keyset_page(
+        query, Likes.created_at, Likes.message_id, before=get_cursor(),
+        position=lambda row: (row.created_at, row.Message.id))
+
+    return render_template('users/likes.html', user=user,
+                           messages=[row.Message for row in rows],
+                           next_cursor=next_cursor)
 
 @app.route('/users/<int:user_id>/followers')
+@replica.read_only
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -187,7 +340,10 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    users, next_cursor = follows_page(Follows.user_being_followed_id,
+                                      Follows.user_following_id, user_id)
+    return render_template('users/followers.html', user=user, users=users,
+                           next_cursor=next_cursor)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -200,6 +356,8 @@ def add_follow(follow_id):
 
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
+    db.session.flush()
+    timeline.add_follow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -210,16 +368,12 @@ def add_like(msg_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    user_id = g.user.id
-    existing_like = Likes.query.filter(Likes.user_id==user_id, Likes.message_id==msg_id).first()
-
-    if existing_like:    
-        db.session.delete(existing_like)
-        db.session.commit()
-    else:
-        like = Likes(user_id = user_id, message_id = msg_id)
-        db.session.add(like)
-        db.session.commit()
+    # the form says which state it wants, so a double click can't undo
+    # itself; without it we toggle
+    liked = request.form.get('like')
+    likes.set_liked(g.user.id, msg_id,
+                    None if liked is None else liked == '1')
+    db.session.commit()
 
     return redirect("/")
 
@@ -233,6 +387,7 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    timeline.remove_follow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -290,8 +445,10 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # hidden right away; their rows are deleted in the background
+    deletion.tombstone(g.user)
     db.session.commit()
+    jobs.runner.submit(deletion.purge_user, g.user.id)
 
     return redirect("/signup")
 
@@ -315,6 +472,8 @@ def messages_add():
     if form.is_submitted and form.validate():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        timeline.fan_out_message(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -322,7 +481,35 @@ def messages_add():
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/api/messages/bulk', methods=["POST"])
+def messages_bulk_add():
+    """Post a JSON batch of messages; see ingest.py.
+
+    Returns the new message IDs, in the order they were given.
+    """
+
+    admin = ingest.is_admin(request.headers.get('Authorization'),
+                            app.config['INGEST_ADMIN_TOKEN'])
+    if not g.user and not admin:
+        return jsonify(errors=[{'index': None,
+                                'error': "Access unauthorized."}]), 401
+
+    try:
+        rows = ingest.validate(request.get_json(silent=True),
+                               user_id=g.user and g.user.id,
+                               admin=admin,
+                               max_batch=app.config['INGEST_MAX_BATCH'])
+    except ingest.IngestError as exc:
+        return jsonify(errors=exc.errors), 400
+
+    ids = ingest.ingest(rows)
+    db.session.commit()
+
+    return jsonify(ids=ids), 201
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@replica.read_only
 def messages_show(message_id):
     """Show a message."""
    
@@ -341,6 +528,7 @@ def messages_destroy(message_id):
         flash("Access unauthorized", "danger")
         return redirect("/")
     
+    timeline.remove_message(msg.id)
     db.session.delete(msg)
     db.session.commit()
 
@@ -352,6 +540,7 @@ def messages_destroy(message_id):
 
 
 @app.route('/')
+@replica.read_only
 def homepage():
     """Show homepage:
 
@@ -360,37 +549,136 @@ def homepage():
     """
     
     if g.user:
-        followed_users_ids = [user.id for user in g.user.following]  # IDs of users being followed
-        followed_users_ids.append(g.user.id)  #Include the user's own messages
-
-        messages = (Message.query
-                            .filter(Message.user_id.in_(followed_users_ids))
-                            .order_by(Message.timestamp.desc())
-                            .limit(100)
-                            .all())
-        
-        liked_message_ids = Likes.query.with_entities(Likes.message_id).filter(Likes.user_id == g.user.id).all()
-        likes = [like[0] for like in liked_message_ids]
-        print(f"likes: {likes}")
-        return render_template('home.html', messages=messages, likes=likes)
+        # read from the precomputed timeline rather than scanning `messages`
+        messages, next_cursor = timeline.home_messages(g.user.id,
+                                                       before=get_cursor())
+
+        # only the liked state of the messages on this page
+        liked = likes.liked_ids(g.user.id, [msg.id for msg in messages])
+
+        # precomputed by `flask suggest-follows`
+        suggested = g.user.suggested_follows()
+
+        # everything the page shows, as IDs and version stamps
+        etag_parts = ('home', g.user.id, g.user.version,
+                      g.user.messages_count, g.user.following_count,
+                      g.user.followers_count, next_cursor,
+                      [(msg.id, msg.user.id, msg.user.version)
+                       for msg in messages],
+                      sorted(liked),
+                      [(user.id, user.version) for user in suggested])
+        return caching.render_with_etag('home.html', etag_parts,
+                                        messages=messages, likes=liked,
+                                        suggested=suggested,
+                                        next_cursor=next_cursor)
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# CLI commands
+
+
+@app.cli.command('rebuild-timelines')
+@click.option('--user-id', type=int, default=None,
+              help="Only rebuild this user's timeline.")
+def rebuild_timelines(user_id):
+    """Recompute home timelines for cold or corrupted users."""
+
+    if user_id is None:
+        user_ids = db.session.scalars(
+            db.select(User.id).order_by(User.id)).all()
+    else:
+        user_ids = [user_id]
+
+    rebuilt = timeline.rebuild_blocks(user_ids)
+
+    click.echo(f"Rebuilt {rebuilt} timeline(s).")
+
+
+@app.cli.command('trim-timelines')
+def trim_timelines():
+    """Trim home timelines that have grown past their length limit."""
+
+    trimmed = timeline.trim()
+
+    click.echo(f"Trimmed {trimmed} timeline(s).")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recount every user's message/follow/like counters."""
+
+    fixed = counters.reconcile()
+    db.session.commit()
+
+    click.echo(f"Repaired counters for {fixed} user(s).")
+
+
+@app.cli.command('purge-deleted-users')
+def purge_deleted_users():
+    """Finish deleting accounts whose background purge didn't complete."""
+
+    purged = deletion.purge_pending()
+
+    click.echo(f"Purged {purged} deleted user(s).")
+
+
+@app.cli.command('build-follow-graph')
+def build_follow_graph():
+    """Rebuild the shared follow graph index, folding in its delta log."""
+
+    path = app.config['FOLLOW_GRAPH_PATH']
+    if not path:
+        raise click.UsageError("Set FOLLOW_GRAPH_PATH first.")
+
+    edges = follow_graph.build(db.engine, path)
+
+    click.echo(f"Indexed {edges} follow(s) in {path}.")
+
+
+@app.cli.command('suggest-follows')
+@click.option('--per-user', type=int, default=10,
+              help="Suggestions to keep for each user.")
+def suggest_follows(per_user):
+    """Recompute friends-of-friends follow suggestions for every user."""
+
+    # NumPy and SciPy are only needed here; keep them out of web workers
+    import suggestions
+
+    written = suggestions.build(per_user, progress=click.echo)
+
+    click.echo(f"Wrote {written} suggestion(s).")
+
+
+@app.cli.command('db-upgrade')
+@click.option('--to', 'target', type=int, default=None,
+              help="Stop after this migration version.")
+def db_upgrade(target):
+    """Apply pending schema migrations."""
+
+    applied = migrations.upgrade(db.engine, target, progress=click.echo)
+
+    click.echo(f"Applied {len(applied)} migration(s).")
+
+
+@app.cli.command('db-status')
+def db_status():
+    """List applied and pending schema migrations."""
+
+    done = migrations.applied_versions(db.engine)
+    for migration in migrations.MIGRATIONS:
+        state = "applied" if migration.version in done else "pending"
+        click.echo(f"{migration.version:04d} {state:<8} "
+                   f"{migration.description}")
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and precompress static files into static/build/."""
+
+    manifest = assets.build(app.static_folder)
+    assets.load_manifest(app)
+
+    click.echo(f"Built {len(manifest)} asset(s).")
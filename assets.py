@@ -0,0 +1,167 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies every file under static/ to static/build/ with
+a content hash in its name (style.css -> style.3f9c2a1b7d0e.css). It also
+writes gzip and, if the `brotli` package is installed, brotli copies of the
+text formats next to it, plus a manifest.json mapping original names to
+hashed ones. Stylesheets have their `url(/static/...)` references rewritten
+to the hashed names before they are hashed themselves.
+
+Once the manifest exists, `url_for('static', filename='stylesheets/style.css')`
+and `static_url()` return the hashed URL. Hashed files never change, so
+they are cached as immutable, and the static view serves the .br or .gz
+copy when the client's Accept-Encoding allows it. Nothing is compressed
+while a request is being handled. Without a build, URLs fall back to the
+original files.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+
+# worth compressing; images are already compressed
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.txt', '.json', '.html'}
+
+# preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+CSS_URL = re.compile(r"""url\((["']?)/static/([^"')]+)\1\)""")
+
+
+def _hashed_name(filename, content):
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+def _sources(static_folder):
+    """Paths under `static_folder` to fingerprint, stylesheets last."""
+
+    found = []
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [d for d in dirs if d != BUILD_DIR]
+        for name in files:
+            found.append(os.path.relpath(os.path.join(root, name),
+                                         static_folder).replace(os.sep, '/'))
+
+    # stylesheets point at other files, so they go after them
+    return sorted(found, key=lambda name: (name.endswith('.css'), name))
+
+
+def _write_variants(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+    if os.path.splitext(path)[1] not in COMPRESSIBLE:
+        return
+
+    compressed = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed['.br'] = brotli.compress(content)
+
+    for suffix, data in compressed.items():
+        # a variant that isn't smaller isn't worth serving
+        if len(data) < len(content):
+            with open(path + suffix, 'wb') as f:
+                f.write(data)
+
+
+def build(static_folder):
+    """Fingerprint and precompress `static_folder`; return the manifest."""
+
+    out = os.path.join(static_folder, BUILD_DIR)
+    shutil.rmtree(out, ignore_errors=True)
+
+    manifest = {}
+    for filename in _sources(static_folder):
+        with open(os.path.join(static_folder, filename), 'rb') as f:
+            content = f.read()
+
+        if filename.endswith('.css'):
+            content = CSS_URL.sub(
+                lambda m: f'url({m.group(1)}/static/'
+                          f'{manifest.get(m.group(2), m.group(2))}{m.group(1)})',
+                content.decode()).encode()
+
+        hashed = f"{BUILD_DIR}/{_hashed_name(filename, content)}"
+        os.makedirs(os.path.dirname(os.path.join(static_folder, hashed)),
+                    exist_ok=True)
+        _write_variants(os.path.join(static_folder, hashed), content)
+        manifest[filename] = hashed
+
+    with open(os.path.join(out, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def load_manifest(app):
+    """Read the build manifest into `app`, or clear it if there's none."""
+
+    path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST)
+    try:
+        with open(path) as f:
+            app.extensions['assets'] = json.load(f)
+    except FileNotFoundError:
+        app.extensions['assets'] = {}
+
+
+def is_fingerprinted(filename):
+    # the manifest lives in the build but is rewritten by every build
+    return (filename.startswith(BUILD_DIR + '/')
+            and filename != f"{BUILD_DIR}/{MANIFEST}")
+
+
+def _fingerprint_url(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        manifest = current_app.extensions['assets']
+        values['filename'] = manifest.get(values['filename'],
+                                          values['filename'])
+
+
+def serve_static(filename):
+    """The static view, serving a precompressed copy when one fits."""
+
+    static_folder = current_app.static_folder
+
+    if is_fingerprinted(filename):
+        for encoding, suffix in ENCODINGS:
+            variant = safe_join(static_folder, filename + suffix)
+            if (request.accept_encodings[encoding] and variant
+                    and os.path.isfile(variant)):
+                response = send_from_directory(static_folder,
+                                               filename + suffix)
+                # the type of the original file, not of the archive
+                response.mimetype = (mimetypes.guess_type(filename)[0]
+                                     or 'application/octet-stream')
+                response.content_encoding = encoding
+                response.vary.add('Accept-Encoding')
+                return response
+
+    response = send_from_directory(static_folder, filename)
+    if is_fingerprinted(filename):
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Serve fingerprinted assets and point static URLs at them."""
+
+    load_manifest(app)
+    app.url_defaults(_fingerprint_url)
+    app.view_functions['static'] = serve_static
@@ -0,0 +1,128 @@
+"""Measure message ingest throughput, one at a time versus in bulk.
+
+Creates a few throwaway users who follow each other, plus a crowd of
+`--followers` users who all follow the first POPULAR of them, then posts
+messages through the Flask test client for a fixed time: once through
+`/messages/new` (as a popular user), once per batch size through
+`/api/messages/bulk`. Results are in messages per second, not requests per
+second. Fan-out doesn't trim timelines, so the `flask trim-timelines` pass
+that catches up afterwards is timed too. Run from the repo root against a
+scratch database, because it creates and drops tables:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.ingest_throughput --seconds 10 --batch 100 1000 \\
+            --followers 2000
+"""
+
+import argparse
+import time
+
+from sqlalchemy import insert
+
+from app import app, CURR_USER_KEY
+from models import db, Follows, User
+import timeline
+
+TOKEN = "bench-ingest-token"
+USERS = 20
+POPULAR = 2
+
+
+def run_single(seconds):
+    """Post through the form, one request per message; return messages/sec."""
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = 1
+
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        resp = client.post("/messages/new", data={'text': f"single {done}"})
+        assert resp.status_code == 302, resp.status_code
+        done += 1
+
+    return done / (time.perf_counter() - start)
+
+
+def run_bulk(seconds, batch):
+    """Post batches for many users with the admin token; return messages/sec."""
+
+    client = app.test_client()
+    headers = {'Authorization': f"Bearer {TOKEN}"}
+
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        messages = [{'text': f"bulk {done + n}", 'user_id': n % USERS + 1}
+                    for n in range(batch)]
+        resp = client.post("/api/messages/bulk", json={'messages': messages},
+                           headers=headers)
+        assert resp.status_code == 201, resp.status_code
+        done += batch
+
+    return done / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--batch", type=int, nargs='+', default=[100, 1000])
+    parser.add_argument("--followers", type=int, default=2000,
+                        help="Followers of each popular user.")
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['INGEST_ADMIN_TOKEN'] = TOKEN
+    app.config['INGEST_MAX_BATCH'] = max(args.batch)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([User(id=uid, username=f"bench{uid}",
+                                 email=f"bench{uid}@example.com",
+                                 password="HASHED_PASSWORD")
+                            for uid in range(1, USERS + 1)])
+        db.session.flush()
+        # everyone follows the next five users, so posts fan out
+        db.session.add_all([Follows(user_following_id=uid,
+                                    user_being_followed_id=(uid + n) % USERS + 1)
+                            for uid in range(1, USERS + 1)
+                            for n in range(5)])
+
+        db.session.commit()
+
+        # the crowd, written in bulk
+        crowd = range(USERS + 1, USERS + args.followers + 1)
+        if crowd:
+            db.session.execute(insert(User), [
+                {'id': uid, 'username': f"bench{uid}",
+                 'email': f"bench{uid}@example.com",
+                 'password': "HASHED_PASSWORD"}
+                for uid in crowd])
+            db.session.execute(insert(Follows), [
+                {'user_following_id': uid, 'user_being_followed_id': popular}
+                for uid in crowd
+                for popular in range(1, POPULAR + 1)])
+            db.session.commit()
+
+    single = run_single(args.seconds)
+    print(f"{'single':>12}: {single:10.1f} messages/sec")
+
+    for batch in args.batch:
+        rate = run_bulk(args.seconds, batch)
+        print(f"{f'bulk x{batch}':>12}: {rate:10.1f} messages/sec "
+              f"({rate / single:.1f}x)")
+
+    with app.app_context():
+        start = time.perf_counter()
+        trimmed = timeline.trim()
+        print(f"{'trim':>12}: {trimmed} timeline(s) in "
+              f"{time.perf_counter() - start:.2f}s")
+
+    with app.app_context():
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
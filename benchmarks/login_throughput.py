@@ -0,0 +1,84 @@
+"""Measure /login throughput with the password hashing pool on and off.
+
+Creates a throwaway user, then has several client threads POST /login
+through the Flask test client for a fixed time, once with hashing inline and
+once through the process pool. Run from the repo root against a scratch
+database, because it creates and drops tables:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.login_throughput --threads 8 --seconds 10
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app
+from models import db, User
+import passwords
+
+USERNAME = "bench-login"
+PASSWORD = "bench-password"
+
+
+def run_clients(threads, seconds):
+    """Log in from `threads` clients for `seconds`; return logins/sec."""
+
+    deadline = time.perf_counter() + seconds
+
+    def client_loop():
+        client = app.test_client()
+        done = 0
+        while time.perf_counter() < deadline:
+            resp = client.post("/login", data={"username": USERNAME,
+                                               "password": PASSWORD})
+            assert resp.status_code == 302, resp.status_code
+            done += 1
+        return done
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        total = sum(pool.map(lambda _: client_loop(), range(threads)))
+    elapsed = time.perf_counter() - start
+
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=4,
+                        help="pool size for the pooled run")
+    parser.add_argument("--rounds", type=int,
+                        default=app.config['BCRYPT_LOG_ROUNDS'])
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        passwords.init_app(app)
+        User.signup(USERNAME, "bench@example.com", PASSWORD, None)
+        db.session.commit()
+
+    results = {}
+    for label, workers in (("inline", 0), ("pool", args.workers)):
+        app.config['PASSWORD_HASH_WORKERS'] = workers
+        passwords.init_app(app)
+        results[label] = run_clients(args.threads, args.seconds)
+        print(f"{label:>6}: {results[label]:8.1f} logins/sec "
+              f"({args.threads} threads, cost {args.rounds}, "
+              f"{workers} hash workers)")
+
+    passwords.hasher.shutdown()
+    print(f"speedup: {results['pool'] / results['inline']:.2f}x")
+
+    with app.app_context():
+        db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Benchmark Warbler's read routes against seeded datasets.
+
+For each scale the database is reseeded from the offline generator, then the
+Flask test client requests every route in `ROUTES` as a logged-in user. For
+each route we report p50/p99 latency plus the SQL statements run and rows
+fetched per request, and optionally write everything as JSON so a later run
+can be compared against it. Run from the repo root against a scratch
+database, because seeding drops and recreates the tables:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.routes --scale small medium \\
+        --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from statistics import mean
+
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
+
+from app import app, CURR_USER_KEY
+from loader import load_snapshot
+from models import db, User
+
+SCALES = {
+    'small': dict(users=100, messages=1_000, follows=1_000),
+    'medium': dict(users=5_000, messages=100_000, follows=100_000),
+    'large': dict(users=50_000, messages=1_000_000, follows=1_000_000),
+}
+
+# a word from the generator's vocabulary, so searches have matches
+SEARCH_QUERY = "sun"
+
+ROUTES = [
+    ('homepage', lambda t: "/"),
+    ('users_show', lambda t: f"/users/{t['author']}"),
+    ('users_followers', lambda t: f"/users/{t['celebrity']}/followers"),
+    ('list_users', lambda t: f"/users?q={SEARCH_QUERY}"),
+]
+
+
+class SQLTally:
+    """Count statements and fetched rows while `active`."""
+
+    def __init__(self):
+        self.active = False
+        self.reset()
+
+    def reset(self):
+        self.statements = 0
+        self.rows = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context,
+                 executemany):
+        if self.active:
+            self.statements += 1
+            if cursor.description is not None:
+                self.rows += max(cursor.rowcount, 0)
+
+
+tally = SQLTally()
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of `samples`."""
+
+    ordered = sorted(samples)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def seed(scale, seed_value):
+    """Generate and load the dataset for `scale`."""
+
+    sizes = SCALES[scale]
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run(
+            [sys.executable, "generator/create_csvs.py",
+             "--users", str(sizes['users']),
+             "--messages", str(sizes['messages']),
+             "--follows", str(sizes['follows']),
+             "--seed", str(seed_value), "--out", directory],
+            check=True)
+        with app.app_context():
+            load_snapshot(directory, progress=lambda line: None)
+
+
+def pick_targets():
+    """The users whose pages are the heaviest to render."""
+
+    with app.app_context():
+        def busiest(column):
+            return db.session.scalar(
+                select(User.id).order_by(column.desc(), User.id).limit(1))
+
+        return {'viewer': busiest(User.following_count),
+                'author': busiest(User.messages_count),
+                'celebrity': busiest(User.followers_count)}
+
+
+def bench_route(client, path, requests, warmup):
+    """Time `requests` GETs of `path` after `warmup` untimed ones."""
+
+    for _ in range(warmup):
+        client.get(path)
+
+    latencies = []
+    statements = []
+    rows = []
+    for _ in range(requests):
+        tally.reset()
+        tally.active = True
+        start = time.perf_counter()
+        resp = client.get(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+        tally.active = False
+
+        assert resp.status_code == 200, (path, resp.status_code)
+        statements.append(tally.statements)
+        rows.append(tally.rows)
+
+    return {'requests': requests,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(mean(latencies), 3),
+            'statements': round(mean(statements), 2),
+            'rows': round(mean(rows), 2)}
+
+
+def run_scale(scale, requests, warmup):
+    targets = pick_targets()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = targets['viewer']
+
+    results = []
+    for route, make_path in ROUTES:
+        path = make_path(targets)
+        result = bench_route(client, path, requests, warmup)
+        results.append(dict(scale=scale, route=route, path=path, **result))
+        print(f"{scale:>6} {route:<16} p50 {result['p50_ms']:8.2f} ms  "
+              f"p99 {result['p99_ms']:8.2f} ms  "
+              f"{result['statements']:6.1f} stmts  "
+              f"{result['rows']:8.1f} rows")
+
+    return results
+
+
+def compare(results, baseline_path):
+    """Print how each route moved against an earlier run's JSON."""
+
+    with open(baseline_path) as f:
+        baseline = {(r['scale'], r['route']): r for r in json.load(f)['results']}
+
+    print(f"\nchange against {baseline_path}:")
+    for result in results:
+        old = baseline.get((result['scale'], result['route']))
+        if old is None:
+            continue
+        changes = "  ".join(
+            f"{key} {(result[key] - old[key]) / old[key] * 100:+6.1f}%"
+            if old[key] else f"{key} {result[key] - old[key]:+g}"
+            for key in ('p50_ms', 'p99_ms', 'statements', 'rows'))
+        print(f"{result['scale']:>6} {result['route']:<16} {changes}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", nargs="+", choices=SCALES,
+                        default=['small'])
+    parser.add_argument("--requests", type=int, default=100,
+                        help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-seed", action="store_true",
+                        help="benchmark the data already loaded")
+    parser.add_argument("--output", help="write results as JSON here")
+    parser.add_argument("--compare", help="JSON from an earlier run")
+    args = parser.parse_args()
+
+    event.listen(Engine, 'after_cursor_execute', tally)
+
+    results = []
+    for scale in args.scale:
+        if not args.no_seed:
+            print(f"seeding {scale}: {SCALES[scale]}")
+            seed(scale, args.seed)
+        results.extend(run_scale(scale, args.requests, args.warmup))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'meta': {'commit': git_commit(),
+                                'run_at': datetime.now(timezone.utc).isoformat(),
+                                'python': platform.python_version(),
+                                'database': os.environ.get('DATABASE_URL'),
+                                'seed': args.seed},
+                       'results': results}, f, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
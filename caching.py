@@ -0,0 +1,143 @@
+"""HTTP caching policy for Warbler responses.
+
+- Static files requested through `static_url()` carry a content hash in
+  their name or URL (see assets.py), so they are cached for a year as
+  immutable. Unversioned static URLs are revalidated, which Flask answers
+  with 304 from the file's ETag/Last-Modified.
+- Per-user pages rendered with `render_with_etag()` get a private ETag built
+  from cheap version stamps (IDs, profile versions, counters) of what the
+  page shows. A request whose If-None-Match matches gets 304 Not Modified
+  without the template being rendered.
+- Everything else (forms, redirects, other pages) is `no-store`.
+"""
+
+import hashlib
+import os
+
+from flask import (current_app, make_response, render_template, request,
+                   session, url_for)
+from werkzeug.security import safe_join
+
+import assets
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+_static_hashes = {}
+
+
+def _file_hash(filename):
+    """Content hash of a file under static/, or None if there's no such file.
+
+    Cached until the file's mtime changes.
+    """
+
+    path = safe_join(current_app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except (TypeError, OSError):
+        return None
+
+    cached = _static_hashes.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+        _static_hashes[path] = cached
+
+    return cached[1]
+
+
+def static_url(filename):
+    """URL of a static file that is safe to cache for good.
+
+    The fingerprinted copy from `flask build-assets` when there is one,
+    else the original with a content hash in the query string.
+    """
+
+    if filename in current_app.extensions['assets']:
+        return url_for('static', filename=filename)
+
+    url = f"{current_app.static_url_path}/{filename}"
+    digest = _file_hash(filename)
+    return f"{url}?v={digest}" if digest else url
+
+
+def asset_url(url):
+    """Fingerprint a stored URL (e.g. the default avatar) that points at one
+    of our static files; leave any other URL alone."""
+
+    prefix = current_app.static_url_path + '/'
+    if not url or not url.startswith(prefix):
+        return url
+
+    filename = url[len(prefix):]
+    if (filename in current_app.extensions['assets']
+            or _file_hash(filename) is not None):
+        return static_url(filename)
+
+    return url
+
+
+def _templates_version(app):
+    """Hash of every template, so a deploy that changes markup busts ETags."""
+
+    digest = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(app.template_folder)):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(name.encode() + f.read())
+
+    return digest.hexdigest()[:16]
+
+
+def make_etag(*parts):
+    """ETag for a page showing `parts` (anything with a stable repr)."""
+
+    stamp = repr((current_app.config['ETAG_SALT'],) + parts).encode()
+    return hashlib.sha256(stamp).hexdigest()[:32]
+
+
+def render_with_etag(template, etag_parts, **context):
+    """Render `template`, or answer 304 if the client has this version."""
+
+    # pending flash messages are shown (and consumed) by the render
+    if session.get('_flashes'):
+        return render_template(template, **context)
+
+    etag = make_etag(*etag_parts)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render_template(template, **context))
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def _apply_policy(response):
+    if request.endpoint == 'static':
+        filename = (request.view_args or {}).get('filename', '')
+        # only a `v` naming the file's current content is safe to keep
+        if (assets.is_fingerprinted(filename)
+                or ('v' in request.args
+                    and request.args['v'] == _file_hash(filename))):
+            response.headers['Cache-Control'] = (
+                f"public, max-age={STATIC_MAX_AGE}, immutable")
+        else:
+            response.headers['Cache-Control'] = 'public, no-cache'
+
+    elif 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = 'no-store'
+
+    return response
+
+
+def init_app(app):
+    """Apply the caching policy to every response `app` sends."""
+
+    app.config.setdefault('ETAG_SALT', _templates_version(app))
+    app.jinja_env.globals['static_url'] = static_url
+    app.jinja_env.filters['asset_url'] = asset_url
+    app.after_request(_apply_policy)
@@ -0,0 +1,156 @@
+"""Per-worker cache of rendered message cards.
+
+The avatar, username, date and text of a message card look the same to
+every viewer and almost never change, yet list pages rendered all of them
+through Jinja on every request. `message_card(msg)`, available in every
+template, renders messages/card.html once and then serves the HTML from an
+LRU capped at `CARD_CACHE_MAX_BYTES`.
+
+Cards are keyed by message ID plus the author's ID and profile version, so
+a profile edit picks up new HTML even in workers that never saw the edit.
+Entries are also dropped eagerly when the ORM deletes a message or changes
+or deletes its author (`messages_destroy()`, `profile()`, `delete_user()`),
+and everything goes when the messages table is dropped. Viewer-specific
+parts of a card, like the like button, stay outside it in the page.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app
+from markupsafe import Markup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import PROFILE_COLUMNS, Message, User
+
+CARD_TEMPLATE = 'messages/card.html'
+
+
+class CardCache:
+    """Thread-safe LRU of rendered HTML, capped by total size in bytes."""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # message and author IDs -> their keys, for invalidation
+        self._by_message = {}
+        self._by_author = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        nbytes = len(html.encode())
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = html
+            self.size += nbytes
+            message_id, author_id, _ = key
+            self._by_message.setdefault(message_id, set()).add(key)
+            self._by_author.setdefault(author_id, set()).add(key)
+
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        html = self._entries.pop(key, None)
+        if html is None:
+            return
+
+        self.size -= len(html.encode())
+        message_id, author_id, _ = key
+        for index, owner in ((self._by_message, message_id),
+                             (self._by_author, author_id)):
+            keys = index.get(owner)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[owner]
+
+    def invalidate_message(self, message_id):
+        with self._lock:
+            for key in list(self._by_message.get(message_id, ())):
+                self._remove(key)
+
+    def invalidate_author(self, author_id):
+        with self._lock:
+            for key in list(self._by_author.get(author_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_message.clear()
+            self._by_author.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self.size}
+
+
+card_cache = CardCache()
+
+
+def message_card(msg):
+    """The rendered card for `msg`, from the cache when possible."""
+
+    key = (msg.id, msg.user_id, msg.user.version)
+    html = card_cache.get(key)
+    if html is None:
+        template = current_app.jinja_env.get_template(CARD_TEMPLATE)
+        html = template.render(message=msg)
+        card_cache.put(key, html)
+
+    return Markup(html)
+
+
+def init_app(app):
+    """Size the cache from `CARD_CACHE_MAX_BYTES`; expose `message_card`."""
+
+    card_cache.max_bytes = app.config.setdefault('CARD_CACHE_MAX_BYTES',
+                                                 16 * 1024 * 1024)
+    app.jinja_env.globals['message_card'] = message_card
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_changed_cards(session, flush_context):
+    for obj in session.deleted:
+        if isinstance(obj, Message):
+            card_cache.invalidate_message(obj.id)
+        elif isinstance(obj, User):
+            card_cache.invalidate_author(obj.id)
+
+    for obj in session.dirty:
+        # counter updates don't change what a card shows
+        if isinstance(obj, User) and any(
+                inspect(obj).attrs[column].history.has_changes()
+                for column in PROFILE_COLUMNS):
+            card_cache.invalidate_author(obj.id)
+
+
+@event.listens_for(Message.__table__, 'after_drop')
+def _invalidate_on_drop(target, connection, **kw):
+    card_cache.clear()
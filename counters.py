@@ -0,0 +1,178 @@
+"""Denormalized per-user counters for Warbler.
+
+`User.messages_count`, `following_count`, `followers_count` and `likes_count`
+let pages show stats without loading every related row. They are kept in
+step by session flush hooks, so any ORM change to messages, follows or likes
+bumps them in the same transaction that made the change.
+
+Writes that bypass the ORM unit of work (bulk loads, `Query.delete()`, raw
+SQL) don't go through these hooks. Callers doing that should use `bump()`,
+and `reconcile()` (exposed as `flask reconcile-counters`) repairs any drift.
+"""
+
+from collections import Counter
+
+from sqlalchemy import case, event, func, inspect, or_, select, update
+from sqlalchemy.orm import Session
+
+from models import db, Follows, Likes, Message, User
+
+COUNTER_COLUMNS = ('messages_count', 'following_count',
+                   'followers_count', 'likes_count')
+
+users = User.__table__
+
+
+def bump(connection, deltas):
+    """Apply `{(user_id, column): delta}` to the users table.
+
+    One UPDATE per column, however many users it touches.
+    """
+
+    by_column = {}
+    for (user_id, column), delta in deltas.items():
+        if delta:
+            by_column.setdefault(column, {})[user_id] = delta
+
+    for column, user_deltas in by_column.items():
+        col = users.c[column]
+        connection.execute(
+            update(users)
+            .where(users.c.id.in_(user_deltas))
+            .values({col: col + case(user_deltas, value=users.c.id)}))
+
+
+def decrement_where(connection, column, user_ids):
+    """Decrement `column` once for every row `user_ids` selects."""
+
+    col = users.c[column]
+    rows = user_ids.subquery()
+    hits = (select(func.count())
+            .select_from(rows)
+            .where(rows.c[0] == users.c.id)
+            .scalar_subquery())
+
+    connection.execute(
+        update(users)
+        .where(users.c.id.in_(user_ids))
+        .values({col: col - hits}))
+
+
+@event.listens_for(Session, 'before_flush')
+def _count_cascaded_deletes(session, flush_context, instances):
+    """Account for rows the database will remove by ON DELETE CASCADE.
+
+    These have to be counted before the flush, while the rows still exist.
+    """
+
+    for obj in session.deleted:
+        if isinstance(obj, Message):
+            likers = select(Likes.user_id).where(Likes.message_id == obj.id)
+            decrement_where(session.connection(), 'likes_count', likers)
+
+        elif isinstance(obj, User):
+            connection = session.connection()
+            decrement_where(
+                connection, 'followers_count',
+                select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == obj.id))
+            decrement_where(
+                connection, 'following_count',
+                select(Follows.user_following_id)
+                .where(Follows.user_being_followed_id == obj.id))
+            decrement_where(
+                connection, 'likes_count',
+                select(Likes.user_id)
+                .join(Message, Message.id == Likes.message_id)
+                .where(Message.user_id == obj.id))
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_flushed_changes(session, flush_context):
+    """Bump counters for the messages, likes and follows just written."""
+
+    deltas = Counter()
+
+    for objs, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objs:
+            if isinstance(obj, Message):
+                deltas[obj.user_id, 'messages_count'] += sign
+            elif isinstance(obj, Likes):
+                deltas[obj.user_id, 'likes_count'] += sign
+            elif isinstance(obj, Follows):
+                deltas[obj.user_following_id, 'following_count'] += sign
+                deltas[obj.user_being_followed_id, 'followers_count'] += sign
+
+    # follows and likes can also be made through the User relationships
+    for user in list(session.new) + list(session.dirty):
+        if not isinstance(user, User):
+            continue
+
+        state = inspect(user)
+        for attr, own, theirs in (('following', 'following_count',
+                                   'followers_count'),
+                                  ('followers', 'followers_count',
+                                   'following_count')):
+            history = state.attrs[attr].history
+            for other, sign in ([(u, 1) for u in history.added] +
+                                [(u, -1) for u in history.deleted]):
+                deltas[user.id, own] += sign
+                deltas[other.id, theirs] += sign
+
+        history = state.attrs.likes.history
+        deltas[user.id, 'likes_count'] += (len(history.added) -
+                                           len(history.deleted))
+
+    if not deltas:
+        return
+
+    bump(session.connection(), deltas)
+    session.info.setdefault('stale_counters', set()).update(
+        user_id for user_id, _ in deltas)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_stale_counters(session, flush_context):
+    """Make loaded users re-read counters we changed behind the ORM's back."""
+
+    mapper = inspect(User)
+
+    for user_id in session.info.pop('stale_counters', ()):
+        key = mapper.identity_key_from_primary_key((user_id,))
+        user = session.identity_map.get(key)
+        if user is not None:
+            session.expire(user, COUNTER_COLUMNS)
+
+
+def reconcile(connection=None):
+    """Recount every user's counters from scratch.
+
+    Runs on `connection` if given, else the session. Returns the number of
+    users whose stored counts had drifted.
+    """
+
+    actual = {
+        'messages_count': (select(func.count(Message.id))
+                           .where(Message.user_id == users.c.id)),
+        'following_count': (select(func.count())
+                            .select_from(Follows)
+                            .where(Follows.user_following_id == users.c.id)),
+        'followers_count': (select(func.count())
+                            .select_from(Follows)
+                            .where(Follows.user_being_followed_id == users.c.id)),
+        'likes_count': (select(func.count())
+                        .select_from(Likes)
+                        .where(Likes.user_id == users.c.id)),
+    }
+    actual = {column: query.scalar_subquery()
+              for column, query in actual.items()}
+
+    drifted = or_(*(users.c[column] != count
+                    for column, count in actual.items()))
+
+    result = (connection or db.session).execute(
+        update(users)
+        .where(drifted)
+        .values({users.c[column]: count for column, count in actual.items()}))
+
+    return result.rowcount
@@ -0,0 +1,172 @@
+"""Account deletion with tombstones.
+
+Deleting a user through the ORM loads every message, follow and like they
+have before removing anything, and holds locks on all of them while it
+does. Instead `tombstone()` just stamps `User.deleted_at`, which is cheap
+and commits with the request. From then on the user and their messages are
+left out of every ORM SELECT (pass the `include_deleted=True` execution
+option to see them), so they vanish from profiles, search, follow lists,
+timelines and likes at once.
+
+`purge_user()` then deletes their rows in small batches, each in its own
+transaction, fixing the other users' counters as it goes, and finally the
+user row itself. The request queues it on the local job runner;
+`flask purge-deleted-users` finishes any purge a restart cut short.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import delete, event, select, tuple_, update
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+import counters
+import follow_graph
+
+PURGE_BATCH_SIZE = 500
+
+users = User.__table__
+
+# plain table columns, so the User criteria below doesn't apply inside it
+_tombstoned_ids = select(users.c.id).where(users.c.deleted_at.is_not(None))
+
+
+def tombstone(user):
+    """Mark `user` deleted; the caller's commit hides them."""
+
+    user.deleted_at = datetime.utcnow()
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _hide_tombstones(orm_execute_state):
+    if (orm_execute_state.is_select
+            and not orm_execute_state.is_column_load
+            and not orm_execute_state.execution_options.get('include_deleted')):
+        orm_execute_state.statement = orm_execute_state.statement.options(
+            with_loader_criteria(User, lambda cls: cls.deleted_at.is_(None),
+                                 include_aliases=True),
+            with_loader_criteria(
+                Message, lambda cls: cls.user_id.not_in(_tombstoned_ids),
+                include_aliases=True))
+
+
+def _purge_messages(connection, user_id, batch_size):
+    """Delete a batch of the user's messages, with their likes and
+    timeline entries."""
+
+    message_ids = connection.scalars(
+        select(Message.id).where(Message.user_id == user_id)
+        .limit(batch_size)).all()
+    if not message_ids:
+        return 0
+
+    counters.decrement_where(
+        connection, 'likes_count',
+        select(Likes.user_id).where(Likes.message_id.in_(message_ids)))
+    connection.execute(
+        delete(Likes).where(Likes.message_id.in_(message_ids)))
+    connection.execute(
+        delete(TimelineEntry).where(TimelineEntry.message_id.in_(message_ids)))
+    connection.execute(delete(Message).where(Message.id.in_(message_ids)))
+    return len(message_ids)
+
+
+def _purge_likes(connection, user_id, batch_size):
+    message_ids = connection.scalars(
+        select(Likes.message_id).where(Likes.user_id == user_id)
+        .limit(batch_size)).all()
+    if not message_ids:
+        return 0
+
+    connection.execute(
+        delete(Likes).where(Likes.user_id == user_id,
+                            Likes.message_id.in_(message_ids)))
+    return len(message_ids)
+
+
+def _purge_follows(connection, user_id, batch_size):
+    """Delete a batch of the user's follows, both ways, and adjust the
+    counts of the users on the other end."""
+
+    pairs = connection.execute(
+        select(Follows.user_following_id, Follows.user_being_followed_id)
+        .where(Follows.user_following_id == user_id)
+        .limit(batch_size)
+        .union_all(
+            select(Follows.user_following_id, Follows.user_being_followed_id)
+            .where(Follows.user_being_followed_id == user_id)
+            .limit(batch_size))).all()
+    if not pairs:
+        return 0
+
+    for column, others in (
+            ('followers_count', [followed for follower, followed in pairs
+                                 if follower == user_id]),
+            ('following_count', [follower for follower, followed in pairs
+                                 if followed == user_id])):
+        if others:
+            col = users.c[column]
+            connection.execute(update(users)
+                               .where(users.c.id.in_(others))
+                               .values({col: col - 1}))
+
+    connection.execute(
+        delete(Follows).where(
+            tuple_(Follows.user_following_id,
+                   Follows.user_being_followed_id).in_(pairs)))
+    for follower, followed in pairs:
+        follow_graph.record(db.session, follower, followed, False)
+    return len(pairs)
+
+
+def _purge_timeline(connection, user_id, batch_size):
+    message_ids = connection.scalars(
+        select(TimelineEntry.message_id)
+        .where(TimelineEntry.owner_id == user_id)
+        .limit(batch_size)).all()
+    if not message_ids:
+        return 0
+
+    connection.execute(
+        delete(TimelineEntry).where(TimelineEntry.owner_id == user_id,
+                                    TimelineEntry.message_id.in_(message_ids)))
+    return len(message_ids)
+
+
+PURGE_STEPS = (_purge_messages, _purge_likes, _purge_follows, _purge_timeline)
+
+
+def purge_user(user_id, batch_size=PURGE_BATCH_SIZE):
+    """Delete a tombstoned user's rows, one committed batch at a time.
+
+    Safe to run again after an interruption. Returns the number of
+    transactions it committed.
+    """
+
+    batches = 0
+
+    for step in PURGE_STEPS:
+        while True:
+            n = step(db.session.connection(), user_id, batch_size)
+            db.session.commit()
+            batches += 1
+            if n < batch_size:
+                break
+
+    # only the row itself is left for the foreign keys to cascade to
+    db.session.execute(
+        delete(users).where(users.c.id == user_id,
+                            users.c.deleted_at.is_not(None)))
+    db.session.commit()
+
+    return batches + 1
+
+
+def purge_pending(batch_size=PURGE_BATCH_SIZE):
+    """Purge every tombstoned user; returns how many there were."""
+
+    user_ids = db.session.scalars(_tombstoned_ids).all()
+    for user_id in user_ids:
+        purge_user(user_id, batch_size)
+
+    return len(user_ids)
@@ -0,0 +1,432 @@
+"""Shared, memory-mapped index of who follows whom.
+
+`is_following()` and `following_ids()` used to ask the database every time.
+`flask build-follow-graph` instead writes the follows table to one file at
+`FOLLOW_GRAPH_PATH` in CSR form. For each direction (following, followers)
+there is an int32 offsets array indexed by user ID and an int32 array of
+neighbour IDs, sorted within each user. Every worker maps the file
+read-only, so all processes share the one copy in the page cache, and a
+lookup is a slice plus a binary search.
+
+Follows and unfollows committed after a build are appended to a small log
+next to the index (`<path>.log`). Each record is the pair's state read back
+from the database under the log's lock after the commit, so the last record
+for a pair is always its latest state. Every worker replays new records into
+an in-memory overlay at the start of each request. Its own commits go in
+straight away, so a user sees their own change immediately. The next build
+(compaction) folds the log into a fresh index, swaps it in with an atomic
+rename, and drops the log records it now includes.
+
+Writes that bypass the session (bulk loads, raw SQL) aren't logged. Run a
+build after them, or call `record()` before committing.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from threading import Lock
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, inspect, select, tuple_
+from sqlalchemy.orm import Session
+
+from models import db, Follows, User
+
+# magic, version, max user ID, edges, first log sequence not in the index
+INDEX_HEADER = struct.Struct('<4sIqqq')
+INDEX_MAGIC = b'WFGI'
+INDEX_VERSION = 1
+
+# magic, sequence number of the first record in the file
+LOG_HEADER = struct.Struct('<4s4xq')
+LOG_MAGIC = b'WFGL'
+# follower, followed, 1 for a follow / 0 for an unfollow
+LOG_RECORD = struct.Struct('<iii')
+
+FETCH_SIZE = 100_000
+
+DELTAS_KEY = 'follow_graph_deltas'
+
+
+class FollowGraph:
+    """Read side of the index: membership, degree and neighbour lists."""
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = path + '.log'
+        self.ready = False
+        self._index_id = None
+        self._log_ino = None
+        self._log_fd = None
+        self._lock = Lock()
+
+    # -- loading
+
+    def refresh(self):
+        """Pick up a rebuilt index and any new log records."""
+
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            if (st.st_ino, st.st_mtime_ns) != self._index_id:
+                self._load_index(st)
+            self._read_log()
+
+    def _load_index(self, st):
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, max_id, edges, log_seq = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{self.path} is not a follow graph index")
+
+        ints = memoryview(data)[INDEX_HEADER.size:].cast('i')
+        n = max_id + 2
+        # old arrays stay valid for anyone still holding a slice of them
+        self._following = (ints[:n], ints[n:n + edges])
+        ints = ints[n + edges:]
+        self._followers = (ints[:n], ints[n:n + edges])
+        self.max_id = max_id
+
+        # the overlay starts over from where this index's snapshot ends
+        self._log_seq = log_seq
+        self._out_changes = {}
+        self._in_changes = {}
+        self._log_ino = None
+        self._index_id = (st.st_ino, st.st_mtime_ns)
+        self.ready = True
+
+    def _read_log(self):
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            return
+
+        if st.st_ino != self._log_ino:
+            # the log is new or was compacted
+            if self._log_fd is not None:
+                os.close(self._log_fd)
+            self._log_fd = os.open(self.log_path, os.O_RDONLY)
+            self._log_ino = os.fstat(self._log_fd).st_ino
+            self._log_base = _log_base(self._log_fd)
+
+            if self._log_base > self._log_seq:
+                # compacted past us; the index that has those records is
+                # already in place
+                st = os.stat(self.path)
+                if (st.st_ino, st.st_mtime_ns) != self._index_id:
+                    self._load_index(st)
+                    return self._read_log()
+                self._log_seq = self._log_base
+
+        start = (LOG_HEADER.size
+                 + (self._log_seq - self._log_base) * LOG_RECORD.size)
+        size = os.fstat(self._log_fd).st_size
+        data = os.pread(self._log_fd, max(size - start, 0), start)
+
+        # only whole records; a write in progress is read next time
+        usable = len(data) - len(data) % LOG_RECORD.size
+        for follower, followed, present in LOG_RECORD.iter_unpack(data[:usable]):
+            self._apply(follower, followed, bool(present))
+        self._log_seq += usable // LOG_RECORD.size
+
+    def _apply(self, follower, followed, present):
+        self._out_changes.setdefault(follower, {})[followed] = present
+        self._in_changes.setdefault(followed, {})[follower] = present
+
+    def apply(self, deltas):
+        """Overlay this process's own committed `(follower, followed,
+        present)` changes before the log is next read."""
+
+        with self._lock:
+            for follower, followed, present in deltas:
+                self._apply(follower, followed, present)
+
+    def can_answer(self, session):
+        """Does the index reflect everything `session` would see?
+
+        Not while it holds follow changes that haven't been committed.
+        """
+
+        return self.ready and not (session.info.get(DELTAS_KEY) or session.new
+                                   or session.deleted or session.dirty)
+
+    # -- queries
+
+    def _base(self, csr, user_id):
+        offsets, neighbours = csr
+        if user_id > self.max_id or user_id < 0:
+            return neighbours[0:0]
+        return neighbours[offsets[user_id]:offsets[user_id + 1]]
+
+    def _neighbours(self, csr, changes, user_id):
+        base = self._base(csr, user_id)
+        changed = changes.get(user_id)
+        if not changed:
+            return base
+
+        ids = set(base)
+        ids.update(other for other, present in changed.items() if present)
+        ids.difference_update(other for other, present in changed.items()
+                              if not present)
+        return sorted(ids)
+
+    def _degree(self, csr, changes, user_id):
+        base = self._base(csr, user_id)
+        degree = len(base)
+        for other, present in changes.get(user_id, {}).items():
+            degree += present - _contains(base, other)
+        return degree
+
+    def is_following(self, follower, followed):
+        change = self._out_changes.get(follower, {}).get(followed)
+        if change is not None:
+            return change
+        return _contains(self._base(self._following, follower), followed)
+
+    def following(self, user_id):
+        """IDs `user_id` follows, ascending."""
+
+        return self._neighbours(self._following, self._out_changes, user_id)
+
+    def followers(self, user_id):
+        """IDs following `user_id`, ascending."""
+
+        return self._neighbours(self._followers, self._in_changes, user_id)
+
+    def following_count(self, user_id):
+        return self._degree(self._following, self._out_changes, user_id)
+
+    def followers_count(self, user_id):
+        return self._degree(self._followers, self._in_changes, user_id)
+
+
+def _contains(ids, target):
+    i = bisect_left(ids, target)
+    return i < len(ids) and ids[i] == target
+
+
+def _log_base(fd):
+    header = os.pread(fd, LOG_HEADER.size, 0)
+    if len(header) < LOG_HEADER.size:
+        return 0
+    magic, base = LOG_HEADER.unpack(header)
+    if magic != LOG_MAGIC:
+        raise ValueError("not a follow graph log")
+    return base
+
+
+class _LockedLog:
+    """The log file at `path`, opened and locked; reopened if it was
+    compacted while we waited for the lock."""
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+
+    def __enter__(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(fd, self.mode)
+            if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                self.fd = fd
+                if self.mode == fcntl.LOCK_EX and os.fstat(fd).st_size == 0:
+                    os.write(fd, LOG_HEADER.pack(LOG_MAGIC, 0))
+                return fd
+            os.close(fd)
+
+    def __exit__(self, *exc):
+        os.close(self.fd)
+
+
+def _log_end(fd):
+    """Sequence number the next record appended to the log will get."""
+
+    size = max(os.fstat(fd).st_size - LOG_HEADER.size, 0)
+    return _log_base(fd) + size // LOG_RECORD.size
+
+
+def _current_state(connection, pairs):
+    """`(follower, followed, present)` for each pair as the database has it."""
+
+    existing = set(connection.execute(
+        select(Follows.user_following_id, Follows.user_being_followed_id)
+        .where(tuple_(Follows.user_following_id,
+                      Follows.user_being_followed_id).in_(pairs))).all())
+
+    return [(follower, followed, (follower, followed) in existing)
+            for follower, followed in pairs]
+
+
+def append(path, engine, pairs):
+    """Log the committed state of the changed `(follower, followed)` pairs
+    for every worker using the index at `path`; returns the records.
+
+    Workers' commits and appends can interleave in any order, so the state
+    is read back from the database while holding the log lock rather than
+    taken from the change that was made. Whichever append runs last, the
+    last record for a pair is then its latest committed state.
+    """
+
+    pairs = list(dict.fromkeys(pairs))
+    with _LockedLog(path + '.log', fcntl.LOCK_EX) as fd:
+        with engine.connect() as connection:
+            records = _current_state(connection, pairs)
+        os.write(fd, b''.join(LOG_RECORD.pack(follower, followed, present)
+                              for follower, followed, present in records))
+
+    return records
+
+
+# -- building
+
+
+def _csr(connection, max_id, source, target):
+    """Offsets and neighbours for follows grouped by `source`."""
+
+    offsets = array('i', bytes(4 * (max_id + 2)))
+    neighbours = array('i')
+
+    result = connection.execution_options(yield_per=FETCH_SIZE).execute(
+        select(source, target).order_by(source, target))
+    for rows in result.partitions():
+        for src, dst in rows:
+            neighbours.append(dst)
+            offsets[src + 1] += 1
+
+    total = 0
+    for i in range(len(offsets)):
+        total += offsets[i]
+        offsets[i] = total
+
+    return offsets, neighbours
+
+
+def build(engine, path):
+    """Write a fresh index of `follows` to `path` and trim the log.
+
+    Returns the number of follows indexed.
+    """
+
+    log_path = path + '.log'
+
+    # anything logged from here on may be missing from the snapshot below,
+    # so the new index replays it; replaying a change twice is harmless
+    with _LockedLog(log_path, fcntl.LOCK_SH) as fd:
+        log_seq = _log_end(fd)
+
+    with engine.connect() as connection:
+        connection = connection.execution_options(
+            isolation_level='REPEATABLE READ')
+        with connection.begin():
+            max_id = connection.scalar(select(func.max(User.id))) or 0
+            following = _csr(connection, max_id, Follows.user_following_id,
+                             Follows.user_being_followed_id)
+            followers = _csr(connection, max_id, Follows.user_being_followed_id,
+                             Follows.user_following_id)
+
+    edges = len(following[1])
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, max_id, edges,
+                                  log_seq))
+        for ints in following + followers:
+            ints.tofile(f)
+    os.replace(tmp, path)
+
+    _trim_log(log_path, log_seq)
+    return edges
+
+
+def _trim_log(log_path, keep_from):
+    """Drop log records before sequence `keep_from`, which the index at
+    `log_path` now includes."""
+
+    with _LockedLog(log_path, fcntl.LOCK_EX) as fd:
+        base = _log_base(fd)
+        start = LOG_HEADER.size + (keep_from - base) * LOG_RECORD.size
+        tail = os.pread(fd, max(os.fstat(fd).st_size - start, 0), start)
+
+        tmp = f"{log_path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(LOG_HEADER.pack(LOG_MAGIC, keep_from))
+            f.write(tail)
+        # writers waiting on the old file's lock notice the swap and reopen
+        os.replace(tmp, log_path)
+
+
+# -- keeping it current
+
+
+def record(session, follower, followed, present):
+    """Note a follow change `session` is making; the pair's state is logged
+    once it commits."""
+
+    session.info.setdefault(DELTAS_KEY, []).append(
+        (follower, followed, present))
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_follows(session, flush_context):
+    for objs, present in ((session.new, True), (session.deleted, False)):
+        for obj in objs:
+            if isinstance(obj, Follows):
+                record(session, obj.user_following_id,
+                       obj.user_being_followed_id, present)
+
+    # follows made through the User relationships
+    for user in list(session.new) + list(session.dirty):
+        if not isinstance(user, User):
+            continue
+
+        state = inspect(user)
+        for attr, outgoing in (('following', True), ('followers', False)):
+            history = state.attrs[attr].history
+            for others, present in ((history.added, True),
+                                    (history.deleted, False)):
+                for other in others:
+                    pair = ((user.id, other.id) if outgoing
+                            else (other.id, user.id))
+                    record(session, *pair, present)
+
+
+@event.listens_for(Session, 'after_commit')
+def _log_committed_follows(session):
+    deltas = session.info.pop(DELTAS_KEY, None)
+    if not deltas or not has_app_context():
+        return
+
+    graph = current_app.extensions.get('follow_graph')
+    if graph is None:
+        return
+
+    records = append(graph.path, db.engine,
+                     [(follower, followed) for follower, followed, _ in deltas])
+    graph.apply(records)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_follows(session):
+    session.info.pop(DELTAS_KEY, None)
+
+
+def _refresh():
+    current_app.extensions['follow_graph'].refresh()
+
+
+def init_app(app):
+    """Share the index at `FOLLOW_GRAPH_PATH`, if set, with `app`."""
+
+    path = app.config.setdefault('FOLLOW_GRAPH_PATH', None)
+    if not path:
+        return
+
+    graph = FollowGraph(path)
+    graph.refresh()
+    app.extensions['follow_graph'] = graph
+    app.before_request(_refresh)
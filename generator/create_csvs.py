@@ -3,14 +3,28 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Everything is drawn from seeded random generators with no network
+access, so the same arguments always produce the same files. Rows are
+written as they are generated and memory only grows with the number of
+users, never with messages or follows:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 50000000 --seed 7 --out /tmp/warbler-1m
+
+Follower counts follow a power law (a few accounts are followed by a large
+share of users), posting activity is skewed the same way, and message times
+grow busier towards the present with a daily cycle.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+from datetime import datetime
+from random import Random
+
+from helpers import (DEFAULT_END, TimestampSampler, ranked_population,
+                     zipf_cum_weights)
 
 MAX_WARBLER_LENGTH = 140
 
@@ -18,11 +32,51 @@ USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'heade
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
-
-fake = Faker()
+# bcrypt hash of "password", so every generated user can log in
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+WORDS = """
+able about above across act add after again age ago air all almost alone
+along already also always among animal answer any appear apple area arm
+around art ask away baby back bad ball bank base bear beat beauty become bed
+before begin behind bell best better between big bird black blue board boat
+body bone book both box boy bread break bright bring brother brown build
+burn busy buy call calm camp car care carry case cat catch cause center
+chair chance change cheap child choose city class clean clear climb clock
+close cloud coast coat cold color come common cook cool corn corner count
+country course cover cow cross crowd cry cup cut dance dark day dead deal
+dear deep desk dinner dog door down draw dream dress drink drive drop dry
+duck dust early earth east easy eat edge egg end enjoy enough even evening
+ever every eye face fact fair fall family far farm fast father feel field
+fight fill find fine fire first fish fit five flat floor flower fly follow
+food foot forest forget form fox free fresh friend front fruit full game
+garden gate gift girl give glad glass gold good grass great green ground
+group grow guess hair half hall hand happy hard hat have head hear heart
+heavy help hill hold home hope horse hot hour house hundred idea iron
+island job join jump just keep key kind king kitchen know lake land large
+last late laugh lead leaf learn leave left letter light line lion listen
+little live long look lose loud love low lunch machine main make man many
+map mark market meet milk mind minute miss moon morning mother mountain
+move music name near neck need never new next nice night noise north nose
+note nothing number ocean office old open orange paint paper park party
+pass path pay pen people piano picture piece place plan plant play pocket
+point poor post power pull push queen quick quiet rain read ready red
+remember rest rich ride right ring river road rock roof room round run
+safe sail salt sand save say school sea season seat see seed sell send
+serve shape share ship shoe shop short show side sign silver simple sing
+sister sit sky sleep slow small smile snow soft soil song soon sound south
+space speak spring square star start station stay step stone stop store
+storm story street strong study sugar summer sun sweet swim table tail
+take talk tall teach team tell test thank thick thin think three tiny
+today together tomorrow top touch town track train tree trip true try turn
+under until up use valley very visit voice wait walk wall warm wash watch
+water wave way weather week well west wet wheel white wide wild wind window
+winter wish wood word work world write yard year yellow young
+""".split()
+
+CITIES = ["Springfield", "Riverton", "Fairview", "Lakeside", "Georgetown",
+          "Salem", "Madison", "Clinton", "Franklin", "Greenville", "Bristol",
+          "Oakland", "Ashland", "Milton", "Newport", "Dayton", "Kingston"]
 
 # Generate random profile image URLs to use for users
 
@@ -32,46 +86,126 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Header images ship with the app, so nothing has to be fetched
 
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    "/static/images/warbler-hero.jpg",
+    "/static/images/signed-out-home.jpg",
+    "/static/images/nav-bg.png",
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+def sentence(rng, max_length):
+    """A capitalised run of words no longer than `max_length`."""
+
+    words = []
+    length = 0
+    for _ in range(rng.randint(3, 24)):
+        word = rng.choice(WORDS)
+        if length + len(word) + 2 > max_length:
+            break
+        words.append(word)
+        length += len(word) + 1
+
+    return " ".join(words).capitalize() + "."
+
+
+def write_users(path, rng, num_users):
+    with open(path, 'w', newline='') as users_csv:
+        users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
+        users_writer.writeheader()
+
+        for i in range(1, num_users + 1):
+            # the row number keeps usernames and emails unique at any scale
+            username = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}{i}"
+            users_writer.writerow(dict(
+                email=f"{username}@example.com",
+                username=username,
+                image_url=rng.choice(image_urls),
+                password=PASSWORD_HASH,
+                bio=sentence(rng, 100),
+                header_image_url=rng.choice(header_image_urls),
+                location=rng.choice(CITIES),
+            ))
+
+
+def write_messages(path, rng, num_users, num_messages, exponent, end):
+    # a few prolific posters and a long tail of occasional ones
+    authors = ranked_population(rng, num_users)
+    cum_weights = zipf_cum_weights(num_users, exponent)
+    when = TimestampSampler(rng, end)
+
+    with open(path, 'w', newline='') as messages_csv:
+        messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
+        messages_writer.writeheader()
+
+        for _ in range(num_messages):
+            messages_writer.writerow(dict(
+                text=sentence(rng, MAX_WARBLER_LENGTH),
+                timestamp=when(),
+                user_id=rng.choices(authors, cum_weights=cum_weights)[0],
+            ))
+
+
+def write_follows(path, rng, num_users, num_follows, exponent):
+    # who gets followed is Zipf-distributed over a shuffled ranking, which
+    # gives the power-law follower counts real networks have
+    celebrities = ranked_population(rng, num_users)
+    cum_weights = zipf_cum_weights(num_users, exponent)
+    mean_out_degree = num_follows / num_users
+
+    with open(path, 'w', newline='') as follows_csv:
+        follows_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
+        follows_writer.writeheader()
+
+        for follower in range(1, num_users + 1):
+            # how many accounts each user follows is itself long-tailed
+            out_degree = min(int(rng.expovariate(1 / mean_out_degree)),
+                             num_users - 1)
+
+            # draw with replacement and skip repeats; only this user's
+            # picks are kept in memory
+            followed = set()
+            attempts = 0
+            while len(followed) < out_degree and attempts < out_degree * 20:
+                attempts += 1
+                (pick,) = rng.choices(celebrities, cum_weights=cum_weights)
+                if pick != follower:
+                    followed.add(pick)
+
+            for followed_user in sorted(followed):
+                follows_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSVs.")
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000,
+                        help="approximate number of follows to generate")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help="power-law exponent for popularity/activity")
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=DEFAULT_END,
+                        help="latest message time (ISO); default "
+                             f"{DEFAULT_END.date()}")
+    parser.add_argument('--out', default='generator')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+
+    # separate streams per file, so changing one count doesn't reshuffle
+    # the others
+    write_users(os.path.join(args.out, 'users.csv'),
+                Random(f"{args.seed}-users"), args.users)
+    write_messages(os.path.join(args.out, 'messages.csv'),
+                   Random(f"{args.seed}-messages"), args.users,
+                   args.messages, args.zipf, args.end)
+    write_follows(os.path.join(args.out, 'follows.csv'),
+                  Random(f"{args.seed}-follows"), args.users,
+                  args.follows, args.zipf)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,49 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
 
+# Default end of the generated history. Fixed rather than "today", so the
+# same arguments give the same files whenever they are run.
+DEFAULT_END = datetime(2024, 1, 1)
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+# Share of each hour's traffic (UTC), quiet overnight and peaking in the
+# evening, roughly like a single-timezone social site.
+HOURLY_WEIGHTS = [2, 1, 1, 1, 1, 2, 3, 5, 6, 6, 6, 7,
+                  8, 7, 6, 6, 7, 8, 9, 10, 10, 9, 6, 4]
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
 
-    return datetime.fromtimestamp(random_timestamp)
+def zipf_cum_weights(n, exponent):
+    """Cumulative Zipf weights for ranks 1..n, for `rng.choices`."""
+
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def ranked_population(rng, n):
+    """User IDs 1..n in a random order, so rank 1 isn't always user 1."""
+
+    ids = list(range(1, n + 1))
+    rng.shuffle(ids)
+    return ids
+
+
+class TimestampSampler:
+    """Draw message times over the last `days`, with traffic growing over
+    the window and following a daily cycle."""
+
+    def __init__(self, rng, end, days=730, growth=3.0):
+        self.rng = rng
+        self.start = end - timedelta(days=days)
+        # day d gets weight proportional to growth ** (d / days), so the
+        # last day is `growth` times busier than the first
+        self.day_weights = list(accumulate(growth ** (day / days)
+                                           for day in range(days)))
+        self.hour_weights = list(accumulate(HOURLY_WEIGHTS))
+
+    def __call__(self):
+        rng = self.rng
+        day = bisect(self.day_weights, rng.random() * self.day_weights[-1])
+        hour = bisect(self.hour_weights, rng.random() * self.hour_weights[-1])
+        seconds = day * 86400 + hour * 3600 + rng.random() * 3600
+        return self.start + timedelta(seconds=seconds)
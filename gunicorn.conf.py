@@ -0,0 +1,28 @@
+"""gunicorn settings for Warbler.
+
+Workers share Prometheus metrics through files in PROMETHEUS_MULTIPROC_DIR
+(see metrics.py). The directory is emptied when gunicorn starts, and a dead
+worker's live gauges are dropped when it exits.
+"""
+
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(tempfile.gettempdir(), 'warbler-metrics'))
+
+from prometheus_client import multiprocess  # noqa: E402
+
+wsgi_app = 'app:app'
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+
+
+def on_starting(server):
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
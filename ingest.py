@@ -0,0 +1,134 @@
+"""Bulk message ingest for integrations.
+
+Posting through `/messages/new` costs a form validation, an ORM append and a
+commit per message. `POST /api/messages/bulk` takes a JSON batch instead:
+
+    {"messages": [{"text": "..."}, {"text": "...", "user_id": 7}, ...]}
+
+Logged-in users may only post as themselves, and `user_id` can be left out.
+Requests with `Authorization: Bearer <INGEST_ADMIN_TOKEN>` may post for any
+(live) user and must give `user_id` on every message.
+
+Every message is validated before anything is written, and a batch with any
+invalid message is rejected whole. A valid batch is written by `ingest()`
+with one multi-row INSERT ... RETURNING in the request's transaction, along
+with the authors' `messages_count` and one batched timeline fan-out.
+
+`warbler_ingested_messages_total` counts what was written, so throughput is
+read as messages per second (`rate()` of it) rather than requests per second.
+"""
+
+import hmac
+from collections import Counter
+
+from sqlalchemy import insert, select
+
+from models import db, Message, User
+import counters
+import metrics
+import timeline
+
+MAX_BATCH = 1000
+MAX_LENGTH = Message.text.type.length
+
+messages = Message.__table__
+
+
+class IngestError(ValueError):
+    """A batch was rejected; `errors` lists `{'index', 'error'}` dicts.
+
+    An `index` of None means the problem is with the batch as a whole.
+    """
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid message(s)")
+        self.errors = errors
+
+
+def is_admin(authorization, token):
+    """Does an Authorization header carry the admin `token`?"""
+
+    if not token or not authorization:
+        return False
+
+    scheme, _, given = authorization.partition(' ')
+    return (scheme.lower() == 'bearer'
+            and hmac.compare_digest(given.strip().encode(), token.encode()))
+
+
+def validate(payload, user_id=None, admin=False, max_batch=MAX_BATCH):
+    """Check a decoded request body; return the rows to insert.
+
+    `user_id` is the logged-in user, if any. Raises IngestError listing
+    every problem found.
+    """
+
+    items = payload.get('messages') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        raise IngestError([{'index': None,
+                            'error': "expected a non-empty 'messages' list"}])
+    if len(items) > max_batch:
+        raise IngestError([{'index': None,
+                            'error': f"at most {max_batch} messages a batch"}])
+
+    rows = {}
+    errors = []
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': "expected an object"})
+            continue
+
+        text = item.get('text')
+        author = item.get('user_id', None if admin else user_id)
+
+        if not isinstance(text, str) or not text.strip():
+            errors.append({'index': index, 'error': "text is required"})
+        elif len(text) > MAX_LENGTH:
+            errors.append({'index': index,
+                           'error': f"text is over {MAX_LENGTH} characters"})
+        elif type(author) is not int:
+            errors.append({'index': index, 'error': "user_id is required"})
+        elif not admin and author != user_id:
+            errors.append({'index': index,
+                           'error': "can only post as yourself"})
+        else:
+            rows[index] = {'text': text, 'user_id': author}
+
+    if admin and rows:
+        # tombstoned users are filtered out here too; see deletion.py
+        live = set(db.session.scalars(
+            select(User.id).where(
+                User.id.in_({row['user_id'] for row in rows.values()}))))
+        errors.extend({'index': index, 'error': "no such user"}
+                      for index, row in rows.items()
+                      if row['user_id'] not in live)
+
+    if errors:
+        raise IngestError(sorted(errors, key=lambda error: error['index']))
+
+    return list(rows.values())
+
+
+def ingest(rows):
+    """Insert validated rows; return the new message IDs in order.
+
+    Doesn't commit; the caller commits.
+    """
+
+    connection = db.session.connection()
+    inserted = connection.execute(
+        insert(messages).returning(messages.c.id, messages.c.user_id,
+                                   messages.c.timestamp,
+                                   sort_by_parameter_order=True),
+        rows).all()
+
+    per_author = Counter(row['user_id'] for row in rows)
+    counters.bump(connection, {(author, 'messages_count'): count
+                               for author, count in per_author.items()})
+
+    timeline.fan_out_messages([tuple(row) for row in inserted])
+
+    metrics.INGESTED_MESSAGES.inc(len(inserted))
+
+    return [row.id for row in inserted]
@@ -0,0 +1,76 @@
+"""Background jobs for Warbler.
+
+`runner.submit(func, *args)` queues a call to run after the response, on a
+worker thread inside the app's context, so slow cleanup doesn't hold up a
+request. The local worker starts on the first submit in each process, which
+keeps it out of the gunicorn master.
+
+Queued jobs live in memory and are lost if the worker process exits, so a
+job must be safe to run again and leave enough behind in the database to be
+picked up later (see `deletion.purge_pending()`).
+"""
+
+import logging
+import os
+import queue
+from threading import Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    """Runs submitted calls one at a time on a daemon thread."""
+
+    def __init__(self):
+        self.app = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def submit(self, func, *args):
+        """Run `func(*args)` in the background."""
+
+        self._ensure_worker()
+        self._queue.put((func, args))
+
+    def join(self):
+        """Wait until every submitted job has finished."""
+
+        self._queue.join()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked child inherits the queue but not the thread
+                self._queue = queue.Queue()
+                self._thread = None
+                self._pid = os.getpid()
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._work, args=(self._queue,),
+                                      name='warbler-jobs', daemon=True)
+                self._thread.start()
+
+    def _work(self, jobs):
+        while True:
+            func, args = jobs.get()
+            try:
+                with self.app.app_context():
+                    func(*args)
+            except Exception:
+                logger.exception("Job %s%r failed", func.__name__, args)
+            finally:
+                jobs.task_done()
+
+
+runner = JobRunner()
+
+
+def init_app(app):
+    """Run background jobs for `app`."""
+
+    runner.init_app(app)
@@ -0,0 +1,81 @@
+"""Liking and unliking messages in a single statement.
+
+A click on the star used to SELECT the like and then INSERT or DELETE it, so
+two quick clicks could both see "not liked" and race. `set_liked` instead
+sends one PostgreSQL statement: the DELETE ... RETURNING and/or
+INSERT ... ON CONFLICT DO NOTHING RETURNING run as CTEs, and the same
+statement moves the user's `likes_count` by however many rows changed.
+
+Concurrent calls are safe: a second INSERT of the same (user_id, message_id)
+waits on the first and then does nothing, and a DELETE that loses the race
+deletes nothing, so the counter only moves for rows that really changed.
+
+Like the timeline functions, this doesn't commit.
+"""
+
+import operator
+from functools import reduce
+
+from sqlalchemy import delete, exists, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, Likes, Message, User
+
+likes = Likes.__table__
+users = User.__table__
+
+
+def _row_count(cte):
+    return select(func.count()).select_from(cte).scalar_subquery()
+
+
+def set_liked(user_id, message_id, liked=None):
+    """Like (`liked=True`), unlike (`False`) or toggle (`None`) a message.
+
+    Liking or unliking twice is a no-op the second time. Returns the change
+    in the user's likes: 1, -1, or 0 if nothing changed (including when the
+    message doesn't exist).
+    """
+
+    this_like = (likes.c.user_id == user_id) & (likes.c.message_id == message_id)
+    terms = []
+
+    removed = None
+    if liked is not True:
+        removed = (delete(likes).where(this_like)
+                   .returning(likes.c.message_id).cte('removed'))
+        terms.append(-_row_count(removed))
+
+    if liked is not False:
+        new_row = (select(literal(user_id), literal(message_id))
+                   .where(exists().where(Message.id == message_id)))
+        if removed is not None:
+            # toggling: only add the like if there wasn't one to remove
+            new_row = new_row.where(~exists(select(removed.c.message_id)))
+
+        added = (pg_insert(likes)
+                 .from_select(['user_id', 'message_id'], new_row)
+                 .on_conflict_do_nothing()
+                 .returning(likes.c.message_id).cte('added'))
+        terms.append(_row_count(added))
+
+    delta = reduce(operator.add, terms)
+
+    counted = (update(users)
+               .where(users.c.id == user_id)
+               .values(likes_count=users.c.likes_count + delta)
+               .returning(users.c.id).cte('counted'))
+
+    return db.session.scalar(select(delta).add_cte(counted))
+
+
+def liked_ids(user_id, message_ids):
+    """Which of `message_ids` the user likes, as a set."""
+
+    if not message_ids:
+        return set()
+
+    return set(db.session.scalars(
+        select(likes.c.message_id)
+        .where(likes.c.user_id == user_id,
+               likes.c.message_id.in_(message_ids))))
@@ -0,0 +1,170 @@
+"""Streaming bulk loader for Warbler's CSV snapshots.
+
+Replaces the old load-everything-in-one-transaction seed. Each CSV is read
+row by row and written in batches of `batch_size`: with PostgreSQL's COPY
+when the driver supports it, otherwise with an executemany INSERT. Users go
+first; messages and follows only depend on users, so they load in parallel
+on their own connections.
+
+The CSVs refer to users by their 1-based row number in users.csv. When
+appending to a database that already has users, every user ID in the
+snapshot is shifted past the current maximum so the new rows don't collide.
+"""
+
+import csv
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, text
+
+from models import db, Follows, Message, User
+import counters
+import timeline
+
+DEFAULT_BATCH_SIZE = 10_000
+
+# users whose timelines are rebuilt by one statement
+TIMELINE_BLOCK_SIZE = 1000
+
+USER_COLUMNS = ['id', 'email', 'username', 'image_url', 'password', 'bio',
+                'header_image_url', 'location']
+MESSAGE_COLUMNS = ['text', 'timestamp', 'user_id']
+FOLLOW_COLUMNS = ['user_being_followed_id', 'user_following_id']
+
+
+def read_batches(path, batch_size, convert):
+    """Yield lists of at most `batch_size` converted rows from a CSV."""
+
+    with open(path, newline='') as f:
+        batch = []
+        for row_number, row in enumerate(csv.DictReader(f), start=1):
+            batch.append(convert(row_number, row))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _copy_batch(connection, table, columns, rows):
+    """COPY rows in through the raw psycopg2 cursor."""
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    buf.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) "
+            f"FROM STDIN WITH (FORMAT csv)", buf)
+    finally:
+        cursor.close()
+
+
+def _supports_copy(connection):
+    if connection.dialect.name != 'postgresql':
+        return False
+
+    cursor = connection.connection.cursor()
+    try:
+        return hasattr(cursor, 'copy_expert')
+    finally:
+        cursor.close()
+
+
+def load_table(engine, table, columns, batches, progress, use_copy=None):
+    """Write `batches` into `table` in one transaction; return the row count."""
+
+    loaded = 0
+    started = time.perf_counter()
+
+    with engine.begin() as connection:
+        copy = _supports_copy(connection) if use_copy is None else use_copy
+        for batch in batches:
+            if copy:
+                _copy_batch(connection, table, columns, batch)
+            else:
+                connection.execute(insert(table), batch)
+
+            loaded += len(batch)
+            rate = loaded / max(time.perf_counter() - started, 1e-9)
+            progress(f"{table.name}: {loaded:,} rows ({rate:,.0f} rows/s)")
+
+    return loaded
+
+
+def load_snapshot(directory, batch_size=DEFAULT_BATCH_SIZE, append=False,
+                  parallel=2, progress=print, use_copy=None):
+    """Load users.csv, messages.csv and follows.csv from `directory`.
+
+    Drops and recreates the schema unless `append` is set. Returns a dict of
+    rows loaded per table. Must be called inside an app context.
+    """
+
+    if not append:
+        db.drop_all()
+    db.create_all()
+
+    engine = db.engine
+    with engine.connect() as connection:
+        offset = connection.scalar(
+            select(func.coalesce(func.max(User.id), 0)))
+
+    def user_row(row_number, row):
+        row = {column: row.get(column) for column in USER_COLUMNS}
+        row['id'] = offset + row_number
+        return row
+
+    def message_row(row_number, row):
+        return {'text': row['text'],
+                'timestamp': datetime.fromisoformat(row['timestamp']),
+                'user_id': offset + int(row['user_id'])}
+
+    def follow_row(row_number, row):
+        return {column: offset + int(row[column]) for column in FOLLOW_COLUMNS}
+
+    def job(table, columns, filename, convert):
+        batches = read_batches(f"{directory}/{filename}", batch_size, convert)
+        return load_table(engine, table, columns, batches, progress, use_copy)
+
+    loaded = {'users': job(User.__table__, USER_COLUMNS, 'users.csv',
+                           user_row)}
+
+    if engine.dialect.name == 'postgresql':
+        # users were given explicit IDs; move the sequence past them
+        with engine.begin() as connection:
+            connection.execute(text(
+                "SELECT setval(pg_get_serial_sequence('users', 'id'), "
+                "(SELECT max(id) FROM users))"))
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        messages = pool.submit(job, Message.__table__, MESSAGE_COLUMNS,
+                               'messages.csv', message_row)
+        follows = pool.submit(job, Follows.__table__, FOLLOW_COLUMNS,
+                              'follows.csv', follow_row)
+        loaded['messages'] = messages.result()
+        loaded['follows'] = follows.result()
+
+    # bulk loads skip the counter hooks and leave timelines cold
+    progress("reconciling counters")
+    counters.reconcile()
+    db.session.commit()
+
+    new_users = db.session.scalars(
+        select(User.id).where(User.id > offset).order_by(User.id)).all()
+    started = time.perf_counter()
+
+    def timeline_progress(done):
+        rate = done / max(time.perf_counter() - started, 1e-9)
+        progress(f"timelines: {done:,} of {len(new_users):,} "
+                 f"({rate:,.0f} users/s)")
+
+    timeline.rebuild_blocks(new_users, block_size=TIMELINE_BLOCK_SIZE,
+                            progress=timeline_progress)
+
+    return loaded
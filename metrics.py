@@ -0,0 +1,145 @@
+"""Prometheus metrics for Warbler, served at /metrics.
+
+Exposes:
+
+- `warbler_request_duration_seconds`: histogram per endpoint, method and
+  status.
+- `warbler_requests_in_progress`: gauge per endpoint.
+- `warbler_db_pool_checkout_seconds`: histogram of how long requests waited
+  for a pooled database connection.
+- `warbler_db_connections_checked_out`: gauge of connections in use.
+- `warbler_user_cache_lookups_total`: logged-in user cache lookups by
+  result (hit or miss), and `warbler_user_cache_evictions_total`.
+- `warbler_ingested_messages_total`: messages written by the bulk ingest
+  API; its rate is ingest throughput in messages per second.
+
+Under gunicorn each worker is its own process, so set
+`PROMETHEUS_MULTIPROC_DIR` to an empty directory before the workers start
+(gunicorn.conf.py does this). prometheus_client then keeps every metric in
+memory-mapped files there, and a scrape of any worker adds up all of them.
+Without it, metrics are simply per process, which is fine for development.
+"""
+
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.pool import Pool, QueuePool
+
+REQUEST_DURATION = Histogram(
+    'warbler_request_duration_seconds', "Time spent handling a request.",
+    ['endpoint', 'method', 'status'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+
+REQUESTS_IN_PROGRESS = Gauge(
+    'warbler_requests_in_progress', "Requests currently being handled.",
+    ['endpoint'], multiprocess_mode='livesum')
+
+POOL_CHECKOUT = Histogram(
+    'warbler_db_pool_checkout_seconds',
+    "Time spent waiting for a pooled database connection.",
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 30))
+
+CONNECTIONS_CHECKED_OUT = Gauge(
+    'warbler_db_connections_checked_out',
+    "Database connections currently checked out of the pool.",
+    multiprocess_mode='livesum')
+
+USER_CACHE_LOOKUPS = Counter(
+    'warbler_user_cache_lookups',
+    "Logged-in user cache lookups, by whether they were served from it.",
+    ['result'])
+
+USER_CACHE_EVICTIONS = Counter(
+    'warbler_user_cache_evictions',
+    "Users dropped from the logged-in user cache to make room.")
+
+INGESTED_MESSAGES = Counter(
+    'warbler_ingested_messages', "Messages written by the bulk ingest API.")
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT.observe(time.perf_counter() - started)
+
+
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    CONNECTIONS_CHECKED_OUT.inc()
+
+
+def _checkin(dbapi_connection, connection_record):
+    CONNECTIONS_CHECKED_OUT.dec()
+
+
+def _endpoint():
+    # unmatched URLs share one label rather than one per path
+    return request.endpoint or 'unmatched'
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_endpoint = _endpoint()
+    REQUESTS_IN_PROGRESS.labels(g.metrics_endpoint).inc()
+
+
+def _observe(status):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        REQUEST_DURATION.labels(_endpoint(), request.method, status).observe(
+            time.perf_counter() - started)
+
+
+def _finish_request(response):
+    _observe(response.status_code)
+    return response
+
+
+def _teardown_request(exc):
+    # after_request is skipped when an exception propagates (as in debug
+    # and testing), so count those here
+    _observe(500)
+
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is not None:
+        REQUESTS_IN_PROGRESS.labels(endpoint).dec()
+
+
+def metrics_view():
+    """Every metric in the Prometheus text format."""
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Record request and pool metrics for `app` and serve /metrics.
+
+    Call before `connect_db`, so the engine is built with the timed pool.
+    """
+
+    engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    engine_options.setdefault('poolclass', TimedQueuePool)
+
+    if not event.contains(Pool, 'checkout', _checkout):
+        event.listen(Pool, 'checkout', _checkout)
+        event.listen(Pool, 'checkin', _checkin)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
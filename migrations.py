@@ -0,0 +1,274 @@
+"""Versioned schema migrations for Warbler.
+
+`db.create_all()` only creates missing tables; it never changes a table
+that already exists. Databases created before a schema change are brought up
+to date by the numbered steps in `MIGRATIONS`, which run in order and are
+recorded in the `schema_migrations` table:
+
+    flask db-upgrade        # apply everything that hasn't run yet
+    flask db-status         # list applied and pending migrations
+
+Every step is written to be safe on a database that `create_all()` already
+built with the current models, so fresh databases simply record them.
+
+Steps marked `transactional=False` run outside a transaction. Indexes are
+added that way with CREATE INDEX CONCURRENTLY, so they build without locking
+writes to busy tables. A concurrent build that fails leaves an INVALID
+index behind; `create_index_concurrently` drops and rebuilds it on the next
+run.
+
+Migrations are written as plain SQL rather than against the models, so they
+keep describing the schema as it was at that step.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import inspect, text
+
+import counters
+
+Migration = namedtuple('Migration',
+                       ['version', 'description', 'upgrade', 'transactional'])
+
+# any constant will do; it just keeps two upgrades from running at once
+ADVISORY_LOCK_ID = 0x77617262
+
+
+# the schema before migrations existed: the original tables plus home
+# timelines; later steps change it from here
+BASELINE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS users ("
+    "id serial PRIMARY KEY, "
+    "email text NOT NULL UNIQUE, "
+    "username text NOT NULL UNIQUE, "
+    "image_url text, "
+    "header_image_url text, "
+    "bio text, "
+    "location text, "
+    "password text NOT NULL)",
+
+    "CREATE TABLE IF NOT EXISTS follows ("
+    "user_being_followed_id integer NOT NULL "
+    "REFERENCES users (id) ON DELETE CASCADE, "
+    "user_following_id integer NOT NULL "
+    "REFERENCES users (id) ON DELETE CASCADE, "
+    "PRIMARY KEY (user_being_followed_id, user_following_id))",
+
+    "CREATE TABLE IF NOT EXISTS messages ("
+    "id serial PRIMARY KEY, "
+    "text varchar(140) NOT NULL, "
+    "timestamp timestamp NOT NULL, "
+    "user_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE)",
+
+    "CREATE TABLE IF NOT EXISTS likes ("
+    "id serial PRIMARY KEY, "
+    "user_id integer REFERENCES users (id) ON DELETE CASCADE, "
+    "message_id integer UNIQUE REFERENCES messages (id) ON DELETE CASCADE)",
+
+    "CREATE TABLE IF NOT EXISTS timeline_entries ("
+    "owner_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE, "
+    "message_id integer NOT NULL REFERENCES messages (id) ON DELETE CASCADE, "
+    "author_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE, "
+    "timestamp timestamp NOT NULL, "
+    "PRIMARY KEY (owner_id, message_id))",
+
+    "CREATE INDEX IF NOT EXISTS ix_timeline_entries_owner_recent "
+    "ON timeline_entries (owner_id, timestamp, message_id)",
+]
+
+
+def _create_missing_tables(connection):
+    for statement in BASELINE_SCHEMA:
+        connection.execute(text(statement))
+
+
+def _add_user_counters(connection):
+    for column in counters.COUNTER_COLUMNS:
+        connection.execute(text(
+            f"ALTER TABLE users ADD COLUMN IF NOT EXISTS {column} "
+            f"integer NOT NULL DEFAULT 0"))
+
+    counters.reconcile(connection)
+
+
+def _key_likes_on_user_and_message(connection):
+    columns = {c['name'] for c in inspect(connection).get_columns('likes')}
+    if 'id' not in columns:
+        return
+
+    # the old table allowed one like per message; keep the first of any
+    # duplicate (user_id, message_id) pairs before keying on them
+    connection.execute(text(
+        "DELETE FROM likes a USING likes b "
+        "WHERE a.user_id = b.user_id AND a.message_id = b.message_id "
+        "AND a.id > b.id"))
+    connection.execute(text(
+        "DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL"))
+    connection.execute(text(
+        "ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key"))
+    connection.execute(text(
+        "ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_pkey"))
+    connection.execute(text("ALTER TABLE likes DROP COLUMN id"))
+    connection.execute(text(
+        "ALTER TABLE likes ADD PRIMARY KEY (user_id, message_id)"))
+
+
+def create_index_concurrently(connection, name, definition):
+    """CREATE INDEX CONCURRENTLY `name` ON `definition`, replacing a broken
+    earlier attempt. Must run outside a transaction."""
+
+    valid = connection.scalar(text(
+        "SELECT i.indisvalid FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name"), {'name': name})
+
+    if valid is False:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    connection.execute(text(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+
+
+HOT_PATH_INDEXES = [
+    # profile messages, newest first (users_show)
+    ('ix_messages_user_recent', "messages (user_id, timestamp, id)"),
+    # who a user follows (following page, timeline fan-in)
+    ('ix_follows_follower',
+     "follows (user_following_id, user_being_followed_id)"),
+    # likers of a message, for cascades when it's deleted
+    ('ix_likes_message_id', "likes (message_id)"),
+    # home timelines (homepage)
+    ('ix_timeline_entries_owner_recent',
+     "timeline_entries (owner_id, timestamp, message_id)"),
+    ('ix_timeline_entries_message_id', "timeline_entries (message_id)"),
+    # /users?q= word-prefix search
+    ('ix_users_username_search',
+     "users USING gin (to_tsvector('simple'::regconfig, username))"),
+]
+
+
+def _add_hot_path_indexes(connection):
+    for name, definition in HOT_PATH_INDEXES:
+        create_index_concurrently(connection, name, definition)
+
+
+def _add_user_version(connection):
+    connection.execute(text(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS version "
+        "integer NOT NULL DEFAULT 1"))
+
+
+def _add_user_tombstones(connection):
+    connection.execute(text(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS deleted_at timestamp"))
+    create_index_concurrently(connection, 'ix_users_tombstones',
+                              "users (id) WHERE deleted_at IS NOT NULL")
+
+
+def _add_follow_and_like_times(connection):
+    # existing rows all get the time of the upgrade; a constant default
+    # doesn't rewrite the table
+    for table in ('follows', 'likes'):
+        connection.execute(text(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS created_at "
+            f"timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'utc')"))
+
+    for name, definition in (
+            ('ix_follows_followed_recent',
+             "follows (user_being_followed_id, created_at, user_following_id)"),
+            ('ix_follows_follower_recent',
+             "follows (user_following_id, created_at, user_being_followed_id)"),
+            ('ix_likes_user_recent', "likes (user_id, created_at, message_id)")):
+        create_index_concurrently(connection, name, definition)
+
+
+def _add_follow_suggestions(connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS follow_suggestions ("
+        "user_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE, "
+        "rank smallint NOT NULL, "
+        "suggested_id integer NOT NULL "
+        "REFERENCES users (id) ON DELETE CASCADE, "
+        "mutuals integer NOT NULL, "
+        "PRIMARY KEY (user_id, rank))"))
+    # a new, empty table; no need to build it concurrently
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_follow_suggestions_suggested_id "
+        "ON follow_suggestions (suggested_id)"))
+
+
+MIGRATIONS = [
+    Migration(1, "create missing tables", _create_missing_tables, True),
+    Migration(2, "denormalized user counters", _add_user_counters, True),
+    Migration(3, "key likes on (user_id, message_id)",
+              _key_likes_on_user_and_message, True),
+    Migration(4, "hot path indexes", _add_hot_path_indexes, False),
+    Migration(5, "user profile version", _add_user_version, True),
+    Migration(6, "user tombstones", _add_user_tombstones, False),
+    Migration(7, "follow and like times", _add_follow_and_like_times, False),
+    Migration(8, "follow suggestions", _add_follow_suggestions, True),
+]
+
+
+def _ensure_version_table(connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version integer PRIMARY KEY, "
+        "description text NOT NULL, "
+        "applied_at timestamp NOT NULL DEFAULT now())"))
+
+
+def applied_versions(engine):
+    """Versions already recorded in `schema_migrations`."""
+
+    with engine.begin() as connection:
+        _ensure_version_table(connection)
+        return set(connection.scalars(
+            text("SELECT version FROM schema_migrations")))
+
+
+def _record(connection, migration):
+    connection.execute(
+        text("INSERT INTO schema_migrations (version, description) "
+             "VALUES (:version, :description)"),
+        {'version': migration.version, 'description': migration.description})
+
+
+def upgrade(engine, target=None, progress=print):
+    """Apply pending migrations up to `target` (default: all).
+
+    Returns the versions applied, in order.
+    """
+
+    applied = []
+
+    with engine.connect() as lock:
+        lock = lock.execution_options(isolation_level='AUTOCOMMIT')
+        lock.execute(text("SELECT pg_advisory_lock(:id)"),
+                     {'id': ADVISORY_LOCK_ID})
+        try:
+            done = applied_versions(engine)
+            for migration in MIGRATIONS:
+                if migration.version in done:
+                    continue
+                if target is not None and migration.version > target:
+                    break
+
+                progress(f"{migration.version:04d} {migration.description}")
+                if migration.transactional:
+                    with engine.begin() as connection:
+                        migration.upgrade(connection)
+                        _record(connection, migration)
+                else:
+                    with engine.connect() as connection:
+                        migration.upgrade(connection.execution_options(
+                            isolation_level='AUTOCOMMIT'))
+                    with engine.begin() as connection:
+                        _record(connection, migration)
+
+                applied.append(migration.version)
+        finally:
+            lock.execute(text("SELECT pg_advisory_unlock(:id)"),
+                         {'id': ADVISORY_LOCK_ID})
+
+    return applied
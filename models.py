@@ -2,11 +2,57 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import DateTime, event, inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import hasher
+
+# the optional read-only bind in SQLALCHEMY_BINDS; see replica.py
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """Session that can send plain SELECTs to the read replica.
+
+    Only while `info['use_replica']` is set; flushes, writes and
+    SELECT ... FOR UPDATE always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get('use_replica')
+                and not self._flushing
+                and getattr(clause, 'is_select', False)
+                and getattr(clause, '_for_update_arg', None) is None):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+class utcnow(FunctionElement):
+    """The database's current time as naive UTC, like `datetime.utcnow()`;
+    a server default for rows inserted outside the ORM."""
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, 'postgresql')
+def _pg_utcnow(element, compiler, **kw):
+    return "(now() AT TIME ZONE 'utc')"
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
 
 
 class Follows(db.Model):
@@ -14,6 +60,18 @@ class Follows(db.Model):
 
     __tablename__ = 'follows'
 
+    __table_args__ = (
+        # the primary key leads with the followed user; this serves
+        # "who does this user follow"
+        db.Index('ix_follows_follower',
+                 'user_following_id', 'user_being_followed_id'),
+        # newest-first, keyset-paginated followers and following pages
+        db.Index('ix_follows_followed_recent',
+                 'user_being_followed_id', 'created_at', 'user_following_id'),
+        db.Index('ix_follows_follower_recent',
+                 'user_following_id', 'created_at', 'user_being_followed_id'),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -26,34 +84,87 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=utcnow(),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
+    __table_args__ = (
+        # a user's likes, most recently given first
+        db.Index('ix_likes_user_recent', 'user_id', 'created_at', 'message_id'),
     )
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True
     )
 
+    # a message can be liked by any number of users, once each
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+        index=True
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=utcnow(),
     )
 
 
+def _follow_graph():
+    """The shared follow index (see follow_graph.py), if it can answer for
+    the current session."""
+
+    if not has_app_context():
+        return None
+
+    graph = current_app.extensions.get('follow_graph')
+    if graph is not None and graph.can_answer(db.session()):
+        return graph
+    return None
+
+
+def _follow_exists(follower_id, followed_id):
+    """Does a follows row exist for this pair?"""
+
+    graph = _follow_graph()
+    if graph is not None:
+        return graph.is_following(follower_id, followed_id)
+
+    return db.session.scalar(
+        db.select(db.exists().where(
+            Follows.user_following_id == follower_id,
+            Follows.user_being_followed_id == followed_id)))
+
+
 class User(db.Model):
     """User in the system."""
 
     __tablename__ = 'users'
 
+    __table_args__ = (
+        # word-prefix username search on PostgreSQL; see search.py
+        db.Index('ix_users_username_search',
+                 db.text("to_tsvector('simple'::regconfig, username)"),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+        # the few tombstoned users, which every read path filters out
+        db.Index('ix_users_tombstones', 'id',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -94,6 +205,51 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts, maintained by counters.py. Read these instead of
+    # len() on the relationships below, which loads every row.
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # bumped whenever a profile column changes; cache keys and ETags for
+    # anything showing this user include it
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default='1',
+    )
+
+    # set when the account is deleted; the user is hidden from then on and
+    # their rows are purged in the background (see deletion.py)
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -119,16 +275,51 @@ class User(db.Model):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     def is_followed_by(self, other_user):
-        """Is this user followed by `other_user`?"""
+        """Is this user followed by `other_user`?
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        Answered from the follow graph index when there is one, else a
+        single EXISTS query; use `following_ids()` when checking many users.
+        """
+
+        return _follow_exists(follower_id=other_user.id, followed_id=self.id)
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_use`?
+
+        Answered from the follow graph index when there is one, else a
+        single EXISTS query; use `following_ids()` when checking many users.
+        """
+
+        return _follow_exists(follower_id=self.id, followed_id=other_user.id)
+
+    def following_ids(self):
+        """Set of IDs of every user this user follows, in one query."""
+
+        graph = _follow_graph()
+        if graph is not None:
+            return set(graph.following(self.id))
+
+        return set(db.session.scalars(
+            db.select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == self.id)))
+
+    def suggested_follows(self, limit=5):
+        """Accounts this user might follow, best first.
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        Reads the precomputed `follow_suggestions` (see suggestions.py) in
+        one query, skipping any followed since they were computed.
+        """
+
+        followed = db.exists().where(
+            Follows.user_following_id == self.id,
+            Follows.user_being_followed_id == User.id)
+
+        return (User.query
+                .join(FollowSuggestion, FollowSuggestion.suggested_id == User.id)
+                .filter(FollowSuggestion.user_id == self.id, ~followed)
+                .order_by(FollowSuggestion.rank)
+                .limit(limit)
+                .all())
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +328,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash_password(password)
 
         user = User(
             username=username,
@@ -158,23 +349,47 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made at a different bcrypt cost than the one
+        configured now, it is replaced with a fresh hash; the caller's commit
+        saves it.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check_password(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash_password(password)
                 return user
 
         return False
 
 
+PROFILE_COLUMNS = ('username', 'email', 'image_url', 'header_image_url',
+                   'bio', 'location')
+
+
+@event.listens_for(User, 'before_update')
+def _bump_version(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes()
+           for column in PROFILE_COLUMNS):
+        # incremented in SQL, so concurrent edits can't both write N+1
+        target.version = User.version + 1
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
 
+    __table_args__ = (
+        # serves the newest-first, keyset-paginated profile listing
+        db.Index('ix_messages_user_recent', 'user_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -188,7 +403,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -200,6 +415,74 @@ class Message(db.Model):
     user = db.relationship('User')
 
 
+class TimelineEntry(db.Model):
+    """A message fanned out to one user's home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_owner_recent',
+                 'owner_id', 'timestamp', 'message_id'),
+        # finds a deleted message's entries in every timeline
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
+
+    owner_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # copied from the message so unfollows and ordering never touch `messages`
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class FollowSuggestion(db.Model):
+    """An account suggested to a user; written by suggestions.py."""
+
+    __tablename__ = 'follow_suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # 0 is the best suggestion
+    rank = db.Column(
+        db.SmallInteger,
+        primary_key=True,
+    )
+
+    suggested_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+    )
+
+    # how many of the accounts the user follows follow this one
+    mutuals = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -0,0 +1,60 @@
+"""Detect N+1 query patterns in Warbler requests.
+
+Every SQL statement a request sends is counted by its text, which is the
+same for every run of a given query no matter what parameters it's given.
+When one statement runs `QUERY_REPEAT_THRESHOLD` times or more in a single
+request (typically a lazy load inside a template loop), we log it, or raise
+`RepeatedQueryError` if `QUERY_REPEAT_RAISE` is set, as the tests do.
+"""
+
+import logging
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class RepeatedQueryError(AssertionError):
+    """A request ran the same SQL statement too many times."""
+
+
+def _count_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    if has_request_context():
+        g.setdefault('statement_counts', Counter())[statement] += 1
+
+
+def _check_request(response):
+    counts = g.pop('statement_counts', None)
+    if not counts:
+        return response
+
+    threshold = current_app.config['QUERY_REPEAT_THRESHOLD']
+    repeated = {sql: n for sql, n in counts.items() if n >= threshold}
+
+    for sql, n in repeated.items():
+        logger.warning("%s ran the same statement %d times: %s",
+                       request.endpoint, n, sql)
+
+    if repeated and current_app.config['QUERY_REPEAT_RAISE']:
+        sql, n = max(repeated.items(), key=lambda item: item[1])
+        raise RepeatedQueryError(
+            f"{request.endpoint} ran the same statement {n} times "
+            f"(threshold {threshold}): {sql}")
+
+    return response
+
+
+def init_app(app):
+    """Count statements for every request `app` handles."""
+
+    app.config.setdefault('QUERY_REPEAT_THRESHOLD', 10)
+    app.config.setdefault('QUERY_REPEAT_RAISE', False)
+
+    if not event.contains(Engine, 'before_cursor_execute', _count_statement):
+        event.listen(Engine, 'before_cursor_execute', _count_statement)
+
+    app.after_request(_check_request)
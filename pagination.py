@@ -0,0 +1,96 @@
+"""Keyset (cursor) pagination helpers for Warbler.
+
+Pages are walked newest-first on a `(timestamp, id)` pair. The position of
+the last row on a page is handed to the client as an opaque `before=` token,
+and the next page starts strictly past it, so fetching page N costs the same
+index range scan as fetching page 1 (unlike OFFSET, which has to skip over
+every earlier row).
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination token can't be decoded."""
+
+
+def pack_token(parts):
+    """Encode a list of JSON-able sort-key values as a URL-safe token."""
+
+    raw = json.dumps(parts, separators=(",", ":")).encode()
+    return urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def unpack_token(token):
+    """Reverse `pack_token`; raises InvalidCursor for anything malformed."""
+
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        parts = json.loads(urlsafe_b64decode(padded))
+    except (DecodeError, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(token)
+
+    if not isinstance(parts, list):
+        raise InvalidCursor(token)
+
+    return parts
+
+
+def encode_cursor(timestamp, row_id):
+    """Turn a `(timestamp, id)` position into a URL-safe token."""
+
+    return pack_token([timestamp.isoformat(), row_id])
+
+
+def decode_cursor(token):
+    """Turn a token from `encode_cursor` back into `(timestamp, id)`.
+
+    Returns None for a missing token; raises InvalidCursor for a bad one.
+    """
+
+    if not token:
+        return None
+
+    try:
+        timestamp, row_id = unpack_token(token)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError):
+        raise InvalidCursor(token)
+
+
+def _timestamp_and_id(row):
+    return row.timestamp, row.id
+
+
+def keyset_page(query, timestamp_col, id_col, before=None, per_page=PAGE_SIZE,
+                position=_timestamp_and_id):
+    """Fetch one newest-first page of `query`.
+
+    `before` is a decoded `(timestamp, id)` cursor or None for the first
+    page. `position(row)` gives a row's values of the two sort columns; by
+    default its `.timestamp` and `.id`. Returns `(rows, next_cursor)`, where
+    `next_cursor` is the token for the following page, or None when there are
+    no older rows.
+    """
+
+    if before is not None:
+        query = query.filter(tuple_(timestamp_col, id_col) < before)
+
+    # one extra row tells us whether an older page exists
+    rows = (query
+            .order_by(timestamp_col.desc(), id_col.desc())
+            .limit(per_page + 1)
+            .all())
+
+    if len(rows) <= per_page:
+        return rows, None
+
+    rows = rows[:per_page]
+    return rows, encode_cursor(*position(rows[-1]))
@@ -0,0 +1,108 @@
+"""Password hashing for Warbler.
+
+bcrypt is deliberately slow, and running it inline ties up the request
+worker for the whole hash. Hashes and checks are instead handed to a small
+process pool (`PASSWORD_HASH_WORKERS` processes, 0 to hash inline), with at
+most `PASSWORD_HASH_MAX_PENDING` jobs queued so a login storm can't pile up
+unbounded work.
+
+The bcrypt cost comes from `BCRYPT_LOG_ROUNDS`, so each environment can pick
+its own. Hashes made at a different cost are upgraded the next time their
+owner logs in; see `needs_rehash`.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+
+DEFAULT_LOG_ROUNDS = 12
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password, hashed)
+
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded process pool, or inline with no workers."""
+
+    def __init__(self, rounds=DEFAULT_LOG_ROUNDS, workers=0, max_pending=None):
+        self.configure(rounds, workers, max_pending)
+        self._pool = None
+        self._pool_pid = None
+        self._lock = Lock()
+
+    def configure(self, rounds, workers, max_pending=None):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending or max(workers * 4, 1)
+        self._slots = BoundedSemaphore(self.max_pending)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        with self._slots:
+            return self._get_pool().submit(fn, *args).result()
+
+    def _get_pool(self):
+        # gunicorn forks workers after import, and a pool can't be shared
+        # across a fork, so each process starts its own on first use
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown()
+            self._pool = None
+
+    def hash_password(self, password):
+        """bcrypt hash of `password` at the configured cost, as text."""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        return self._run(_hash, password.encode('utf-8'), self.rounds)
+
+    def check_password(self, hashed, password):
+        """Does `password` match the stored bcrypt hash?"""
+
+        if not hashed or not password:
+            return False
+
+        return self._run(_check, hashed.encode('utf-8'),
+                         password.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made at a different cost than the configured one?"""
+
+        # bcrypt hashes look like $2b$<cost>$<salt+hash>
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+hasher = PasswordHasher()
+
+
+def init_app(app):
+    """Configure the shared hasher from the app config."""
+
+    app.config.setdefault('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS)
+    app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+    app.config.setdefault('PASSWORD_HASH_MAX_PENDING', None)
+
+    hasher.shutdown()
+    hasher.configure(app.config['BCRYPT_LOG_ROUNDS'],
+                     app.config['PASSWORD_HASH_WORKERS'],
+                     app.config['PASSWORD_HASH_MAX_PENDING'])
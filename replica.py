@@ -0,0 +1,60 @@
+"""Send read-only page views to a read replica.
+
+When `SQLALCHEMY_BINDS` has a 'replica' engine, GET requests to views
+marked `@read_only` run their SELECTs against it (see `RoutingSession` in
+models.py). Every other request, and every write, uses the primary.
+
+A replica trails the primary slightly, so a user who has just posted might
+not see their own change there. After any POST we store a deadline in
+their session, and until it passes (`REPLICA_PIN_SECONDS`) their requests
+read from the primary.
+"""
+
+import time
+
+from flask import current_app, request, session
+
+from models import REPLICA_BIND, db
+
+PIN_KEY = 'read_primary_until'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def read_only(view):
+    """Mark `view` as safe to serve from the replica."""
+
+    view.read_only = True
+    return view
+
+
+def _route_reads():
+    if REPLICA_BIND not in db.engines or request.method not in SAFE_METHODS:
+        return
+
+    view = current_app.view_functions.get(request.endpoint)
+    if (getattr(view, 'read_only', False)
+            and session.get(PIN_KEY, 0) <= time.time()):
+        db.session.info['use_replica'] = True
+
+
+def _pin_to_primary(response):
+    if REPLICA_BIND in db.engines and request.method not in SAFE_METHODS:
+        session[PIN_KEY] = (time.time()
+                            + current_app.config['REPLICA_PIN_SECONDS'])
+
+    return response
+
+
+def _teardown_request(exc):
+    # the session outlives the request when an app context was already pushed
+    db.session.info.pop('use_replica', None)
+
+
+def init_app(app):
+    """Route `@read_only` GETs on `app` to the replica, if there is one."""
+
+    app.config.setdefault('REPLICA_PIN_SECONDS', 5)
+    app.before_request(_route_reads)
+    app.after_request(_pin_to_primary)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,139 @@
+"""Indexed, paginated user search for the /users directory.
+
+Usernames are matched word-by-word on prefixes ("tuck" finds "tucker_diane"
+and "old_tucker") using the database's own full-text index: a GIN index over
+`to_tsvector('simple', username)` on PostgreSQL and an FTS5 table on SQLite.
+Results come back best-match first (exact username, then username prefix,
+then any word prefix) and are paged with keyset cursors, so neither the
+search nor deep pages fall back to scanning `users`.
+"""
+
+import re
+
+from sqlalchemy import (DDL, case, event, func, literal_column, select, text,
+                        tuple_)
+
+from models import User
+from pagination import InvalidCursor, pack_token, unpack_token
+
+DIRECTORY_PAGE_SIZE = 60
+
+# must match the text search config of ix_users_username_search in models.py
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
+
+users = User.__table__
+
+# SQLite keeps a shadow FTS5 table of usernames, synced by triggers.
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE users_fts USING fts5(
+           username, content='users', content_rowid='id')""",
+    """CREATE TRIGGER users_fts_insert AFTER INSERT ON users BEGIN
+           INSERT INTO users_fts(rowid, username)
+           VALUES (new.id, new.username);
+       END""",
+    """CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN
+           INSERT INTO users_fts(users_fts, rowid, username)
+           VALUES ('delete', old.id, old.username);
+       END""",
+    """CREATE TRIGGER users_fts_update AFTER UPDATE OF username ON users BEGIN
+           INSERT INTO users_fts(users_fts, rowid, username)
+           VALUES ('delete', old.id, old.username);
+           INSERT INTO users_fts(rowid, username)
+           VALUES (new.id, new.username);
+       END""",
+]
+
+for statement in SQLITE_DDL:
+    event.listen(users, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+
+event.listen(users, 'before_drop',
+             DDL("DROP TABLE IF EXISTS users_fts").execute_if(dialect='sqlite'))
+
+
+def search_words(q):
+    """The searchable words in a query string, lowercased."""
+
+    return re.findall(r"[^\W_]+", q.lower())
+
+
+def matching(q, dialect_name):
+    """WHERE clause for users whose username has a word starting with each
+    word of `q`, or None when `q` has nothing searchable in it."""
+
+    words = search_words(q)
+    if not words:
+        return None
+
+    if dialect_name == 'sqlite':
+        match = " ".join(f'"{word}"*' for word in words)
+        hits = (select(literal_column('rowid'))
+                .select_from(text('users_fts'))
+                .where(text('users_fts MATCH :match').bindparams(match=match)))
+        return User.id.in_(hits)
+
+    tsquery = " & ".join(f"{word}:*" for word in words)
+    return (func.to_tsvector(SEARCH_CONFIG, User.username)
+            .bool_op('@@')(func.to_tsquery(SEARCH_CONFIG, tsquery)))
+
+
+def relevance(q):
+    """0 for an exact username match, 1 for a username prefix, else 2."""
+
+    return case((func.lower(User.username) == q.lower(), 0),
+                (User.username.istartswith(q, autoescape=True), 1),
+                else_=2)
+
+
+def directory_page(session, q=None, after=None, per_page=DIRECTORY_PAGE_SIZE):
+    """One page of the user directory, optionally filtered by `q`.
+
+    `after` is the token from the previous page. Returns `(users,
+    next_token)`; `next_token` is None on the last page.
+    """
+
+    query = session.query(User)
+
+    if q:
+        condition = matching(q, session.get_bind().dialect.name)
+        if condition is None:
+            return [], None
+        query = query.filter(condition)
+        sort_key = (relevance(q), User.username)
+        key_types = (int, str)
+    else:
+        sort_key = (User.username,)
+        key_types = (str,)
+
+    if after:
+        position = unpack_token(after)
+        # a tampered token mustn't reach the SQL with the wrong types
+        if (len(position) != len(sort_key)
+                or any(type(value) is not key_type
+                       for value, key_type in zip(position, key_types))):
+            raise InvalidCursor(after)
+        query = query.filter(tuple_(*sort_key) > tuple(position))
+
+    # one extra row tells us whether another page exists
+    rows = query.order_by(*sort_key).limit(per_page + 1).all()
+
+    if len(rows) <= per_page:
+        return rows, None
+
+    rows = rows[:per_page]
+    last = rows[-1]
+    position = [last.username]
+    if q:
+        position.insert(0, _rank_of(last.username, q))
+
+    return rows, pack_token(position)
+
+
+def _rank_of(username, q):
+    """Python mirror of `relevance()` for building the next-page token."""
+
+    if username.lower() == q.lower():
+        return 0
+    if username.lower().startswith(q.lower()):
+        return 1
+    return 2
@@ -1,20 +1,28 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db,app
-from models import User, Message, Follows
+    python seed.py                      # drop, recreate and load generator/
+    python seed.py --dir snapshots/prod --batch-size 50000 --append
+"""
 
-with app.app_context():
-    db.drop_all()
-    db.create_all()
+import argparse
 
-    with open('generator/users.csv') as users:
-        db.session.bulk_insert_mappings(User, DictReader(users))
+from app import app
+from loader import DEFAULT_BATCH_SIZE, load_snapshot
 
-    with open('generator/messages.csv') as messages:
-        db.session.bulk_insert_mappings(Message, DictReader(messages))
+parser = argparse.ArgumentParser(description="Load Warbler CSV snapshots.")
+parser.add_argument('--dir', default='generator',
+                    help="directory holding users/messages/follows.csv")
+parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+parser.add_argument('--parallel', type=int, default=2,
+                    help="tables to load at once after users")
+parser.add_argument('--append', action='store_true',
+                    help="add to the existing data instead of dropping it")
+args = parser.parse_args()
 
-    with open('generator/follows.csv') as follows:
-        db.session.bulk_insert_mappings(Follows, DictReader(follows))
+with app.app_context():
+    loaded = load_snapshot(args.dir,
+                           batch_size=args.batch_size,
+                           append=args.append,
+                           parallel=args.parallel)
 
-    db.session.commit()
+print(", ".join(f"{count:,} {table}" for table, count in loaded.items()))
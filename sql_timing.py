@@ -0,0 +1,100 @@
+"""Per-request SQL counters for Warbler.
+
+Engine events count the statements each request sends, the time spent in
+the database and the rows fetched. The totals go out on every response as a
+`Server-Timing` header, which browser dev tools show next to the request:
+
+    Server-Timing: sql;dur=4.21;desc="3 statements, 102 rows", app;dur=11.80
+
+Any request slower than `SLOW_REQUEST_MS` is logged together with each of
+its statements and how long they took, so a slow page points straight at
+the query behind it. Set `SERVER_TIMING_ENABLED` to False to keep the
+header off public responses.
+"""
+
+import logging
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class RequestSQLStats:
+    """SQL totals for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = []
+        self.db_seconds = 0.0
+        self.rows = 0
+
+    def record(self, statement, seconds, rows):
+        self.statements.append((statement, seconds))
+        self.db_seconds += seconds
+        self.rows += rows
+
+
+def _start_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    # the execution context lives for exactly one statement, so nothing
+    # is left behind when a statement fails
+    if context is not None:
+        context._sql_timing_started = time.perf_counter()
+
+
+def _finish_statement(conn, cursor, statement, parameters, context,
+                      executemany):
+    started = getattr(context, '_sql_timing_started', None)
+    stats = g.get('sql_stats') if has_request_context() else None
+    if stats is not None and started is not None:
+        # rowcount is only the number fetched for statements returning rows
+        rows = max(cursor.rowcount, 0) if cursor.description else 0
+        stats.record(statement, time.perf_counter() - started, rows)
+
+
+def _start_request():
+    g.sql_stats = RequestSQLStats()
+
+
+def _finish_request(response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+
+    total_ms = (time.perf_counter() - stats.started) * 1000
+    db_ms = stats.db_seconds * 1000
+
+    if current_app.config['SERVER_TIMING_ENABLED']:
+        response.headers.add(
+            'Server-Timing',
+            f'sql;dur={db_ms:.2f};desc="{len(stats.statements)} statements, '
+            f'{stats.rows} rows", app;dur={total_ms:.2f}')
+
+    if total_ms >= current_app.config['SLOW_REQUEST_MS']:
+        logger.warning(
+            "slow request %s %s (%s): %.1f ms, %d statements in %.1f ms, "
+            "%d rows\n%s",
+            request.method, request.path, request.endpoint, total_ms,
+            len(stats.statements), db_ms, stats.rows,
+            "\n".join(f"  {seconds * 1000:8.2f} ms  {statement}"
+                      for statement, seconds in stats.statements))
+
+    return response
+
+
+def init_app(app):
+    """Time the SQL of every request `app` handles."""
+
+    app.config.setdefault('SERVER_TIMING_ENABLED', True)
+    app.config.setdefault('SLOW_REQUEST_MS', 500)
+
+    for name, listener in (('before_cursor_execute', _start_statement),
+                           ('after_cursor_execute', _finish_statement)):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
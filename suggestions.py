@@ -0,0 +1,129 @@
+"""Offline "who to follow" suggestions.
+
+A user is suggested the accounts most followed by the people they follow
+(friends of friends), leaving out anyone they already follow. Working that
+out per request is a two-hop join over `follows`, so instead
+`flask suggest-follows` computes it for every user at once and stores each
+user's top `SUGGESTIONS_PER_USER` in `follow_suggestions`. The homepage
+reads them back with one primary-key range scan (`User.suggested_follows()`).
+
+The job loads `follows` into a SciPy sparse matrix A, with A[u, v] = 1 when
+u follows v. Row u of A @ A then counts, for every account w, how many of
+the accounts u follows follow w. Rows are multiplied and ranked a block at
+a time, so memory stays bounded, and each block's suggestions replace the
+old ones in a transaction of its own.
+
+Only this job needs NumPy and SciPy; web workers never import it.
+"""
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import and_, delete, insert, select, true
+
+from models import db, Follows, FollowSuggestion
+
+SUGGESTIONS_PER_USER = 10
+BLOCK_SIZE = 10_000
+FETCH_SIZE = 100_000
+
+suggestions = FollowSuggestion.__table__
+
+
+def load_graph(connection):
+    """Read `follows` into `(user_ids, A)`.
+
+    `user_ids` is the sorted array of users in any follow, and A the CSR
+    adjacency matrix over positions in it.
+    """
+
+    result = connection.execution_options(yield_per=FETCH_SIZE).execute(
+        select(Follows.user_following_id, Follows.user_being_followed_id))
+    chunks = [np.array(rows, dtype=np.int64).reshape(-1, 2)
+              for rows in result.partitions()]
+    pairs = np.concatenate(chunks) if chunks else np.empty((0, 2), np.int64)
+
+    user_ids, positions = np.unique(pairs, return_inverse=True)
+    positions = positions.reshape(pairs.shape)
+
+    graph = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int32),
+         (positions[:, 0], positions[:, 1])),
+        shape=(len(user_ids), len(user_ids)))
+
+    return user_ids, graph
+
+
+def rank_block(graph, start, stop, per_user=SUGGESTIONS_PER_USER):
+    """Top `per_user` two-hop suggestions for rows `start:stop` of `graph`.
+
+    Returns `(rows, cols, mutuals, ranks)` arrays ordered by row, then rank.
+    """
+
+    block = graph[start:stop]
+    two_hop = block @ graph
+    # zero out accounts already followed
+    two_hop = (two_hop - two_hop.multiply(block)).tocoo()
+
+    rows = two_hop.row.astype(np.int64) + start
+    cols = two_hop.col.astype(np.int64)
+    mutuals = two_hop.data
+    # nor suggest users to themselves
+    keep = (mutuals > 0) & (rows != cols)
+    rows, cols, mutuals = rows[keep], cols[keep], mutuals[keep]
+
+    # most mutuals first, ties to the lower ID
+    order = np.lexsort((cols, -mutuals, rows))
+    rows, cols, mutuals = rows[order], cols[order], mutuals[order]
+
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = ranks < per_user
+    return rows[keep], cols[keep], mutuals[keep], ranks[keep]
+
+
+def _owned_by_block(user_ids, start, stop):
+    """Condition on `follow_suggestions.user_id` for the block's users and
+    anyone between them and the next block who has no follows."""
+
+    conditions = []
+    if start > 0:
+        conditions.append(suggestions.c.user_id >= int(user_ids[start]))
+    if stop < len(user_ids):
+        conditions.append(suggestions.c.user_id < int(user_ids[stop]))
+
+    return and_(true(), *conditions)
+
+
+def build(per_user=SUGGESTIONS_PER_USER, block_size=BLOCK_SIZE, progress=print):
+    """Recompute every user's suggestions; returns how many were written."""
+
+    engine = db.engine
+    with engine.connect() as connection:
+        user_ids, graph = load_graph(connection)
+
+    if not len(user_ids):
+        with engine.begin() as connection:
+            connection.execute(delete(suggestions))
+        return 0
+
+    written = 0
+
+    for start in range(0, len(user_ids), block_size):
+        stop = min(start + block_size, len(user_ids))
+        rows, cols, mutuals, ranks = rank_block(graph, start, stop, per_user)
+
+        with engine.begin() as connection:
+            connection.execute(delete(suggestions).where(
+                _owned_by_block(user_ids, start, stop)))
+            if len(rows):
+                connection.execute(insert(suggestions), [
+                    {'user_id': user_id, 'rank': rank,
+                     'suggested_id': suggested_id, 'mutuals': count}
+                    for user_id, rank, suggested_id, count in zip(
+                        user_ids[rows].tolist(), ranks.tolist(),
+                        user_ids[cols].tolist(), mutuals.tolist())])
+
+        written += len(rows)
+        progress(f"{stop:,}/{len(user_ids):,} users, "
+                 f"{written:,} suggestions")
+
+    return written
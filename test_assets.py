@@ -0,0 +1,129 @@
+"""Fingerprinted static asset tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask import url_for
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import assets
+import caching
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class AssetsTestCase(TestCase):
+    """Test the build, fingerprinted URLs and encoding negotiation."""
+
+    def setUp(self):
+        self.original_folder = app.static_folder
+        self.tmp = tempfile.mkdtemp()
+        static = os.path.join(self.tmp, 'static')
+        shutil.copytree(self.original_folder, static,
+                        ignore=shutil.ignore_patterns(assets.BUILD_DIR))
+
+        app.static_folder = static
+        self.manifest = assets.build(static)
+        assets.load_manifest(app)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.static_folder = self.original_folder
+        assets.load_manifest(app)
+        shutil.rmtree(self.tmp)
+
+    def test_manifest_and_urls(self):
+        hashed = self.manifest['stylesheets/style.css']
+        self.assertRegex(hashed, r"^build/stylesheets/style\.\w{12}\.css$")
+
+        with app.test_request_context():
+            self.assertEqual(url_for('static', filename='stylesheets/style.css'),
+                             f"/static/{hashed}")
+            # files the build doesn't know about are left alone
+            self.assertEqual(url_for('static', filename='missing.css'),
+                             "/static/missing.css")
+
+        html = self.client.get("/login").get_data(as_text=True)
+        self.assertIn(f'href="/static/{hashed}"', html)
+
+    def test_stored_static_urls(self):
+        avatar = self.manifest['images/default-pic.png']
+        with app.test_request_context():
+            self.assertEqual(caching.asset_url("/static/images/default-pic.png"),
+                             f"/static/{avatar}")
+            for url in ("https://example.com/me.png", "/static/missing.png",
+                        None):
+                self.assertEqual(caching.asset_url(url), url)
+
+        # users get the default avatar when they sign up without one
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add(User(id=7001, username="plain",
+                                email="plain@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.commit()
+
+        html = self.client.get("/users/7001").get_data(as_text=True)
+        self.assertIn(f'src="/static/{avatar}"', html)
+        self.assertNotIn('src="/static/images/', html)
+
+    def test_manifest_is_not_immutable(self):
+        resp = self.client.get(f"/static/{assets.BUILD_DIR}/{assets.MANIFEST}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], "public, no-cache")
+
+    def test_stylesheet_points_at_fingerprinted_images(self):
+        with open(os.path.join(app.static_folder,
+                               self.manifest['stylesheets/style.css'])) as f:
+            css = f.read()
+
+        self.assertIn(f"/static/{self.manifest['images/nav-bg.png']}", css)
+        self.assertNotIn('url("/static/images/', css)
+
+    def test_encoding_negotiation(self):
+        url = f"/static/{self.manifest['stylesheets/style.css']}"
+        with open(os.path.join(app.static_folder,
+                               self.manifest['stylesheets/style.css']),
+                  'rb') as f:
+            original = f.read()
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertEqual(gzip.decompress(resp.data), original)
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(resp.headers['Cache-Control'],
+                         "public, max-age=31536000, immutable")
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data, original)
+
+        if assets.brotli is not None:
+            resp = self.client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+            self.assertEqual(resp.headers['Content-Encoding'], 'br')
+            self.assertEqual(assets.brotli.decompress(resp.data), original)
+
+    def test_images_are_not_recompressed(self):
+        hashed = self.manifest['images/warbler-logo.png']
+        self.assertFalse(os.path.exists(
+            os.path.join(app.static_folder, hashed + '.gz')))
+
+        resp = self.client.get(f"/static/{hashed}",
+                               headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('Content-Encoding', resp.headers)
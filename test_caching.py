@@ -0,0 +1,146 @@
+"""HTTP caching policy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_caching.py
+
+
+import os
+from unittest import TestCase
+
+from flask import template_rendered
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import likes
+import timeline
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class CachingTestCase(TestCase):
+    """Test static caching, private ETags with 304s, and no-store."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            db.session.add(User(id=6001, username="viewer",
+                                email="viewer@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.add(User(id=6002, username="author",
+                                email="author@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.flush()
+            db.session.add(Follows(user_being_followed_id=6002,
+                                   user_following_id=6001))
+            db.session.add(Message(id=600, text="cache me", user_id=6002))
+            db.session.flush()
+            timeline.rebuild(6001)
+            db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 6001
+
+    def get_rendering(self, path, **kwargs):
+        """GET `path`; return the response and the templates rendered."""
+
+        rendered = []
+
+        def record(sender, template, context, **extra):
+            rendered.append(template.name)
+
+        with template_rendered.connected_to(record, app):
+            resp = self.client.get(path, **kwargs)
+
+        return resp, rendered
+
+    def test_static_assets(self):
+        # without a build, URLs carry the content hash as a query string
+        manifest = app.extensions['assets']
+        app.extensions['assets'] = {}
+        try:
+            with app.test_request_context():
+                url = app.jinja_env.globals['static_url']('stylesheets/style.css')
+        finally:
+            app.extensions['assets'] = manifest
+        self.assertRegex(url, r"^/static/stylesheets/style\.css\?v=\w{12}$")
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.headers['Cache-Control'],
+                         "public, max-age=31536000, immutable")
+
+        resp = self.client.get("/static/stylesheets/style.css")
+        self.assertEqual(resp.headers['Cache-Control'], "public, no-cache")
+
+        # a made-up or outdated version isn't the file's content
+        resp = self.client.get("/static/stylesheets/style.css?v=0123456789ab")
+        self.assertEqual(resp.headers['Cache-Control'], "public, no-cache")
+
+        resp = self.client.get("/static/stylesheets/style.css",
+                               headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_homepage_etag(self):
+        resp, rendered = self.get_rendering("/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], "private, no-cache")
+        etag = resp.headers['ETag']
+
+        resp, rendered = self.get_rendering("/", headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(rendered, [])
+
+        # liking a message on the page changes it
+        with app.app_context():
+            likes.set_liked(6001, 600, True)
+            db.session.commit()
+
+        resp, rendered = self.get_rendering("/", headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(rendered, ['home.html'])
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_homepage_etag_follows_counters(self):
+        etag = self.client.get("/").headers['ETag']
+
+        # someone else follows the viewer; the sidebar count changes
+        with app.app_context():
+            db.session.add(Follows(user_being_followed_id=6001,
+                                   user_following_id=6002))
+            db.session.commit()
+
+        resp = self.client.get("/", headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_users_show_etag_follows_profile_version(self):
+        etag = self.client.get("/users/6002").headers['ETag']
+        resp = self.client.get("/users/6002", headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+
+        with app.app_context():
+            author = db.session.get(User, 6002)
+            self.assertEqual(author.version, 1)
+            author.bio = "new bio"
+            db.session.commit()
+            self.assertEqual(author.version, 2)
+
+            # counters aren't part of the profile
+            author.messages_count += 1
+            db.session.commit()
+            self.assertEqual(author.version, 2)
+
+        resp = self.client.get("/users/6002", headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("new bio", resp.get_data(as_text=True))
+
+    def test_other_pages_are_not_stored(self):
+        resp = self.client.get("/users/6002/following")
+        self.assertEqual(resp.headers['Cache-Control'], "no-store")
+        self.assertNotIn('ETag', resp.headers)
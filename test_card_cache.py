@@ -0,0 +1,114 @@
+"""Message card fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_card_cache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from card_cache import CardCache, card_cache
+import timeline
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class CardCacheTestCase(TestCase):
+    """Test that cards are reused, invalidated and evicted."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            db.session.add(User(id=7001, username="viewer",
+                                email="viewer@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.add(User(id=7002, username="author",
+                                email="author@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.flush()
+            db.session.add(Follows(user_being_followed_id=7002,
+                                   user_following_id=7001))
+            db.session.add(Message(id=700, text="first card", user_id=7002))
+            db.session.add(Message(id=701, text="second card", user_id=7002))
+            db.session.flush()
+            timeline.rebuild(7001)
+            db.session.commit()
+
+        card_cache.clear()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 7001
+
+    def cards_rendered(self, path):
+        """GET `path`; return the page and how many cards were rendered."""
+
+        misses = card_cache.stats()['misses']
+        html = self.client.get(path).get_data(as_text=True)
+        return html, card_cache.stats()['misses'] - misses
+
+    def test_cards_are_reused_across_pages(self):
+        html, rendered = self.cards_rendered("/")
+        self.assertEqual(rendered, 2)
+        self.assertIn("first card", html)
+        self.assertIn("@author", html)
+
+        html, rendered = self.cards_rendered("/users/7002")
+        self.assertEqual(rendered, 0)
+        self.assertIn("second card", html)
+
+    def test_profile_edit_invalidates_author_cards(self):
+        self.cards_rendered("/")
+
+        with app.app_context():
+            author = db.session.get(User, 7002)
+            author.messages_count += 1
+            db.session.commit()
+        self.assertEqual(card_cache.stats()['entries'], 2)
+
+        with app.app_context():
+            author = db.session.get(User, 7002)
+            author.username = "renamed"
+            db.session.commit()
+        self.assertEqual(card_cache.stats()['entries'], 0)
+
+        html, rendered = self.cards_rendered("/")
+        self.assertEqual(rendered, 2)
+        self.assertIn("@renamed", html)
+
+    def test_message_delete_invalidates_card(self):
+        self.cards_rendered("/")
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 7002
+        self.client.post("/messages/700/delete")
+
+        self.assertEqual(card_cache.stats()['entries'], 1)
+
+    def test_eviction_by_size(self):
+        cache = CardCache(max_bytes=10)
+        cache.put((1, 1, 1), "aaaa")
+        cache.put((2, 1, 1), "bbbb")
+        self.assertEqual(cache.get((1, 1, 1)), "aaaa")
+
+        # the least recently used card goes
+        cache.put((3, 2, 1), "cccc")
+        self.assertIsNone(cache.get((2, 1, 1)))
+        self.assertEqual(cache.get((1, 1, 1)), "aaaa")
+        self.assertEqual(cache.stats()['bytes'], 8)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        # too big to ever fit
+        cache.put((4, 2, 1), "d" * 11)
+        self.assertIsNone(cache.get((4, 2, 1)))
+
+        cache.invalidate_author(1)
+        self.assertEqual(cache.stats()['entries'], 1)
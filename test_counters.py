@@ -0,0 +1,125 @@
+"""Denormalized user counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import jobs
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class CountersTestCase(TestCase):
+    """Test that User counters follow posts, follows and likes."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.fan_id = 3001
+            self.star_id = 3002
+
+            db.session.add_all([
+                User(id=self.fan_id, username="fan",
+                     email="fan@test.com", password="HASHED_PASSWORD"),
+                User(id=self.star_id, username="star",
+                     email="star@test.com", password="HASHED_PASSWORD"),
+            ])
+            db.session.commit()
+
+            self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def counts(self, user_id):
+        user = db.session.get(User, user_id)
+        db.session.refresh(user)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def test_follow_and_unfollow(self):
+        with app.app_context():
+            with self.client as c:
+                self.login(c, self.fan_id)
+                c.post(f"/users/follow/{self.star_id}")
+
+                self.assertEqual(self.counts(self.fan_id), (0, 1, 0, 0))
+                self.assertEqual(self.counts(self.star_id), (0, 0, 1, 0))
+
+                c.post(f"/users/stop-following/{self.star_id}")
+
+                self.assertEqual(self.counts(self.fan_id), (0, 0, 0, 0))
+                self.assertEqual(self.counts(self.star_id), (0, 0, 0, 0))
+
+    def test_post_like_and_delete(self):
+        with app.app_context():
+            with self.client as c:
+                self.login(c, self.star_id)
+                c.post("/messages/new", data={"text": "count me"})
+                msg = Message.query.filter_by(text="count me").one()
+                self.assertEqual(self.counts(self.star_id), (1, 0, 0, 0))
+
+                self.login(c, self.fan_id)
+                c.post(f"/users/add_like/{msg.id}")
+                self.assertEqual(self.counts(self.fan_id), (0, 0, 0, 1))
+
+                # deleting the message takes the fan's like with it
+                self.login(c, self.star_id)
+                c.post(f"/messages/{msg.id}/delete")
+                self.assertEqual(self.counts(self.star_id), (0, 0, 0, 0))
+                self.assertEqual(self.counts(self.fan_id), (0, 0, 0, 0))
+
+    def test_deleted_follower(self):
+        with app.app_context():
+            db.session.add(Follows(user_being_followed_id=self.star_id,
+                                   user_following_id=self.fan_id))
+            db.session.commit()
+            self.assertEqual(self.counts(self.star_id), (0, 0, 1, 0))
+
+            with self.client as c:
+                self.login(c, self.fan_id)
+                c.post("/users/delete")
+
+            # the follow goes when the background purge runs
+            jobs.runner.join()
+            self.assertEqual(self.counts(self.star_id), (0, 0, 0, 0))
+
+    def test_reconcile(self):
+        with app.app_context():
+            db.session.add_all([
+                Message(id=70, text="hi", user_id=self.star_id),
+                Follows(user_being_followed_id=self.star_id,
+                        user_following_id=self.fan_id),
+            ])
+            db.session.commit()
+            db.session.add(Likes(user_id=self.fan_id, message_id=70))
+            db.session.commit()
+
+            # bulk writes skip the flush hooks and leave counters stale
+            Likes.query.delete()
+            Follows.query.delete()
+            db.session.commit()
+            self.assertEqual(self.counts(self.fan_id), (0, 1, 0, 1))
+
+            result = app.test_cli_runner().invoke(args=["reconcile-counters"])
+            self.assertIn("Repaired counters for 2 user(s).", result.output)
+
+            self.assertEqual(self.counts(self.fan_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.star_id), (1, 0, 0, 0))
@@ -0,0 +1,127 @@
+"""Tombstoned user deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_deletion.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import func, select
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import deletion
+import jobs
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class DeletionTestCase(TestCase):
+    """Test that deleted users are hidden at once and purged later."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid, name in ((9001, "leaver"), (9002, "friend")):
+                db.session.add(User(id=uid, username=name,
+                                    email=f"{name}@test.com",
+                                    password="HASHED_PASSWORD"))
+            db.session.flush()
+            db.session.add_all([
+                Follows(user_being_followed_id=9001, user_following_id=9002),
+                Follows(user_being_followed_id=9002, user_following_id=9001),
+            ])
+            db.session.flush()
+            db.session.add_all([
+                Message(id=900 + n, text=f"leaving {n}", user_id=9001)
+                for n in range(5)])
+            db.session.add(Message(id=990, text="staying", user_id=9002))
+            db.session.flush()
+            db.session.add_all([Likes(user_id=9002, message_id=900),
+                                Likes(user_id=9001, message_id=990)])
+            timeline.rebuild(9001)
+            timeline.rebuild(9002)
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def count(self, model, *criteria):
+        with app.app_context():
+            return db.session.scalar(
+                select(func.count()).select_from(model).where(*criteria))
+
+    def test_tombstoned_user_is_hidden(self):
+        with app.app_context():
+            deletion.tombstone(db.session.get(User, 9001))
+            db.session.commit()
+
+        self.login(9002)
+        self.assertEqual(self.client.get("/users/9001").status_code, 404)
+        self.assertEqual(self.client.get("/messages/900").status_code, 404)
+
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn("staying", html)
+        self.assertNotIn("leaving", html)
+
+        for path in ("/users", "/users/9002/followers",
+                     "/users/9002/following", "/users/9002/likes"):
+            html = self.client.get(path).get_data(as_text=True)
+            self.assertNotIn("@leaver", html, path)
+
+        with app.app_context():
+            self.assertFalse(User.authenticate("leaver", "HASHED_PASSWORD"))
+            self.assertIsNotNone(db.session.scalar(
+                select(User).where(User.id == 9001)
+                .execution_options(include_deleted=True)))
+
+    def test_delete_route_purges_in_background(self):
+        self.login(9001)
+        resp = self.client.post("/users/delete")
+        self.assertEqual(resp.status_code, 302)
+        jobs.runner.join()
+
+        self.assertEqual(self.count(User, User.id == 9001), 0)
+        self.assertEqual(self.count(Message, Message.user_id == 9001), 0)
+        self.assertEqual(self.count(Likes), 0)
+        self.assertEqual(self.count(Follows), 0)
+        self.assertEqual(self.count(TimelineEntry,
+                                    TimelineEntry.message_id < 990), 0)
+
+        with app.app_context():
+            friend = db.session.get(User, 9002)
+            self.assertEqual((friend.messages_count, friend.following_count,
+                              friend.followers_count, friend.likes_count),
+                             (1, 0, 0, 0))
+
+    def test_purge_in_batches(self):
+        with app.app_context():
+            deletion.tombstone(db.session.get(User, 9001))
+            db.session.commit()
+
+            # messages 2+2+1, likes 1, follows 1+1 (one each way) + an
+            # empty check, timeline 1, then the user
+            self.assertEqual(deletion.purge_user(9001, batch_size=2), 8)
+            self.assertEqual(self.count(User), 1)
+            self.assertEqual(deletion.purge_pending(), 0)
+
+    def test_purge_pending_command(self):
+        with app.app_context():
+            deletion.tombstone(db.session.get(User, 9001))
+            db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=["purge-deleted-users"])
+        self.assertIn("Purged 1 deleted user(s).", result.output)
+        self.assertEqual(self.count(User), 1)
@@ -0,0 +1,174 @@
+"""Memory-mapped follow graph index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follow_graph.py
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from models import db, User, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import follow_graph
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['QUERY_REPEAT_RAISE'] = True
+
+# 1 follows 2 and 3; 2 follows 3; 4 follows nobody
+FOLLOWS = [(1, 2), (1, 3), (2, 3)]
+
+
+class FollowGraphTestCase(TestCase):
+    """Test building, querying, the delta log and compaction."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid in range(1, 5):
+                db.session.add(User(id=uid, username=f"user{uid}",
+                                    email=f"user{uid}@test.com",
+                                    password="HASHED_PASSWORD"))
+            db.session.flush()
+            db.session.add_all([
+                Follows(user_following_id=follower,
+                        user_being_followed_id=followed)
+                for follower, followed in FOLLOWS])
+            db.session.commit()
+
+            self.tmp = tempfile.mkdtemp()
+            self.path = os.path.join(self.tmp, 'follows.graph')
+            follow_graph.build(db.engine, self.path)
+
+        self.graph = follow_graph.FollowGraph(self.path)
+        self.graph.refresh()
+        app.extensions['follow_graph'] = self.graph
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        del app.extensions['follow_graph']
+        shutil.rmtree(self.tmp)
+
+    def test_queries(self):
+        graph = self.graph
+        self.assertTrue(graph.is_following(1, 3))
+        self.assertFalse(graph.is_following(3, 1))
+        self.assertEqual(list(graph.following(1)), [2, 3])
+        self.assertEqual(list(graph.followers(3)), [1, 2])
+        self.assertEqual(list(graph.following(4)), [])
+        # users newer than the index have no follows in it
+        self.assertEqual(list(graph.followers(99)), [])
+        self.assertEqual(graph.following_count(1), 2)
+        self.assertEqual(graph.followers_count(3), 2)
+
+    def test_models_use_the_index(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.app_context():
+            user1, user3 = db.session.get(User, 1), db.session.get(User, 3)
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                self.assertTrue(user1.is_following(user3))
+                self.assertTrue(user3.is_followed_by(user1))
+                self.assertEqual(user1.following_ids(), {2, 3})
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(statements, [])
+
+    def test_deltas_reach_other_workers(self):
+        # another worker's view of the same files
+        other = follow_graph.FollowGraph(self.path)
+        other.refresh()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 4
+        self.client.post("/users/follow/1")
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+        self.client.post("/users/stop-following/2")
+
+        # the worker that handled the requests sees them at once
+        self.assertTrue(self.graph.is_following(4, 1))
+        self.assertFalse(self.graph.is_following(1, 2))
+
+        self.assertFalse(other.is_following(4, 1))
+        other.refresh()
+        self.assertTrue(other.is_following(4, 1))
+        self.assertFalse(other.is_following(1, 2))
+        self.assertEqual(list(other.following(1)), [3])
+        self.assertEqual(other.following_count(1), 1)
+        self.assertEqual(list(other.followers(1)), [4])
+
+    def test_late_append_logs_the_latest_state(self):
+        # hold back the log append of a follow, as if its worker stalled
+        held = []
+        with patch.object(follow_graph, 'append',
+                          lambda *args: held.append(args) or []):
+            with self.client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 4
+            self.client.post("/users/follow/1")
+
+        # another worker unfollows and logs that first
+        self.client.post("/users/stop-following/1")
+
+        # then the stalled append lands
+        follow_graph.append(*held[0])
+
+        other = follow_graph.FollowGraph(self.path)
+        other.refresh()
+        self.assertFalse(other.is_following(4, 1))
+        self.assertEqual(list(other.followers(1)), [])
+
+    def test_rolled_back_follows_are_not_logged(self):
+        with app.app_context():
+            db.session.add(Follows(user_following_id=4,
+                                   user_being_followed_id=2))
+            db.session.flush()
+            db.session.rollback()
+
+        self.assertEqual(os.path.getsize(self.path + '.log'),
+                         follow_graph.LOG_HEADER.size)
+        self.assertFalse(self.graph.is_following(4, 2))
+
+    def test_compaction(self):
+        with app.app_context():
+            db.session.add(Follows(user_following_id=4,
+                                   user_being_followed_id=3))
+            db.session.commit()
+
+            follow_graph.build(db.engine, self.path)
+
+        # the log is emptied into the new index
+        self.assertEqual(os.path.getsize(self.path + '.log'),
+                         follow_graph.LOG_HEADER.size)
+
+        fresh = follow_graph.FollowGraph(self.path)
+        fresh.refresh()
+        self.assertEqual(list(fresh.followers(3)), [1, 2, 4])
+
+        # a worker still on the old index switches over
+        self.graph.refresh()
+        self.assertEqual(list(self.graph.followers(3)), [1, 2, 4])
+
+        with app.app_context():
+            db.session.delete(db.session.get(Follows, (3, 1)))
+            db.session.commit()
+
+        fresh.refresh()
+        self.assertEqual(list(fresh.followers(3)), [2, 4])
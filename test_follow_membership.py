@@ -0,0 +1,90 @@
+"""Follow-membership lookup tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follow_membership.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class FollowMembershipTestCase(TestCase):
+    """Test is_following/is_followed_by and the per-request ID set."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.viewer_id = 4000
+            db.session.add(User(id=self.viewer_id, username="viewer",
+                                email="viewer@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.add_all([
+                User(id=4000 + i, username=f"card{i}",
+                     email=f"card{i}@test.com", password="HASHED_PASSWORD")
+                for i in range(1, 31)
+            ])
+            db.session.commit()
+
+            # the viewer follows every other card
+            db.session.add_all([
+                Follows(user_being_followed_id=4000 + i,
+                        user_following_id=self.viewer_id)
+                for i in range(1, 31, 2)
+            ])
+            db.session.commit()
+
+            self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.rollback()
+
+    def test_membership(self):
+        with app.app_context():
+            viewer = db.session.get(User, self.viewer_id)
+            followed = db.session.get(User, 4001)
+            unfollowed = db.session.get(User, 4002)
+
+            self.assertTrue(viewer.is_following(followed))
+            self.assertFalse(viewer.is_following(unfollowed))
+            self.assertTrue(followed.is_followed_by(viewer))
+            self.assertFalse(viewer.is_followed_by(followed))
+
+            self.assertEqual(viewer.following_ids(),
+                             {4000 + i for i in range(1, 31, 2)})
+
+    def test_directory_query_count_is_flat(self):
+        with app.app_context():
+            statements = []
+
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                with self.client as c:
+                    with c.session_transaction() as sess:
+                        sess[CURR_USER_KEY] = self.viewer_id
+
+                    resp = c.get("/users")
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+
+            html = resp.get_data(as_text=True)
+            self.assertEqual(html.count("Unfollow"), 15)
+
+            follow_lookups = [s for s in statements if "FROM follows" in s]
+            self.assertEqual(len(follow_lookups), 1)
@@ -0,0 +1,64 @@
+"""CSV generator tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_generator.py
+
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'generator'))
+
+import create_csvs
+import helpers
+
+FILES = ('users.csv', 'messages.csv', 'follows.csv')
+
+
+def frozen_datetime(today):
+    """A `datetime` class whose now()/utcnow() always return `today`."""
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return today
+
+        @classmethod
+        def utcnow(cls):
+            return today
+
+    return FrozenDatetime
+
+
+class GeneratorTestCase(TestCase):
+    """Test that the generator's output depends only on its arguments."""
+
+    def generate(self, today):
+        """Run the generator as if it were `today`; return the files' bytes."""
+
+        with tempfile.TemporaryDirectory() as out:
+            argv = ['create_csvs.py', '--users', '30', '--messages', '200',
+                    '--follows', '100', '--seed', '3', '--out', out]
+            clock = frozen_datetime(today)
+            with patch.object(sys, 'argv', argv), \
+                    patch.object(create_csvs, 'datetime', clock), \
+                    patch.object(helpers, 'datetime', clock):
+                create_csvs.main()
+
+            contents = {}
+            for name in FILES:
+                with open(os.path.join(out, name), 'rb') as f:
+                    contents[name] = f.read()
+            return contents
+
+    def test_same_arguments_same_files(self):
+        first = self.generate(datetime(2025, 3, 1, 12))
+        second = self.generate(datetime(2026, 10, 18, 9))
+
+        self.assertEqual(first, second)
+        self.assertTrue(all(first.values()))
@@ -0,0 +1,148 @@
+"""Bulk message ingest API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ingest.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import select
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import deletion
+import ingest
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+TOKEN = "test-ingest-token"
+ADMIN = {'Authorization': f"Bearer {TOKEN}"}
+
+
+class IngestTestCase(TestCase):
+    """Test validation, insertion, counters and timeline fan-out."""
+
+    def setUp(self):
+        app.config['INGEST_ADMIN_TOKEN'] = TOKEN
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid in (1, 2, 3):
+                db.session.add(User(id=uid, username=f"user{uid}",
+                                    email=f"user{uid}@test.com",
+                                    password="HASHED_PASSWORD"))
+            db.session.flush()
+            # 2 follows 1
+            db.session.add(Follows(user_following_id=2,
+                                   user_being_followed_id=1))
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['INGEST_ADMIN_TOKEN'] = None
+
+    def post(self, messages, headers=None):
+        return self.client.post("/api/messages/bulk",
+                                json={'messages': messages},
+                                headers=headers)
+
+    def test_current_user(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+        resp = self.post([{'text': f"bulk {n}"} for n in range(3)])
+        self.assertEqual(resp.status_code, 201)
+        ids = resp.json['ids']
+        self.assertEqual(len(ids), 3)
+
+        with app.app_context():
+            self.assertEqual(
+                [db.session.get(Message, id).text for id in ids],
+                ["bulk 0", "bulk 1", "bulk 2"])
+            self.assertEqual(db.session.get(User, 1).messages_count, 3)
+
+            # on the author's and the follower's timelines, nobody else's
+            owners = db.session.execute(
+                select(TimelineEntry.owner_id, TimelineEntry.message_id)
+                .order_by(TimelineEntry.owner_id,
+                          TimelineEntry.message_id)).all()
+            self.assertEqual(owners, [(1, id) for id in ids] +
+                                     [(2, id) for id in ids])
+
+    def test_admin_posts_for_many_users(self):
+        resp = self.post([{'text': "one", 'user_id': 1},
+                          {'text': "two", 'user_id': 2},
+                          {'text': "one again", 'user_id': 1}],
+                         headers=ADMIN)
+        self.assertEqual(resp.status_code, 201)
+
+        with app.app_context():
+            authors = [db.session.get(Message, id).user_id
+                       for id in resp.json['ids']]
+            self.assertEqual(authors, [1, 2, 1])
+            self.assertEqual([db.session.get(User, uid).messages_count
+                              for uid in (1, 2, 3)], [2, 1, 0])
+
+    def test_batch_rejected_whole(self):
+        with app.app_context():
+            deletion.tombstone(db.session.get(User, 3))
+            db.session.commit()
+
+        resp = self.post([{'text': "fine", 'user_id': 1},
+                          {'text': "", 'user_id': 1},
+                          {'text': "x" * 141, 'user_id': 2},
+                          {'text': "nobody"},
+                          {'text': "gone", 'user_id': 3},
+                          "not an object"],
+                         headers=ADMIN)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual([error['index'] for error in resp.json['errors']],
+                         [1, 2, 3, 4, 5])
+
+        with app.app_context():
+            self.assertEqual(db.session.scalar(
+                select(db.func.count(Message.id))), 0)
+
+    def test_malformed_user_ids(self):
+        resp = self.post([{'text': "fine", 'user_id': 1},
+                          {'text': "list", 'user_id': [1]},
+                          {'text': "dict", 'user_id': {'id': 1}},
+                          {'text': "bool", 'user_id': True}],
+                         headers=ADMIN)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json['errors'],
+                         [{'index': index, 'error': "user_id is required"}
+                          for index in (1, 2, 3)])
+
+    def test_authorization(self):
+        resp = self.post([{'text': "hi", 'user_id': 1}])
+        self.assertEqual(resp.status_code, 401)
+
+        resp = self.post([{'text': "hi", 'user_id': 1}],
+                         headers={'Authorization': "Bearer wrong"})
+        self.assertEqual(resp.status_code, 401)
+
+        # users can't post for each other
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+        resp = self.post([{'text': "hi", 'user_id': 2}])
+        self.assertEqual(resp.status_code, 400)
+
+    def test_batch_size_limit(self):
+        app.config['INGEST_MAX_BATCH'] = 2
+        try:
+            resp = self.post([{'text': "hi", 'user_id': 1}] * 3,
+                             headers=ADMIN)
+        finally:
+            app.config['INGEST_MAX_BATCH'] = ingest.MAX_BATCH
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json['errors'][0]['index'], None)
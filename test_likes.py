@@ -0,0 +1,145 @@
+"""Like/unlike statement tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_likes.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User, Message, Likes, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import likes
+import timeline
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class LikesTestCase(TestCase):
+    """Test toggling, idempotent and concurrent likes, and liked state."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for i in range(1, 4):
+                db.session.add(User(id=9000 + i, username=f"liker{i}",
+                                    email=f"liker{i}@test.com",
+                                    password="HASHED_PASSWORD"))
+            db.session.add(Message(id=900, text="likable", user_id=9001))
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.rollback()
+
+    def likes_count(self, user_id):
+        db.session.expire_all()
+        return db.session.get(User, user_id).likes_count
+
+    def test_toggle(self):
+        with app.app_context():
+            self.assertEqual(likes.set_liked(9002, 900), 1)
+            self.assertEqual(likes.set_liked(9002, 900), -1)
+            self.assertEqual(likes.set_liked(9002, 900), 1)
+            db.session.commit()
+
+            self.assertEqual(Likes.query.count(), 1)
+            self.assertEqual(self.likes_count(9002), 1)
+
+    def test_like_and_unlike_are_idempotent(self):
+        with app.app_context():
+            self.assertEqual(likes.set_liked(9002, 900, True), 1)
+            self.assertEqual(likes.set_liked(9002, 900, True), 0)
+            db.session.commit()
+            self.assertEqual(self.likes_count(9002), 1)
+
+            self.assertEqual(likes.set_liked(9002, 900, False), -1)
+            self.assertEqual(likes.set_liked(9002, 900, False), 0)
+            db.session.commit()
+            self.assertEqual(self.likes_count(9002), 0)
+
+    def test_many_users_like_one_message(self):
+        with app.app_context():
+            likes.set_liked(9002, 900, True)
+            likes.set_liked(9003, 900, True)
+            db.session.commit()
+
+            self.assertEqual(Likes.query.filter_by(message_id=900).count(), 2)
+
+    def test_missing_message(self):
+        with app.app_context():
+            self.assertEqual(likes.set_liked(9002, 12345, True), 0)
+            db.session.commit()
+            self.assertEqual(self.likes_count(9002), 0)
+
+    def test_concurrent_likes(self):
+        barrier = threading.Barrier(4)
+        results = []
+
+        def click():
+            with app.app_context():
+                barrier.wait()
+                results.append(likes.set_liked(9002, 900, True))
+                db.session.commit()
+
+        threads = [threading.Thread(target=click) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), [0, 0, 0, 1])
+        with app.app_context():
+            self.assertEqual(Likes.query.count(), 1)
+            self.assertEqual(self.likes_count(9002), 1)
+
+    def test_route_double_click(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 9002
+
+        for _ in range(2):
+            resp = self.client.post("/users/add_like/900", data={"like": "1"})
+            self.assertEqual(resp.status_code, 302)
+
+        with app.app_context():
+            self.assertEqual(Likes.query.count(), 1)
+
+    def test_liked_ids_only_covers_given_messages(self):
+        with app.app_context():
+            db.session.add(Message(id=901, text="also likable", user_id=9001))
+            likes.set_liked(9002, 900, True)
+            likes.set_liked(9002, 901, True)
+            db.session.commit()
+
+            self.assertEqual(likes.liked_ids(9002, [900, 902]), {900})
+            self.assertEqual(likes.liked_ids(9002, []), set())
+
+    def test_homepage_marks_liked_messages(self):
+        with app.app_context():
+            db.session.add(Message(id=901, text="not liked", user_id=9001))
+            db.session.flush()
+            likes.set_liked(9002, 900, True)
+            db.session.add(Follows(user_being_followed_id=9001,
+                                   user_following_id=9002))
+            timeline.rebuild(9002)
+            db.session.commit()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 9002
+
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn('action="/users/add_like/900"', html)
+        # the liked message offers an unlike, the other a like
+        liked_form = html[html.index('add_like/900'):]
+        self.assertIn('name="like" value="0"', liked_form[:200])
+        other_form = html[html.index('add_like/901'):]
+        self.assertIn('name="like" value="1"', other_form[:200])
@@ -0,0 +1,90 @@
+"""Bulk CSV loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from loader import load_snapshot
+import timeline
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+def write_snapshot(directory, prefix):
+    """Three users, two messages and a follow, with unique names."""
+
+    with open(f"{directory}/users.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["email", "username", "image_url", "password", "bio",
+                         "header_image_url", "location"])
+        for i in range(1, 4):
+            writer.writerow([f"{prefix}{i}@test.com", f"{prefix}{i}",
+                             "/static/images/default-pic.png",
+                             "HASHED_PASSWORD", "bio", "", "Nowhere"])
+
+    with open(f"{directory}/messages.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["text", "timestamp", "user_id"])
+        writer.writerow(["first", "2020-01-01 10:00:00.000001", 1])
+        writer.writerow(["second", "2020-01-02 10:00:00", 3])
+
+    with open(f"{directory}/follows.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["user_being_followed_id", "user_following_id"])
+        writer.writerow([3, 2])
+
+
+class LoaderTestCase(TestCase):
+    """Test fresh and appending loads with COPY and executemany."""
+
+    def load(self, prefix, **kwargs):
+        with tempfile.TemporaryDirectory() as directory:
+            write_snapshot(directory, prefix)
+            return load_snapshot(directory, batch_size=2,
+                                 progress=lambda line: None, **kwargs)
+
+    def test_fresh_then_append(self):
+        for use_copy in (True, False):
+            with self.subTest(use_copy=use_copy):
+                with app.app_context():
+                    self.assertEqual(self.load("a", use_copy=use_copy),
+                                     {'users': 3, 'messages': 2, 'follows': 1})
+                    self.load("b", append=True, use_copy=use_copy)
+
+                    self.assertEqual(User.query.count(), 6)
+                    self.assertEqual(Message.query.count(), 4)
+
+                    # the appended snapshot's IDs were shifted past the first
+                    b3 = User.query.filter_by(username="b3").one()
+                    b2 = User.query.filter_by(username="b2").one()
+                    self.assertEqual(b3.id, 6)
+                    self.assertEqual(b3.messages_count, 1)
+                    self.assertEqual(b3.followers_count, 1)
+                    self.assertIsNotNone(Follows.query.filter_by(
+                        user_being_followed_id=b3.id,
+                        user_following_id=b2.id).one_or_none())
+
+                    # timelines were rebuilt for the new users
+                    messages, _ = timeline.home_messages(b2.id)
+                    self.assertEqual([m.text for m in messages], ["second"])
+
+                    # the ID sequence moved past the explicit IDs
+                    user = User(username="later", email="later@test.com",
+                                password="HASHED_PASSWORD")
+                    db.session.add(user)
+                    db.session.commit()
+                    self.assertEqual(user.id, 7)
+
+                    db.session.rollback()
+                    db.drop_all()
@@ -7,6 +7,8 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 from app import app
 
+app.config['QUERY_REPEAT_RAISE'] = True
+
 class MessageModelTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
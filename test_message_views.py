@@ -31,6 +31,7 @@ from app import app, CURR_USER_KEY
 # Don't have WTForms use CSRF at all, since it's a pain to test
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['QUERY_REPEAT_RAISE'] = True
 
 
 class MessageViewTestCase(TestCase):
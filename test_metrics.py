@@ -0,0 +1,98 @@
+"""Prometheus metrics endpoint tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+import os
+from unittest import TestCase
+
+from prometheus_client.parser import text_string_to_metric_families
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+def scrape(client):
+    """Samples from /metrics as {(name, sorted labels): value}."""
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.content_type.startswith("text/plain")
+
+    return {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(
+                resp.get_data(as_text=True))
+            for sample in family.samples}
+
+
+def request_count(samples, endpoint, status):
+    key = ('warbler_request_duration_seconds_count',
+           (('endpoint', endpoint), ('method', 'GET'), ('status', str(status))))
+    return samples.get(key, 0)
+
+
+class MetricsTestCase(TestCase):
+    """Test request, in-flight, pool and cache metrics."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add(User(id=8000, username="measured",
+                                email="measured@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def test_request_histograms(self):
+        before = scrape(self.client)
+
+        for _ in range(3):
+            self.client.get("/users/8000")
+        self.client.get("/users/9999")
+        self.client.get("/no-such-page")
+
+        after = scrape(self.client)
+        self.assertEqual(request_count(after, 'users_show', 200)
+                         - request_count(before, 'users_show', 200), 3)
+        self.assertEqual(request_count(after, 'users_show', 404)
+                         - request_count(before, 'users_show', 404), 1)
+        self.assertEqual(request_count(after, 'unmatched', 404)
+                         - request_count(before, 'unmatched', 404), 1)
+
+    def test_in_progress_and_pool(self):
+        self.client.get("/users/8000")
+        samples = scrape(self.client)
+
+        # only the scrape itself is in flight
+        self.assertEqual(samples[('warbler_requests_in_progress',
+                                  (('endpoint', 'users_show'),))], 0)
+        self.assertEqual(samples[('warbler_requests_in_progress',
+                                  (('endpoint', 'metrics'),))], 1)
+
+        self.assertGreater(
+            samples[('warbler_db_pool_checkout_seconds_count', ())], 0)
+
+    def test_user_cache_lookups(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 8000
+
+        # scrape anonymously, so the scrapes don't look up the user
+        before = scrape(app.test_client())
+        # the first request loads the user, the second is served cached
+        self.client.get("/users/8000")
+        self.client.get("/users/8000")
+        after = scrape(app.test_client())
+
+        for result in ('hit', 'miss'):
+            key = ('warbler_user_cache_lookups_total', (('result', result),))
+            self.assertEqual(after[key] - before.get(key, 0), 1, result)
+        self.assertIn(('warbler_user_cache_evictions_total', ()), after)
@@ -0,0 +1,59 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import inspect, text
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import migrations
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class MigrationsTestCase(TestCase):
+    """Test that the migrations alone build the schema the models describe."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            with db.engine.begin() as connection:
+                connection.execute(text(
+                    "DROP TABLE IF EXISTS schema_migrations"))
+
+    def tearDown(self):
+        with app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(text(
+                    "DROP TABLE IF EXISTS schema_migrations"))
+
+    def test_upgrade_empty_database(self):
+        with app.app_context():
+            applied = migrations.upgrade(db.engine, progress=lambda msg: None)
+            self.assertEqual(applied, [m.version for m in migrations.MIGRATIONS])
+
+            inspector = inspect(db.engine)
+            for table in db.metadata.sorted_tables:
+                columns = {c['name'] for c in inspector.get_columns(table.name)}
+                self.assertEqual(columns, set(table.columns.keys()), table.name)
+
+                indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+                self.assertLessEqual({i.name for i in table.indexes}, indexes,
+                                     table.name)
+
+                key = inspector.get_pk_constraint(table.name)
+                self.assertEqual(key['constrained_columns'],
+                                 [c.name for c in table.primary_key], table.name)
+
+            # a second run has nothing to do
+            self.assertEqual(
+                migrations.upgrade(db.engine, progress=lambda msg: None), [])
@@ -0,0 +1,91 @@
+"""N+1 query detector tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_n_plus_one.py
+
+
+import os
+from unittest import TestCase
+
+from flask import Response
+
+from models import db, User, Message, Likes, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from n_plus_one import RepeatedQueryError
+
+# Fail any request that repeats a statement, rather than just logging it.
+# Every test module sets this, so the guard holds however the tests are run.
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class NPlusOneTestCase(TestCase):
+    """Test eager loading on list pages and the repeated-query detector."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.reader_id = 5000
+            db.session.add(User(id=self.reader_id, username="reader",
+                                email="reader@test.com",
+                                password="HASHED_PASSWORD"))
+
+            # one message from each of many authors, all liked by the reader
+            count = app.config['QUERY_REPEAT_THRESHOLD'] * 2
+            for i in range(1, count + 1):
+                db.session.add(User(id=5000 + i, username=f"author{i}",
+                                    email=f"author{i}@test.com",
+                                    password="HASHED_PASSWORD"))
+                db.session.add(Message(id=500 + i, text=f"warble {i}",
+                                       user_id=5000 + i))
+            db.session.commit()
+
+            for i in range(1, count + 1):
+                db.session.add(Likes(user_id=self.reader_id,
+                                     message_id=500 + i))
+                db.session.add(timeline_entry(self.reader_id, 500 + i))
+            db.session.commit()
+
+            self.count = count
+            self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.rollback()
+
+    def test_list_pages_batch_authors(self):
+        with app.app_context():
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.reader_id
+
+                # these raise RepeatedQueryError if authors load one by one
+                resp = c.get("/")
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("@author1<", resp.get_data(as_text=True))
+
+                resp = c.get(f"/users/{self.reader_id}/likes")
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("@author1<", resp.get_data(as_text=True))
+
+    def test_detector_raises_on_repeats(self):
+        with app.test_request_context("/"):
+            for message_id in range(501, 501 + self.count):
+                db.session.get(Message, message_id).user
+
+            with self.assertRaises(RepeatedQueryError):
+                app.process_response(Response())
+
+
+def timeline_entry(owner_id, message_id):
+    """Timeline row pointing at an already-flushed message."""
+
+    msg = db.session.get(Message, message_id)
+    return TimelineEntry(owner_id=owner_id, message_id=msg.id,
+                         author_id=msg.user_id,
+                         timestamp=msg.timestamp)
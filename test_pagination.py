@@ -0,0 +1,185 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from pagination import (PAGE_SIZE, InvalidCursor, decode_cursor,
+                        encode_cursor, keyset_page)
+import timeline
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class PaginationTestCase(TestCase):
+    """Test cursor paging of profile and home messages."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.user_id = 2001
+            db.session.add(User(id=self.user_id, username="pager",
+                                email="pager@test.com",
+                                password="HASHED_PASSWORD"))
+
+            # a block of messages sharing one timestamp makes sure ties are
+            # broken by id rather than skipped or repeated
+            start = datetime(2024, 1, 1)
+            db.session.add_all([
+                Message(id=i, text=f"warble {i}", user_id=self.user_id,
+                        timestamp=start + timedelta(minutes=min(i, 50)))
+                for i in range(1, PAGE_SIZE + 31)
+            ])
+            db.session.commit()
+
+            self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.rollback()
+
+    def test_cursor_round_trip(self):
+        when = datetime(2024, 5, 6, 7, 8, 9, 123)
+        self.assertEqual(decode_cursor(encode_cursor(when, 42)), (when, 42))
+        self.assertIsNone(decode_cursor(None))
+
+        with self.assertRaises(InvalidCursor):
+            decode_cursor("not-a-cursor")
+
+    def test_pages_cover_every_row_once(self):
+        with app.app_context():
+            query = Message.query.filter(Message.user_id == self.user_id)
+
+            seen = []
+            before = None
+            while True:
+                rows, token = keyset_page(query, Message.timestamp,
+                                          Message.id, before=before,
+                                          per_page=7)
+                seen.extend(row.id for row in rows)
+                if token is None:
+                    break
+                before = decode_cursor(token)
+
+            expected = [m.id for m in query.order_by(
+                Message.timestamp.desc(), Message.id.desc())]
+            self.assertEqual(seen, expected)
+
+    def test_users_show_older_link(self):
+        with app.app_context():
+            with self.client as c:
+                resp = c.get(f"/users/{self.user_id}")
+                html = resp.get_data(as_text=True)
+                self.assertEqual(html.count('class="message-link"'), PAGE_SIZE)
+                self.assertIn('id="older-messages"', html)
+
+                token = html.split("?before=")[1].split('"')[0]
+                resp = c.get(f"/users/{self.user_id}?before={token}")
+                html = resp.get_data(as_text=True)
+                self.assertEqual(html.count('class="message-link"'), 30)
+                self.assertNotIn('id="older-messages"', html)
+
+    def test_bad_cursor(self):
+        with app.app_context():
+            with self.client as c:
+                resp = c.get(f"/users/{self.user_id}?before=garbage")
+                self.assertEqual(resp.status_code, 400)
+
+    def test_home_older_link(self):
+        with app.app_context():
+            timeline.rebuild(self.user_id)
+            db.session.commit()
+
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user_id
+
+                html = c.get("/").get_data(as_text=True)
+                self.assertIn('id="older-messages"', html)
+
+                token = html.split("?before=")[1].split('"')[0]
+                html = c.get(f"/?before={token}").get_data(as_text=True)
+                self.assertIn("warble 1<", html)
+                self.assertNotIn('id="older-messages"', html)
+
+    def test_followers_pages(self):
+        with app.app_context():
+            # followers sharing a follow time are ordered by id
+            start = datetime(2024, 1, 1)
+            db.session.add_all([
+                User(id=i, username=f"fan{i}", email=f"fan{i}@test.com",
+                     password="HASHED_PASSWORD")
+                for i in range(3001, 3001 + PAGE_SIZE + 5)])
+            db.session.flush()
+            db.session.add_all([
+                Follows(user_being_followed_id=self.user_id,
+                        user_following_id=i,
+                        created_at=start + timedelta(minutes=min(i - 3000, 20)))
+                for i in range(3001, 3001 + PAGE_SIZE + 5)])
+            db.session.add_all([
+                Follows(user_being_followed_id=i, user_following_id=3001)
+                for i in range(3002, 3001 + PAGE_SIZE + 5)])
+            db.session.commit()
+
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user_id
+
+                html = c.get(f"/users/{self.user_id}/followers").get_data(
+                    as_text=True)
+                self.assertEqual(html.count('class="card user-card"'),
+                                 PAGE_SIZE)
+                self.assertLess(html.index("@fan3104"), html.index("@fan3020"))
+                self.assertLess(html.index("@fan3020"), html.index("@fan3019"))
+
+                token = html.split("?before=")[1].split('"')[0]
+                html = c.get(f"/users/{self.user_id}/followers?before={token}"
+                             ).get_data(as_text=True)
+                self.assertEqual(html.count('class="card user-card"'), 5)
+                self.assertNotIn('id="older-followers"', html)
+
+                html = c.get(f"/users/{self.user_id}/following").get_data(
+                    as_text=True)
+                self.assertNotIn("@fan", html)
+
+                # and the other way round, one page at a time
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 3001
+
+                html = c.get("/users/3001/following").get_data(as_text=True)
+                self.assertEqual(html.count('class="card user-card"'),
+                                 PAGE_SIZE)
+                self.assertIn('id="older-following"', html)
+
+    def test_likes_in_order_given(self):
+        with app.app_context():
+            # liked oldest message last, so it's listed first
+            start = datetime(2024, 2, 1)
+            for n, message_id in enumerate((PAGE_SIZE + 30, 1, 2)):
+                db.session.add(Likes(user_id=self.user_id,
+                                     message_id=message_id,
+                                     created_at=start + timedelta(days=-n)))
+            db.session.commit()
+
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user_id
+
+                html = c.get(f"/users/{self.user_id}/likes").get_data(
+                    as_text=True)
+                positions = [html.index(f"warble {i}<")
+                             for i in (PAGE_SIZE + 30, 1, 2)]
+                self.assertEqual(positions, sorted(positions))
+                self.assertNotIn('id="older-likes"', html)
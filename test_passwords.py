@@ -0,0 +1,80 @@
+"""Password hashing service tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from passwords import PasswordHasher, hasher
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing inline and through the process pool."""
+
+    def test_pool_and_inline_agree(self):
+        inline = PasswordHasher(rounds=4, workers=0)
+        pooled = PasswordHasher(rounds=4, workers=2)
+        try:
+            for make, check in ((inline, pooled), (pooled, inline)):
+                hashed = make.hash_password("s3cret!")
+                self.assertTrue(hashed.startswith("$2b$04$"))
+                self.assertTrue(check.check_password(hashed, "s3cret!"))
+                self.assertFalse(check.check_password(hashed, "wrong"))
+        finally:
+            pooled.shutdown()
+
+    def test_empty_password(self):
+        with self.assertRaises(ValueError):
+            PasswordHasher(rounds=4).hash_password("")
+
+    def test_needs_rehash(self):
+        h = PasswordHasher(rounds=5)
+        self.assertFalse(h.needs_rehash(h.hash_password("password")))
+        self.assertTrue(h.needs_rehash(
+            PasswordHasher(rounds=4).hash_password("password")))
+        self.assertTrue(h.needs_rehash("not-a-hash"))
+
+
+class RehashOnLoginTestCase(TestCase):
+    """Test that logging in upgrades hashes made at an old cost."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            old = PasswordHasher(rounds=4).hash_password("password")
+            db.session.add(User(id=8000, username="oldhash",
+                                email="oldhash@test.com", password=old))
+            db.session.commit()
+
+        self.rounds = hasher.rounds
+        hasher.rounds = 5
+        self.client = app.test_client()
+
+    def tearDown(self):
+        hasher.rounds = self.rounds
+        with app.app_context():
+            db.session.rollback()
+
+    def test_login_rehashes(self):
+        with app.app_context():
+            resp = self.client.post("/login", data={"username": "oldhash",
+                                                    "password": "password"})
+            self.assertEqual(resp.status_code, 302)
+
+            user = db.session.get(User, 8000)
+            db.session.refresh(user)
+            self.assertTrue(user.password.startswith("$2b$05$"))
+            self.assertTrue(User.authenticate("oldhash", "password"))
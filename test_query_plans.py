@@ -0,0 +1,153 @@
+"""Query plan regression tests for the hot read paths."""
+
+# run these tests like:
+#
+#    python -m unittest test_query_plans.py
+
+
+import json
+import os
+from unittest import TestCase
+
+from sqlalchemy import event, text
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+NUM_USERS = 20000
+MESSAGES_PER_USER = 5
+FOLLOWS_PER_USER = 10
+LIKES_PER_USER = 5
+TIMELINE_PER_USER = 10
+
+VIEWER_ID = 42
+
+# tables big enough in production that a sequential scan is a bug
+BIG_TABLES = {'users', 'messages', 'follows', 'likes', 'timeline_entries'}
+
+SEED_SQL = [
+    f"""INSERT INTO users (id, email, username, password)
+        SELECT i, 'user' || i || '@test.com', 'name' || i, 'HASHED_PASSWORD'
+        FROM generate_series(1, {NUM_USERS}) i""",
+    f"""INSERT INTO messages (id, text, timestamp, user_id)
+        SELECT i, 'warble ' || i,
+               timestamp '2024-01-01' + i * interval '1 minute',
+               i % {NUM_USERS} + 1
+        FROM generate_series(1, {NUM_USERS * MESSAGES_PER_USER}) i""",
+    f"""INSERT INTO follows (user_being_followed_id, user_following_id)
+        SELECT (u + k * 97) % {NUM_USERS} + 1, u
+        FROM generate_series(1, {NUM_USERS}) u,
+             generate_series(1, {FOLLOWS_PER_USER}) k""",
+    f"""INSERT INTO likes (user_id, message_id)
+        SELECT u, (u * 31 + k * 1009) % {NUM_USERS * MESSAGES_PER_USER} + 1
+        FROM generate_series(1, {NUM_USERS}) u,
+             generate_series(1, {LIKES_PER_USER}) k""",
+    f"""INSERT INTO timeline_entries (owner_id, message_id, author_id, timestamp)
+        SELECT u, m.id, m.user_id, m.timestamp
+        FROM generate_series(1, {NUM_USERS}) u
+        JOIN messages m ON m.id BETWEEN u * 7 + 1 AND u * 7 + {TIMELINE_PER_USER}""",
+    f"""UPDATE users SET
+        messages_count = {MESSAGES_PER_USER},
+        following_count = {FOLLOWS_PER_USER},
+        followers_count = {FOLLOWS_PER_USER},
+        likes_count = {LIKES_PER_USER}""",
+    "SELECT setval(pg_get_serial_sequence('users', 'id'), "
+    "(SELECT max(id) FROM users))",
+    "SELECT setval(pg_get_serial_sequence('messages', 'id'), "
+    "(SELECT max(id) FROM messages))",
+]
+
+
+def seq_scans(plan):
+    """Relations a JSON EXPLAIN plan reads with a sequential scan."""
+
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+class QueryPlanTestCase(TestCase):
+    """EXPLAIN every query the hot pages send, and fail on seq scans.
+
+    The dataset is large enough that, with fresh statistics, the planner
+    only scans a whole table when no index can serve the query.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            for sql in SEED_SQL:
+                db.session.execute(text(sql))
+            db.session.commit()
+
+            with db.engine.connect() as connection:
+                connection.execute(text("ANALYZE"))
+                connection.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            db.drop_all()
+
+    def capture(self, paths):
+        """The (statement, parameters) of every SELECT these GETs send."""
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+                statements.append((statement, parameters))
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = VIEWER_ID
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                for path in paths:
+                    resp = client.get(path)
+                    self.assertEqual(resp.status_code, 200, path)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        return statements
+
+    def assert_no_seq_scans(self, paths):
+        statements = self.capture(paths)
+        self.assertTrue(statements)
+
+        with app.app_context():
+            with db.engine.connect() as connection:
+                cursor = connection.connection.cursor()
+                for statement, parameters in statements:
+                    cursor.execute("EXPLAIN (FORMAT JSON) " + statement,
+                                   parameters)
+                    (plan,), = cursor.fetchall()
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    scans = seq_scans(plan[0]['Plan'])
+                    self.assertFalse(BIG_TABLES.intersection(scans),
+                                     f"sequential scan of {scans}:\n{statement}")
+
+    def test_homepage(self):
+        self.assert_no_seq_scans(["/"])
+
+    def test_profile_pages(self):
+        self.assert_no_seq_scans([f"/users/{VIEWER_ID}",
+                                  f"/users/{VIEWER_ID}/following",
+                                  f"/users/{VIEWER_ID}/followers",
+                                  f"/users/{VIEWER_ID}/likes"])
+
+    def test_directory_and_message(self):
+        self.assert_no_seq_scans(["/users", "/users?q=name12", "/messages/500"])
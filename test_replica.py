@@ -0,0 +1,87 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replica.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine, event
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import replica
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class ReplicaTestCase(TestCase):
+    """Test which engine read-only and writing requests use."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            db.session.add(User(id=8001, username="reader",
+                                email="reader@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.flush()
+            db.session.add(Message(id=800, text="replicated", user_id=8001))
+            db.session.commit()
+
+            # a second engine on the same database stands in for the replica;
+            # routing is told apart by which engine ran the statements
+            self.replica = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+            db.engines[replica.REPLICA_BIND] = self.replica
+
+        self.replica_sql = []
+        event.listen(self.replica, 'before_cursor_execute', self.record)
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 8001
+
+    def tearDown(self):
+        with app.app_context():
+            del db.engines[replica.REPLICA_BIND]
+        self.replica.dispose()
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.replica_sql.append(statement)
+
+    def test_read_only_pages_use_replica(self):
+        resp = self.client.get("/messages/800")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("replicated", resp.get_data(as_text=True))
+        self.assertTrue(self.replica_sql)
+        self.assertTrue(all(sql.lstrip().startswith("SELECT")
+                            for sql in self.replica_sql))
+
+    def test_other_pages_use_primary(self):
+        resp = self.client.get("/messages/new")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.replica_sql, [])
+
+    def test_read_your_writes_after_post(self):
+        resp = self.client.post("/messages/new", data={"text": "fresh"})
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.replica_sql, [])
+
+        # pinned to the primary right after posting
+        resp = self.client.get("/users/8001")
+        self.assertIn("fresh", resp.get_data(as_text=True))
+        self.assertEqual(self.replica_sql, [])
+
+        # and back on the replica once the pin expires
+        with self.client.session_transaction() as sess:
+            sess[replica.PIN_KEY] = 0
+        self.client.get("/users/8001")
+        self.assertTrue(self.replica_sql)
@@ -0,0 +1,125 @@
+"""User search and directory tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import search
+from pagination import pack_token
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+USERNAMES = ["tucker_diane", "old_tucker", "tuck", "Tuckerman", "abc",
+             "efg", "tuc"]
+
+
+def assert_ranked(test, names):
+    """Exact match, then username prefixes, then other word prefixes."""
+
+    # order within a rank follows the database collation
+    test.assertEqual(names[0], "tuck")
+    test.assertEqual(set(names[1:3]), {"Tuckerman", "tucker_diane"})
+    test.assertEqual(names[3:], ["old_tucker"])
+
+
+def make_users():
+    return [User(id=6000 + i, username=name, email=f"{name}@test.com",
+                 password="HASHED_PASSWORD")
+            for i, name in enumerate(USERNAMES)]
+
+
+class SearchTestCase(TestCase):
+    """Test the indexed, keyset-paginated directory."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add_all(make_users())
+            db.session.commit()
+
+            self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.rollback()
+
+    def test_relevance_order(self):
+        with app.app_context():
+            users, token = search.directory_page(db.session, q="tuck")
+            assert_ranked(self, [u.username for u in users])
+            self.assertIsNone(token)
+
+    def test_pages_walk_whole_result(self):
+        with app.app_context():
+            for q in (None, "tuck"):
+                names = []
+                token = None
+                while True:
+                    users, token = search.directory_page(
+                        db.session, q=q, after=token, per_page=2)
+                    names.extend(u.username for u in users)
+                    if token is None:
+                        break
+
+                full, _ = search.directory_page(db.session, q=q)
+                self.assertEqual(names, [u.username for u in full])
+
+    def test_unsearchable_query(self):
+        with app.app_context():
+            resp = self.client.get("/users?q=%25%25")
+            self.assertIn("Sorry, no users found", str(resp.data))
+
+    def test_more_users_link(self):
+        with app.app_context():
+            resp = self.client.get("/users?q=tuck")
+            self.assertNotIn('id="more-users"', str(resp.data))
+
+            resp = self.client.get("/users?after=garbage")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_tampered_tokens(self):
+        # well-formed tokens whose values have the wrong types
+        for q, position in (("tuck", ["x", "y"]), ("tuck", [True, "tuck"]),
+                            (None, [{"a": 1}]), (None, [1])):
+            token = pack_token(position)
+            resp = self.client.get("/users", query_string={'q': q,
+                                                           'after': token})
+            self.assertEqual(resp.status_code, 400, (q, position))
+
+
+class SQLiteSearchTestCase(TestCase):
+    """The same search against SQLite's FTS5 index."""
+
+    def test_fts_search(self):
+        engine = create_engine("sqlite://")
+        db.metadata.create_all(engine)
+
+        with Session(engine) as session:
+            session.add_all(make_users())
+            session.commit()
+
+            users, _ = search.directory_page(session, q="tuck")
+            assert_ranked(self, [u.username for u in users])
+
+            # renames are picked up by the sync triggers
+            user = session.get(User, 6004)
+            user.username = "tuckshop"
+            session.commit()
+
+            users, _ = search.directory_page(session, q="tucks")
+            self.assertEqual([u.username for u in users], ["tuckshop"])
+
+        db.metadata.drop_all(engine)
@@ -0,0 +1,75 @@
+"""Per-request SQL timing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_sql_timing.py
+
+
+import os
+import re
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class SQLTimingTestCase(TestCase):
+    """Test the Server-Timing header and the slow-request log."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            db.session.add(User(id=7000, username="timed",
+                                email="timed@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.add(Message(id=700, text="tick", user_id=7000))
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['SLOW_REQUEST_MS'] = 500
+        app.config['SERVER_TIMING_ENABLED'] = True
+
+    def test_server_timing_header(self):
+        resp = self.client.get("/users/7000")
+        self.assertEqual(resp.status_code, 200)
+
+        header = resp.headers['Server-Timing']
+        match = re.match(r'sql;dur=[\d.]+;desc="(\d+) statements, (\d+) rows", '
+                         r'app;dur=[\d.]+$', header)
+        self.assertIsNotNone(match, header)
+        statements, rows = map(int, match.groups())
+        self.assertGreaterEqual(statements, 2)
+        self.assertGreaterEqual(rows, 2)
+
+    def test_no_sql_for_anon_home(self):
+        resp = self.client.get("/")
+        self.assertIn('sql;dur=0.00;desc="0 statements, 0 rows"',
+                      resp.headers['Server-Timing'])
+
+    def test_header_can_be_disabled(self):
+        app.config['SERVER_TIMING_ENABLED'] = False
+        resp = self.client.get("/users/7000")
+        self.assertNotIn('Server-Timing', resp.headers)
+
+    def test_slow_request_logs_statements(self):
+        app.config['SLOW_REQUEST_MS'] = 0
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 7000
+
+        with self.assertLogs('sql_timing', 'WARNING') as logs:
+            self.client.get("/users/7000")
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("slow request GET /users/7000 (users_show)",
+                      logs.output[0])
+        self.assertIn("FROM messages", logs.output[0])
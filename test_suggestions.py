@@ -0,0 +1,95 @@
+"""Friends-of-friends follow suggestion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggestions.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Follows, FollowSuggestion
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import suggestions
+
+app.config['QUERY_REPEAT_RAISE'] = True
+
+# who follows whom: 1 follows 2 and 3, who both follow 4; 3 also follows 5
+FOLLOWS = [(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (2, 1), (4, 6)]
+
+
+class SuggestionsTestCase(TestCase):
+    """Test the batch job and the homepage sidebar that reads it."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid in range(1, 8):
+                db.session.add(User(id=uid, username=f"user{uid}",
+                                    email=f"user{uid}@test.com",
+                                    password="HASHED_PASSWORD"))
+            db.session.flush()
+            db.session.add_all([
+                Follows(user_following_id=follower,
+                        user_being_followed_id=followed)
+                for follower, followed in FOLLOWS])
+            db.session.commit()
+
+    def stored(self):
+        with app.app_context():
+            return [(s.user_id, s.rank, s.suggested_id, s.mutuals)
+                    for s in FollowSuggestion.query.order_by(
+                        FollowSuggestion.user_id, FollowSuggestion.rank)]
+
+    def test_build(self):
+        with app.app_context():
+            # small blocks exercise the block boundaries
+            written = suggestions.build(block_size=2, progress=lambda msg: None)
+
+        expected = [
+            # two of user 1's follows follow 4; 1 is never suggested itself
+            (1, 0, 4, 2),
+            (1, 1, 5, 1),
+            # 2 already follows 1, who follows 3
+            (2, 0, 3, 1),
+            (2, 1, 6, 1),
+            (3, 0, 6, 1),
+        ]
+        self.assertEqual(self.stored(), expected)
+        self.assertEqual(written, len(expected))
+
+        # a rerun replaces rather than adds to them
+        with app.app_context():
+            db.session.execute(db.delete(Follows).where(
+                Follows.user_following_id == 3))
+            db.session.commit()
+            suggestions.build(per_user=1, progress=lambda msg: None)
+
+        self.assertEqual(self.stored(), [(1, 0, 4, 1), (2, 0, 3, 1)])
+
+    def test_homepage_sidebar(self):
+        with app.app_context():
+            suggestions.build(progress=lambda msg: None)
+
+            # followed since the job ran
+            db.session.add(Follows(user_following_id=1,
+                                   user_being_followed_id=5))
+            db.session.commit()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+        html = client.get("/").get_data(as_text=True)
+        self.assertIn('id="who-to-follow"', html)
+        self.assertIn('action="/users/follow/4"', html)
+        self.assertNotIn('action="/users/follow/5"', html)
+
+    def test_command(self):
+        result = app.test_cli_runner().invoke(args=["suggest-follows"])
+        self.assertIn("Wrote 5 suggestion(s).", result.output)
@@ -0,0 +1,273 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from pagination import decode_cursor
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out-on-write home timelines."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            self.reader_id = 1001
+            self.author_id = 1002
+
+            db.session.add_all([
+                User(id=self.reader_id, username="reader",
+                     email="reader@test.com", password="HASHED_PASSWORD"),
+                User(id=self.author_id, username="author",
+                     email="author@test.com", password="HASHED_PASSWORD"),
+            ])
+            db.session.commit()
+
+            self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def timeline_ids(self, user_id):
+        messages, _ = timeline.home_messages(user_id)
+        return [msg.id for msg in messages]
+
+    def test_post_fans_out_to_followers(self):
+        with app.app_context():
+            with self.client as c:
+                self.login(c, self.reader_id)
+                c.post(f"/users/follow/{self.author_id}")
+
+                self.login(c, self.author_id)
+                c.post("/messages/new", data={"text": "fan me out"})
+
+            msg = Message.query.filter_by(text="fan me out").one()
+            self.assertEqual(self.timeline_ids(self.reader_id), [msg.id])
+            self.assertEqual(self.timeline_ids(self.author_id), [msg.id])
+
+            with self.client as c:
+                self.login(c, self.reader_id)
+                resp = c.get("/")
+                self.assertIn("fan me out", str(resp.data))
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        with app.app_context():
+            db.session.add(Message(id=50, text="old warble",
+                                   user_id=self.author_id))
+            db.session.commit()
+
+            with self.client as c:
+                self.login(c, self.reader_id)
+                c.post(f"/users/follow/{self.author_id}")
+                self.assertEqual(self.timeline_ids(self.reader_id), [50])
+
+                c.post(f"/users/stop-following/{self.author_id}")
+                self.assertEqual(self.timeline_ids(self.reader_id), [])
+
+    def test_delete_removes_from_timelines(self):
+        with app.app_context():
+            with self.client as c:
+                self.login(c, self.reader_id)
+                c.post(f"/users/follow/{self.author_id}")
+
+                self.login(c, self.author_id)
+                c.post("/messages/new", data={"text": "short-lived"})
+                msg = Message.query.filter_by(text="short-lived").one()
+
+                c.post(f"/messages/{msg.id}/delete")
+
+            self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_timeline_is_bounded(self):
+        with app.app_context():
+            db.session.add_all([
+                Message(id=i, text=f"warble {i}", user_id=self.author_id)
+                for i in range(1, timeline.TIMELINE_LENGTH + 6)
+            ])
+            db.session.commit()
+
+            db.session.add(Follows(user_being_followed_id=self.author_id,
+                                   user_following_id=self.reader_id))
+            db.session.flush()
+            timeline.add_follow(self.reader_id, self.author_id)
+            db.session.commit()
+
+            count = TimelineEntry.query.filter_by(
+                owner_id=self.reader_id).count()
+            self.assertEqual(count, timeline.TIMELINE_LENGTH)
+
+    def test_trim_keeps_the_newest_entries(self):
+        with app.app_context():
+            with self.client as c:
+                self.login(c, self.reader_id)
+                c.post(f"/users/follow/{self.author_id}")
+
+                self.login(c, self.author_id)
+                with patch.object(timeline, 'TIMELINE_LENGTH', 3):
+                    for n in range(5):
+                        c.post("/messages/new", data={"text": f"post {n}"})
+
+            newest = [msg.id for msg in Message.query.order_by(
+                Message.timestamp.desc(), Message.id.desc()).limit(3)]
+
+            # posting doesn't trim; the job does
+            self.assertEqual(TimelineEntry.query.count(), 10)
+
+            with patch.object(timeline, 'TIMELINE_LENGTH', 3):
+                result = app.test_cli_runner().invoke(
+                    args=["trim-timelines"])
+            self.assertIn("Trimmed 2 timeline(s).", result.output)
+
+            for owner_id in (self.reader_id, self.author_id):
+                kept = [entry.message_id for entry in TimelineEntry.query
+                        .filter_by(owner_id=owner_id)
+                        .order_by(TimelineEntry.timestamp.desc(),
+                                  TimelineEntry.message_id.desc())]
+                self.assertEqual(kept, newest)
+
+    def walk(self, user_id, per_page):
+        """Every message ID on a user's home timeline, page by page."""
+
+        ids = []
+        before = None
+        while True:
+            messages, token = timeline.home_messages(
+                user_id, before=before, per_page=per_page)
+            ids.extend(msg.id for msg in messages)
+            if token is None:
+                return ids
+            before = decode_cursor(token)
+
+    def test_pages_continue_past_the_window(self):
+        with app.app_context():
+            db.session.add(Follows(user_being_followed_id=self.author_id,
+                                   user_following_id=self.reader_id))
+            db.session.add_all([
+                Message(id=i, text=f"warble {i}", user_id=self.author_id,
+                        timestamp=datetime(2024, 1, 1, 0, i))
+                for i in range(1, 10)
+            ])
+            db.session.commit()
+
+            with patch.object(timeline, 'TIMELINE_LENGTH', 4):
+                timeline.rebuild(self.reader_id)
+                db.session.commit()
+
+                # pages that end exactly at, and straddle, the window's end
+                for per_page in (2, 3):
+                    self.assertEqual(self.walk(self.reader_id, per_page),
+                                     list(range(9, 0, -1)), per_page)
+
+    def test_pages_continue_after_the_window_shrinks(self):
+        with app.app_context():
+            db.session.add(User(id=1003, username="other",
+                                email="other@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.flush()
+            db.session.add_all([
+                Follows(user_being_followed_id=self.author_id,
+                        user_following_id=self.reader_id),
+                Follows(user_being_followed_id=1003,
+                        user_following_id=self.reader_id),
+            ])
+            db.session.add_all([
+                Message(id=i, text=f"warble {i}",
+                        user_id=1003 if i % 5 == 0 else self.author_id,
+                        timestamp=datetime(2024, 1, 1, 0, i))
+                for i in range(1, 14)
+            ])
+            db.session.commit()
+
+            with patch.object(timeline, 'TIMELINE_LENGTH', 4):
+                timeline.rebuild(self.reader_id)
+                db.session.commit()
+
+                # a delete and an unfollow leave the stored window short
+                timeline.remove_message(13)
+                db.session.delete(db.session.get(Message, 13))
+                timeline.remove_follow(self.reader_id, 1003)
+                db.session.delete(db.session.get(Follows,
+                                                 (1003, self.reader_id)))
+                db.session.commit()
+
+                expected = [i for i in range(12, 0, -1) if i % 5]
+                for per_page in (2, 3):
+                    self.assertEqual(self.walk(self.reader_id, per_page),
+                                     expected, per_page)
+
+    def test_rebuild_blocks(self):
+        with app.app_context():
+            db.session.add(User(id=1003, username="other",
+                                email="other@test.com",
+                                password="HASHED_PASSWORD"))
+            db.session.flush()
+            # the reader follows both; the author follows nobody
+            db.session.add_all([
+                Follows(user_being_followed_id=self.author_id,
+                        user_following_id=self.reader_id),
+                Follows(user_being_followed_id=1003,
+                        user_following_id=self.reader_id),
+            ])
+            db.session.add_all([
+                Message(id=i, text=f"warble {i}",
+                        user_id=1003 if i % 2 else self.author_id,
+                        timestamp=datetime(2024, 1, 1, 0, i))
+                for i in range(1, 10)
+            ])
+            db.session.commit()
+
+            with patch.object(timeline, 'TIMELINE_LENGTH', 4):
+                progress = []
+                rebuilt = timeline.rebuild_blocks(
+                    [self.reader_id, self.author_id, 1003], block_size=2,
+                    progress=progress.append)
+
+            self.assertEqual(rebuilt, 3)
+            self.assertEqual(progress, [2, 3])
+            stored = {}
+            for entry in TimelineEntry.query.order_by(
+                    TimelineEntry.timestamp.desc()):
+                stored.setdefault(entry.owner_id, []).append(entry.message_id)
+            self.assertEqual(stored, {self.reader_id: [9, 8, 7, 6],
+                                      self.author_id: [8, 6, 4, 2],
+                                      1003: [9, 7, 5, 3]})
+
+    def test_rebuild(self):
+        with app.app_context():
+            db.session.add_all([
+                Follows(user_being_followed_id=self.author_id,
+                        user_following_id=self.reader_id),
+                Message(id=60, text="seeded warble", user_id=self.author_id),
+            ])
+            db.session.commit()
+
+            # rows written straight to the DB leave the timeline cold
+            self.assertEqual(self.timeline_ids(self.reader_id), [])
+
+            result = app.test_cli_runner().invoke(
+                args=["rebuild-timelines", "--user-id", str(self.reader_id)])
+            self.assertIn("Rebuilt 1 timeline(s).", result.output)
+            self.assertEqual(self.timeline_ids(self.reader_id), [60])
@@ -0,0 +1,153 @@
+"""Current-user cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_user_cache.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from user_cache import UserCache, user_cache
+import jobs
+import user_cache as user_cache_module
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['QUERY_REPEAT_RAISE'] = True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class UserCacheUnitTestCase(TestCase):
+    """Test the LRU/TTL bookkeeping on its own."""
+
+    def test_ttl_and_stats(self):
+        clock = FakeClock()
+        cache = UserCache(maxsize=10, ttl=5, clock=clock)
+
+        self.assertIsNone(cache.get(1))
+        cache.put(1, {'id': 1})
+        self.assertEqual(cache.get(1), {'id': 1})
+
+        clock.now = 6
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2,
+                                         'evictions': 0, 'size': 0})
+
+    def test_lru_eviction(self):
+        cache = UserCache(maxsize=2)
+        cache.put(1, {'id': 1})
+        cache.put(2, {'id': 2})
+        cache.get(1)
+        cache.put(3, {'id': 3})
+
+        self.assertIsNone(cache.get(2))
+        self.assertIsNotNone(cache.get(1))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class UserCacheViewTestCase(TestCase):
+    """Test add_user_to_g against the cache."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            user = User.signup("cached", "cached@test.com", "password", None)
+            user.id = 7000
+            db.session.commit()
+
+            self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.rollback()
+
+    def user_selects(self, path):
+        """GET `path` as the test user; return SELECTs that hit users."""
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            if statement.startswith("SELECT") and "FROM users" in statement:
+                statements.append(statement)
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                with self.client as c:
+                    with c.session_transaction() as sess:
+                        sess[CURR_USER_KEY] = 7000
+                    resp = c.get(path)
+                    self.assertEqual(resp.status_code, 200)
+                    html = resp.get_data(as_text=True)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+        return statements, html
+
+    def test_second_request_skips_db(self):
+        self.user_selects("/messages/new")
+        selects, html = self.user_selects("/messages/new")
+
+        self.assertEqual(selects, [])
+        self.assertIn('alt="cached"', html)
+
+    def test_profile_edit_invalidates(self):
+        self.user_selects("/messages/new")
+
+        with app.app_context():
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 7000
+                c.post("/users/profile", data={
+                    "username": "cached",
+                    "email": "cached@test.com",
+                    "image_url": "/static/images/new-pic.png",
+                    "password": "password",
+                })
+
+        self.assertIsNone(user_cache.get(7000))
+
+        _, html = self.user_selects("/messages/new")
+        self.assertIn('src="/static/images/new-pic.png"', html)
+
+    def test_delete_reaches_other_workers(self):
+        # another worker's cache, holding a snapshot of the user
+        other = UserCache()
+        with patch.object(user_cache_module, 'user_cache', other):
+            self.user_selects("/messages/new")
+        self.assertIsNotNone(other.get(7000))
+
+        # this worker deletes the account
+        with app.app_context():
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 7000
+                c.post("/users/delete")
+        jobs.runner.join()
+
+        # a session the user still has open elsewhere is logged out there
+        elsewhere = app.test_client()
+        with elsewhere.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 7000
+        with patch.object(user_cache_module, 'user_cache', other):
+            resp = elsewhere.get("/messages/new")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNone(other.get(7000))
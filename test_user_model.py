@@ -19,6 +19,8 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 from app import app
 
+app.config['QUERY_REPEAT_RAISE'] = True
+
 
 class UserModelTestCase(TestCase):
     """Test views for messages."""
@@ -10,6 +10,7 @@ with app.app_context():
     db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['QUERY_REPEAT_RAISE'] = True
 
 class UserViewTestCase(TestCase):
 
@@ -0,0 +1,291 @@
+"""Precomputed home timelines for Warbler.
+
+Every user owns a bounded list of the most recent message IDs from the
+people they follow (plus their own). The list is written when a message is
+posted or deleted and when a follow starts or stops, so the homepage only has
+to read the top of one user's list instead of scanning `messages`. Paging
+past the oldest stored entry falls back to reading `messages` directly.
+
+Posting doesn't trim the lists back to TIMELINE_LENGTH; the `trim()` job
+(`flask trim-timelines`) does that off the request path.
+
+Apart from `trim()`, none of these functions commit; callers commit them
+together with the change that caused them.
+"""
+
+from sqlalchemy import (DateTime, Integer, column, delete, exists, func,
+                        insert, literal, or_, select, true, tuple_,
+                        union_all, values)
+from sqlalchemy.orm import joinedload
+
+from models import db, Follows, Message, TimelineEntry
+from pagination import PAGE_SIZE, encode_cursor, keyset_page
+
+# How many entries we keep per user. Anything older than this falls off the
+# end of the timeline when `trim()` next runs.
+TIMELINE_LENGTH = 800
+
+ENTRY_COLUMNS = ['owner_id', 'message_id', 'author_id', 'timestamp']
+
+
+def _trim(owner_ids):
+    """Drop entries past TIMELINE_LENGTH for the given owners.
+
+    Each owner's cutoff is read off the `(owner_id, timestamp, message_id)`
+    index, so an owner under the limit costs one short index scan and an
+    owner over it only loses the rows past the cutoff.
+    """
+
+    owners = values(column('owner_id', Integer),
+                    name='owners').data([(owner_id,) for owner_id in owner_ids])
+
+    cutoff = (select(TimelineEntry.timestamp, TimelineEntry.message_id)
+              .where(TimelineEntry.owner_id == owners.c.owner_id)
+              .order_by(TimelineEntry.timestamp.desc(),
+                        TimelineEntry.message_id.desc())
+              .offset(TIMELINE_LENGTH)
+              .limit(1)
+              .lateral('cutoff'))
+
+    cutoffs = (select(owners.c.owner_id, cutoff.c.timestamp,
+                      cutoff.c.message_id)
+               .select_from(owners.join(cutoff, true()))
+               .subquery())
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.owner_id == cutoffs.c.owner_id,
+               tuple_(TimelineEntry.timestamp, TimelineEntry.message_id)
+               <= tuple_(cutoffs.c.timestamp, cutoffs.c.message_id)))
+
+
+def trim(block_size=1000, progress=None):
+    """Trim every timeline that has grown past TIMELINE_LENGTH.
+
+    Fan-out doesn't trim, so busy timelines run a little long between runs
+    of this (`flask trim-timelines`). Owners are trimmed and committed in
+    blocks of `block_size`; `progress`, if given, is called with the running
+    count after each block. Returns how many timelines were trimmed.
+    """
+
+    over = db.session.scalars(
+        select(TimelineEntry.owner_id)
+        .group_by(TimelineEntry.owner_id)
+        .having(func.count() > TIMELINE_LENGTH)
+        .order_by(TimelineEntry.owner_id)).all()
+
+    for start in range(0, len(over), block_size):
+        _trim(over[start:start + block_size])
+        db.session.commit()
+        if progress:
+            progress(min(start + block_size, len(over)))
+
+    return len(over)
+
+
+def fan_out_message(msg):
+    """Push a newly flushed message onto its author's and followers' timelines."""
+
+    db.session.add(TimelineEntry(owner_id=msg.user_id,
+                                 message_id=msg.id,
+                                 author_id=msg.user_id,
+                                 timestamp=msg.timestamp))
+
+    followers = select(Follows.user_following_id,
+                       literal(msg.id),
+                       literal(msg.user_id),
+                       literal(msg.timestamp)).where(
+                           Follows.user_being_followed_id == msg.user_id)
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(ENTRY_COLUMNS, followers))
+
+
+def fan_out_messages(messages):
+    """Fan out many new messages with one INSERT.
+
+    `messages` is a list of `(message_id, author_id, timestamp)` rows.
+    """
+
+    if not messages:
+        return
+
+    new = values(column('message_id', Integer),
+                 column('author_id', Integer),
+                 column('timestamp', DateTime),
+                 name='new_messages').data(messages)
+
+    own = select(new.c.author_id, new.c.message_id,
+                 new.c.author_id, new.c.timestamp)
+    followers = (select(Follows.user_following_id, new.c.message_id,
+                        new.c.author_id, new.c.timestamp)
+                 .join(Follows,
+                       Follows.user_being_followed_id == new.c.author_id))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(ENTRY_COLUMNS,
+                                          union_all(own, followers)))
+
+
+def remove_message(message_id):
+    """Take a message off every timeline it was fanned out to."""
+
+    db.session.execute(
+        delete(TimelineEntry).where(TimelineEntry.message_id == message_id))
+
+
+def add_follow(follower_id, followed_id):
+    """Backfill the follower's timeline with the followed user's messages."""
+
+    already_there = exists().where(TimelineEntry.owner_id == follower_id,
+                                   TimelineEntry.message_id == Message.id)
+
+    recent = (select(literal(follower_id),
+                     Message.id,
+                     Message.user_id,
+                     Message.timestamp)
+              .where(Message.user_id == followed_id, ~already_there)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(TIMELINE_LENGTH))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(ENTRY_COLUMNS, recent))
+
+    _trim([follower_id])
+
+
+def remove_follow(follower_id, followed_id):
+    """Drop the unfollowed user's messages from the follower's timeline."""
+
+    db.session.execute(
+        delete(TimelineEntry).where(TimelineEntry.owner_id == follower_id,
+                                    TimelineEntry.author_id == followed_id))
+
+
+def rebuild_many(owner_ids):
+    """Recompute these users' timelines from `messages` and `follows`.
+
+    One statement covers the whole list: each owner/author pair reads at
+    most TIMELINE_LENGTH messages off ix_messages_user_recent, and a window
+    over the owner keeps the newest TIMELINE_LENGTH of those.
+    """
+
+    owner_ids = list(owner_ids)
+
+    db.session.execute(
+        delete(TimelineEntry).where(TimelineEntry.owner_id.in_(owner_ids)))
+
+    owners = values(column('owner_id', Integer),
+                    name='owners').data([(owner_id,) for owner_id in owner_ids])
+
+    authors = union_all(
+        select(owners.c.owner_id, owners.c.owner_id.label('author_id')),
+        select(Follows.user_following_id, Follows.user_being_followed_id)
+        .where(Follows.user_following_id.in_(owner_ids)),
+    ).subquery('authors')
+
+    recent = (select(Message.id, Message.user_id, Message.timestamp)
+              .where(Message.user_id == authors.c.author_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(TIMELINE_LENGTH)
+              .lateral('recent'))
+
+    ranked = (select(authors.c.owner_id, recent.c.id, recent.c.user_id,
+                     recent.c.timestamp,
+                     func.row_number().over(
+                         partition_by=authors.c.owner_id,
+                         order_by=(recent.c.timestamp.desc(),
+                                   recent.c.id.desc()),
+                     ).label('position'))
+              .select_from(authors.join(recent, true()))
+              .subquery())
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(
+            ENTRY_COLUMNS,
+            select(ranked.c.owner_id, ranked.c.id, ranked.c.user_id,
+                   ranked.c.timestamp)
+            .where(ranked.c.position <= TIMELINE_LENGTH)))
+
+
+def rebuild(user_id):
+    """Recompute one user's timeline from `messages` and `follows`.
+
+    Used for cold timelines (e.g. after seeding) or ones that have drifted.
+    """
+
+    rebuild_many([user_id])
+
+
+def rebuild_blocks(owner_ids, block_size=1000, progress=None):
+    """Rebuild many timelines, `block_size` owners to a statement.
+
+    Commits after each block; `progress`, if given, is called with the
+    running count. Returns how many timelines were rebuilt.
+    """
+
+    owner_ids = list(owner_ids)
+
+    for start in range(0, len(owner_ids), block_size):
+        rebuild_many(owner_ids[start:start + block_size])
+        db.session.commit()
+        if progress:
+            progress(min(start + block_size, len(owner_ids)))
+
+    return len(owner_ids)
+
+
+def _pulled(user_id):
+    """The home timeline read straight from `messages`, for pages older than
+    the stored window."""
+
+    # one IN list, so each author's messages come off ix_messages_user_recent
+    authors = union_all(select(literal(user_id)),
+                        select(Follows.user_being_followed_id)
+                        .where(Follows.user_following_id == user_id))
+
+    return (Message.query
+            .filter(Message.user_id.in_(authors))
+            .options(joinedload(Message.user)))
+
+
+def home_messages(user_id, before=None, per_page=PAGE_SIZE):
+    """One page of a user's home timeline, newest first.
+
+    Pages come from the stored timeline while it lasts. Past its oldest
+    entry they carry on with a slower pull query, so scrolling doesn't stop
+    where the timeline was trimmed, however many entries deletes and
+    unfollows have since taken out of it. A timeline with no entries at all
+    is cold (see `rebuild`) and reads as empty.
+
+    Returns `(messages, next_cursor)`; see `pagination.keyset_page`.
+    """
+
+    query = (Message.query
+             .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+             .filter(TimelineEntry.owner_id == user_id)
+             .options(joinedload(Message.user)))
+
+    messages, next_cursor = keyset_page(query,
+                                        TimelineEntry.timestamp,
+                                        TimelineEntry.message_id,
+                                        before=before,
+                                        per_page=per_page)
+
+    if next_cursor is not None or (before is None and not messages):
+        return messages, next_cursor
+
+    # the stored window ran out; continue from where it ended
+    if messages:
+        before = (messages[-1].timestamp, messages[-1].id)
+    older = _pulled(user_id)
+
+    remaining = per_page - len(messages)
+    if not remaining:
+        if older.filter(tuple_(Message.timestamp, Message.id) < before).first():
+            return messages, encode_cursor(*before)
+        return messages, None
+
+    more, next_cursor = keyset_page(older, Message.timestamp, Message.id,
+                                    before=before, per_page=remaining)
+    return messages + more, next_cursor
@@ -0,0 +1,215 @@
+"""Per-worker cache of the logged-in user for `add_user_to_g`.
+
+Every request used to re-read the current user's whole row, password hash
+included. Instead we keep a small LRU of the profile columns templates need,
+with a TTL, and rebuild `g.user` from it without touching the database. The
+counter columns and password are left unloaded, so they are only read (in
+one query) on the pages that actually use them.
+
+Entries are dropped whenever a User is changed or deleted through the ORM
+(so `profile()` and `delete_user()` invalidate their own user), on bulk
+UPDATE/DELETE of users, and when the users table is dropped. Changed users
+are also announced with a NOTIFY on `CHANNEL` when their transaction
+commits. Each worker's cache LISTENs on a connection of its own and polls
+it before every lookup, so a user tombstoned or edited in one worker stops
+being served from the other workers' snapshots on their next request, not
+at the end of the TTL.
+
+Hits, misses and evictions are exported as Prometheus metrics (metrics.py).
+"""
+
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import (Integer, Text, column, event, func, inspect, select,
+                        values)
+from sqlalchemy.orm import Session, load_only, make_transient_to_detached
+
+from models import User, db
+import metrics
+
+CACHED_COLUMNS = ('id', 'username', 'email', 'image_url',
+                  'header_image_url', 'bio', 'location', 'version')
+
+CHANNEL = 'warbler_user_changes'
+
+
+class UserCache:
+    """Thread-safe LRU of `{column: value}` user snapshots with a TTL."""
+
+    def __init__(self, maxsize=1024, ttl=30, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._listener = None
+        self._listener_pid = None
+
+    def get(self, user_id):
+        """Cached snapshot for `user_id`, or None if absent or expired."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, snapshot):
+        """Remember `snapshot`; returns how many entries were evicted."""
+
+        evicted = 0
+        with self._lock:
+            self._entries[user_id] = (self.clock() + self.ttl, snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        return evicted
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def sync(self, engine):
+        """Drop the users other workers have changed since the last call.
+
+        Reads notifications already delivered to our LISTEN connection;
+        it doesn't send a query. Opens the connection on first use in each
+        process, and starts over with an empty cache whenever it has to
+        (re)connect, since anything announced meanwhile was missed.
+        """
+
+        if engine.dialect.name != 'postgresql':
+            return
+
+        with self._lock:
+            if self._listener is None or self._listener_pid != os.getpid():
+                self._entries.clear()
+                self._listener = _listen(engine)
+                self._listener_pid = os.getpid()
+
+            listener = self._listener
+            try:
+                listener.poll()
+            except engine.dialect.dbapi.Error:
+                self._entries.clear()
+                self._listener = None
+                return
+
+            for notify in listener.notifies:
+                if notify.channel == CHANNEL:
+                    self._entries.pop(int(notify.payload), None)
+            listener.notifies.clear()
+
+    def stats(self):
+        """Counters for the metrics endpoint."""
+
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._entries)}
+
+
+user_cache = UserCache()
+
+
+def _listen(engine):
+    """A connection of our own, outside the pool, that LISTENs on CHANNEL."""
+
+    connection = engine.raw_connection()
+    connection.detach()
+    listener = connection.dbapi_connection
+    listener.autocommit = True
+    with listener.cursor() as cursor:
+        cursor.execute(f"LISTEN {CHANNEL}")
+    return listener
+
+
+def init_app(app):
+    """Size the cache from `USER_CACHE_SIZE` and `USER_CACHE_TTL`."""
+
+    user_cache.maxsize = app.config.setdefault('USER_CACHE_SIZE', 1024)
+    user_cache.ttl = app.config.setdefault('USER_CACHE_TTL', 30)
+
+
+def load_user(session, user_id):
+    """The user with `user_id` attached to `session`, or None.
+
+    Served from the cache when possible; otherwise loads just the cached
+    columns and remembers them.
+    """
+
+    key = inspect(User).identity_key_from_primary_key((user_id,))
+    user = session.identity_map.get(key)
+    if user is not None:
+        return user
+
+    user_cache.sync(db.engine)
+    snapshot = user_cache.get(user_id)
+    metrics.USER_CACHE_LOOKUPS.labels(
+        'miss' if snapshot is None else 'hit').inc()
+    if snapshot is not None:
+        user = User(**snapshot)
+        # treat the rebuilt object as an already-loaded row; columns we
+        # didn't cache stay expired and load on first access
+        make_transient_to_detached(user)
+        session.add(user)
+        return user
+
+    user = session.get(User, user_id,
+                       options=[load_only(*(getattr(User, column)
+                                            for column in CACHED_COLUMNS))])
+    if user is not None:
+        metrics.USER_CACHE_EVICTIONS.inc(
+            user_cache.put(user_id, {column: getattr(user, column)
+                                     for column in CACHED_COLUMNS}))
+    return user
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_changed_users(session, flush_context):
+    changed = {obj.id for obj in list(session.dirty) + list(session.deleted)
+               if isinstance(obj, User) and obj.id is not None}
+    if not changed:
+        return
+
+    for user_id in changed:
+        user_cache.invalidate(user_id)
+
+    # tell the other workers; NOTIFY is only delivered if we commit
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        ids = values(column('id', Integer),
+                     name='changed').data([(user_id,) for user_id in changed])
+        connection.execute(select(func.pg_notify(CHANNEL,
+                                                 ids.c.id.cast(Text))))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _invalidate_on_bulk_write(orm_execute_state):
+    if ((orm_execute_state.is_update or orm_execute_state.is_delete)
+            and orm_execute_state.bind_mapper is inspect(User)):
+        user_cache.clear()
+
+
+@event.listens_for(User.__table__, 'after_drop')
+def _invalidate_on_drop(target, connection, **kw):
+    user_cache.clear()